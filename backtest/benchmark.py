@@ -0,0 +1,268 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+import main
+from metrics import objective_score
+from optimizer import optimize
+from strategy_registry import DEFAULT_STRATEGY, load_strategy
+from sweep import expand_grid, run_sweep
+
+# Throughput benchmarks for the backtest engine on synthetic candles, so no CSV is needed.
+#   python benchmark.py --sizes 2000 10000 --output bench.json --baseline bench_baseline.json
+# Every stage is timed on its own and then run once more under tracemalloc for its peak
+# Python/NumPy allocation (tracing slows the code down, so the two are not mixed). Sweep worker
+# processes are not traced, so the sweep's peak only covers the parent.
+#
+# --search N compares the optimizer's TPE and GA searches with the exhaustive grid on N candles:
+# the best objective each has found after a given number of evaluations.
+
+SIZES = (2_000, 10_000, 100_000, 1_000_000)
+STAGES = ('calculate_atr', 'calculate_rsi', 'strategy_run', 'generate_signals',
+          'simulate_positions', 'run_backtest', 'sweep')
+LOOKBACK = 300
+STRATEGY_RUN_WINDOWS = 200   # strat.run is called per candle, so only a sample of windows is timed
+SWEEP_GRID = {'trail_on': [True, False], 'risk_percent': [0.01, 0.03]}
+SEARCH_GRID = {                            # main.py's 160-permutation sweep
+    'trail_on': [True, False],
+    'risk_percent': [0.01, 0.03, 0.05, 0.1],
+    'trail_start': [0.3, 0.5, 0.7, 0.9],
+    'trail_distance': [0.1, 0.25, 0.5, 0.75, 0.9],
+}
+SEARCH_TRIALS = 60
+SEARCH_EVALUATIONS = (10, 20, 40, 60, 160)  # points on the best-so-far curves
+SEARCH_OBJECTIVE = 'profit_factor'
+SEARCH_MIN_TRADES = 20
+
+strat = load_strategy(DEFAULT_STRATEGY)
+
+
+def synthetic_candles(n, seed=0, start_price=1.1, volatility=0.0004):
+    """
+    Random-walk M5 candles with slowly changing drift, so the strategy sees trends and crossovers.
+
+    Returns:
+        DataFrame with time, open, high, low, close (prices rounded to 5 decimals)
+    """
+    rng = np.random.default_rng(seed)
+    drift = 0.2 * volatility * np.sin(np.arange(n) / 500.0)
+    closes = start_price * np.exp(np.cumsum(drift + rng.normal(0, volatility, n)))
+    opens = np.concatenate(([start_price], closes[:-1]))
+    wick_high = np.abs(rng.normal(0, volatility / 2, n)) * closes
+    wick_low = np.abs(rng.normal(0, volatility / 2, n)) * closes
+    return pd.DataFrame({
+        'time': pd.date_range('2020-01-01', periods=n, freq='5min'),
+        'open': opens.round(5),
+        'high': (np.maximum(opens, closes) + wick_high).round(5),
+        'low': (np.minimum(opens, closes) - wick_low).round(5),
+        'close': closes.round(5),
+    })
+
+
+def _measure(fn, track_memory=True, min_seconds=0.2, max_repeats=10):
+    """
+    Best time for fn over repeated calls (fast stages are repeated until min_seconds has passed),
+    and its peak traced allocation in MB from one extra call
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        timings = []
+        while len(timings) < max_repeats and sum(timings) < min_seconds:
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+        peak_mb = None
+        if track_memory:
+            tracemalloc.start()
+            try:
+                fn()
+                peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+            finally:
+                tracemalloc.stop()
+    return min(timings), peak_mb
+
+
+def _stage_functions(candles, workdir):
+    """stage name -> (callable, candles processed per call)"""
+    n = len(candles)
+    sample = np.linspace(200, n - 1, num=min(STRATEGY_RUN_WINDOWS, n - 200), dtype=np.int64)
+    windows = [candles.iloc[max(0, idx - LOOKBACK + 1):idx + 1].to_dict('records') for idx in sample]
+    signal_frame = main.generate_signals(candles, lookback=LOOKBACK, use_cache=False)
+    csv_path = os.path.join(workdir, 'candles.csv')
+
+    def strategy_run():
+        for window in windows:
+            strat.run(window)
+
+    def backtest():
+        main._signal_cache.clear()
+        main.run_backtest(candles=candles, candle_counter=n, trail_on=True,
+                          min_number_of_required_candles_for_strategy=LOOKBACK,
+                          results_directory=os.path.join(workdir, 'results'))
+
+    def sweep():
+        if not os.path.exists(csv_path):
+            candles.to_csv(csv_path, index=False)
+        run_sweep(SWEEP_GRID, candle_counter=n, csv_path=csv_path, lookback=LOOKBACK,
+                  results_directory=os.path.join(workdir, 'sweep'),
+                  store_directory=os.path.join(workdir, 'candle_store'))
+
+    return {
+        'calculate_atr': (lambda: strat.calculate_atr(candles), n),
+        'calculate_rsi': (lambda: strat.calculate_rsi(candles), n),
+        'strategy_run': (strategy_run, len(windows)),
+        'generate_signals': (lambda: main.generate_signals(candles, lookback=LOOKBACK, use_cache=False), n),
+        'simulate_positions': (lambda: main.simulate_positions(candles, signal_frame, trail_on=True), n),
+        'run_backtest': (backtest, n),
+        'sweep': (sweep, n * len(expand_grid(SWEEP_GRID))),
+    }
+
+
+def run_benchmarks(sizes=SIZES, stages=STAGES, seed=0, track_memory=True):
+    """
+    Time every stage at every dataset size.
+
+    Returns:
+        {'meta': environment info, 'results': {size: {stage: {seconds, candles_per_sec, peak_mb}}}}
+        Sizes are string keys so the dict round-trips through JSON unchanged.
+    """
+    report = {
+        'meta': {
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'seed': seed,
+        },
+        'results': {},
+    }
+    for size in sizes:
+        candles = synthetic_candles(size, seed=seed)
+        with tempfile.TemporaryDirectory() as workdir:
+            functions = _stage_functions(candles, workdir)
+            results = {}
+            for stage in stages:
+                fn, processed = functions[stage]
+                seconds, peak_mb = _measure(fn, track_memory)
+                results[stage] = {
+                    'seconds': round(seconds, 6),
+                    'candles_per_sec': round(processed / seconds, 1) if seconds > 0 else None,
+                    'peak_mb': None if peak_mb is None else round(peak_mb, 2),
+                }
+                print(f'{size:>9} candles  {stage:<20} {seconds:10.4f}s  '
+                      f'{results[stage]["candles_per_sec"]:>14} candles/s')
+        report['results'][str(size)] = results
+    return report
+
+
+def _best_after(scores, evaluations=SEARCH_EVALUATIONS):
+    """{n: best score among the first n} for every n in evaluations that the scores reach"""
+    best = np.maximum.accumulate(np.asarray(scores, dtype=float))
+    return {str(n): float(best[n - 1]) for n in evaluations if n <= len(best)}
+
+
+def search_benchmark(size, seed=0, n_trials=SEARCH_TRIALS, max_workers=None):
+    """
+    TPE and GA against the exhaustive grid over SEARCH_GRID, on `size` synthetic candles.
+
+    The grid scores every permutation in expand_grid order, as run_sweep would, in this process.
+    Scores are objective_score of SEARCH_OBJECTIVE with SEARCH_MIN_TRADES (pruned candidates: -inf).
+
+    Returns:
+        {method: {evaluations, best, grid_rank (1 = the grid's best), seconds, best_after: {n: best so far}}}
+    """
+    candles = synthetic_candles(size, seed=seed)
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir, contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        signal_frame = main.generate_signals(candles, lookback=LOOKBACK, use_cache=False)
+        grid_scores = []
+        for params in expand_grid(SEARCH_GRID):
+            trades, balance = main.simulate_positions(candles, signal_frame, **params)
+            metrics = main.calculate_metrics(trades, 850, size)
+            metrics['final_balance'] = round(balance, 2)
+            grid_scores.append(objective_score(metrics, SEARCH_OBJECTIVE, SEARCH_MIN_TRADES))
+        grid_seconds = time.perf_counter() - start
+
+        def summary(scores, seconds):
+            best = max(scores)
+            return {'evaluations': len(scores), 'best': best,
+                    'grid_rank': sum(score > best for score in grid_scores) + 1,
+                    'seconds': round(seconds, 3), 'best_after': _best_after(scores)}
+
+        results['grid'] = summary(grid_scores, grid_seconds)
+        csv_path = os.path.join(workdir, 'candles.csv')
+        candles.to_csv(csv_path, index=False)
+        for method in ('tpe', 'ga'):
+            start = time.perf_counter()
+            search = optimize(SEARCH_GRID, method=method, n_trials=n_trials, candle_counter=size, csv_path=csv_path,
+                              store_directory=os.path.join(workdir, 'candle_store'), lookback=LOOKBACK,
+                              objective=SEARCH_OBJECTIVE, min_trades=SEARCH_MIN_TRADES, seed=seed,
+                              max_workers=max_workers)
+            trials = search['trials']
+            results[method] = summary(trials.loc[~trials['cached'], 'score'].tolist(), time.perf_counter() - start)
+    for method, result in results.items():
+        curve = '  '.join(f'{n}: {best:.3f}' for n, best in result['best_after'].items())
+        print(f'{size:>9} candles  search {method:<5} best {result["best"]:.3f} (grid rank {result["grid_rank"]}) '
+              f'after {result["evaluations"]} evaluations in {result["seconds"]:.2f}s  [{curve}]')
+    return results
+
+
+def compare(report, baseline, tolerance=0.10):
+    """
+    Print each stage's throughput against a baseline report.
+
+    Returns:
+        List of (size, stage, ratio) where throughput fell by more than `tolerance`
+    """
+    regressions = []
+    for size, stages in report['results'].items():
+        for stage, result in stages.items():
+            before = baseline.get('results', {}).get(size, {}).get(stage)
+            if not before or not before.get('candles_per_sec') or not result['candles_per_sec']:
+                continue
+            ratio = result['candles_per_sec'] / before['candles_per_sec']
+            flag = ''
+            if ratio < 1 - tolerance:
+                regressions.append((size, stage, ratio))
+                flag = '  <-- slower'
+            print(f'{size:>9} candles  {stage:<20} {ratio:6.2f}x baseline{flag}')
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Backtest throughput benchmarks')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES))
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help='earlier --output file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10)
+    parser.add_argument('--search', type=int, metavar='CANDLES',
+                        help='also compare TPE/GA with the exhaustive grid on this many candles')
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.sizes, args.stages, args.seed, track_memory=not args.no_memory)
+    if args.search:
+        report['search'] = {str(args.search): search_benchmark(args.search, args.seed)}
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2)
+    print(f'Results written to {args.output}')
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            regressions = compare(report, json.load(file), args.tolerance)
+        if regressions:
+            raise SystemExit(f'{len(regressions)} stage(s) slower than baseline')
@@ -0,0 +1,203 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Candle history converted once from CSV into a columnar .npy layout:
+#   candle_store/<instrument>/<granularity>/ohlc.npy  float64, shape (4, rows): one contiguous row per column
+#   candle_store/<instrument>/<granularity>/time.npy  int64 nanoseconds (UTC), when the CSV has times
+#   candle_store/<instrument>/<granularity>/meta.json
+# Loading memory-maps the files, so only the rows a backtest touches are read from disk. The prices
+# are kept in one 2D array because pandas copies separate same-dtype columns into a single block.
+# Tick CSVs (time plus price, or bid and ask) are stored the same way, as one-price candles
+# (open = high = low = close = price or bid/ask mid) under the 'tick' granularity. Higher
+# timeframes derived from a stored series (timeframes.derive_series) are stored the same way too,
+# as e.g. <instrument>/H1_from_M5.
+STORE_DIRECTORY = 'candle_store'
+PRICE_COLUMNS = ('open', 'high', 'low', 'close')
+
+# Candle length in seconds per granularity (0 for ticks)
+GRANULARITY_SECONDS = {
+    'tick': 0, 'S5': 5, 'S10': 10, 'S15': 15, 'S30': 30,
+    'M1': 60, 'M2': 120, 'M4': 240, 'M5': 300, 'M10': 600, 'M15': 900, 'M30': 1800,
+    'H1': 3600, 'H2': 7200, 'H3': 10800, 'H4': 14400, 'H6': 21600, 'H8': 28800, 'H12': 43200,
+    'D': 86400,
+}
+
+
+def series_directory(instrument, granularity, store_directory=STORE_DIRECTORY):
+    return os.path.join(store_directory, instrument, granularity)
+
+
+def _parse_times(df):
+    """Candle open times as int64 nanoseconds (UTC), or None if the CSV has no time columns"""
+    if 'date' in df.columns and 'time' in df.columns:
+        raw = df['date'].astype(str) + ' ' + df['time'].astype(str)
+    else:
+        column = next((c for c in ('datetime', 'timestamp', 'time', 'date') if c in df.columns), None)
+        if column is None:
+            return None
+        raw = df[column].astype(str)
+    times = pd.to_datetime(raw, utc=True).dt.tz_localize(None)
+    return times.to_numpy().astype('datetime64[ns]').astype(np.int64)
+
+
+def import_csv(csv_path, instrument, granularity, store_directory=STORE_DIRECTORY):
+    """
+    Convert a candle CSV (date, time, open, high, low, close) into the columnar store.
+    A tick CSV (time columns plus price, or bid and ask) is stored as one-price candles.
+
+    Returns:
+        Directory the columns were written to
+    """
+    df = pd.read_csv(csv_path)
+
+    if all(col in df.columns for col in PRICE_COLUMNS):
+        prices = np.vstack([df[col].to_numpy(dtype=np.float64) for col in PRICE_COLUMNS])
+    elif 'price' in df.columns or ('bid' in df.columns and 'ask' in df.columns):
+        if 'price' in df.columns:
+            price = df['price'].to_numpy(dtype=np.float64)
+        else:
+            price = (df['bid'].to_numpy(dtype=np.float64) + df['ask'].to_numpy(dtype=np.float64)) / 2
+        prices = np.vstack([price] * len(PRICE_COLUMNS))
+    else:
+        raise ValueError(f"{csv_path} has neither open/high/low/close nor price or bid/ask columns")
+    times = _parse_times(df)
+    if times is not None and len(times) > 1 and np.any(np.diff(times) < 0):
+        raise ValueError(f"{csv_path} is not sorted by time")
+
+    source = os.stat(csv_path)
+    return write_series(instrument, granularity, prices, times, store_directory, {
+        'source': os.path.abspath(csv_path),
+        'source_size': source.st_size,
+        'source_mtime': source.st_mtime,
+    })
+
+
+def write_series(instrument, granularity, prices, times=None, store_directory=STORE_DIRECTORY, extra_meta=None):
+    """
+    Store a (4, rows) OHLC array and optional int64 ns times as instrument/granularity.
+
+    Returns:
+        Directory the columns were written to
+    """
+    directory = series_directory(instrument, granularity, store_directory)
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, 'ohlc.npy'), prices)
+    if times is not None:
+        np.save(os.path.join(directory, 'time.npy'), times)
+    meta = {
+        'instrument': instrument,
+        'granularity': granularity,
+        'rows': prices.shape[1],
+        'has_time': times is not None,
+        **(extra_meta or {}),
+    }
+    with open(os.path.join(directory, 'meta.json'), 'w', encoding='utf-8') as file:
+        json.dump(meta, file, indent=2)
+    return directory
+
+
+def read_meta(instrument, granularity, store_directory=STORE_DIRECTORY):
+    path = os.path.join(series_directory(instrument, granularity, store_directory), 'meta.json')
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def is_stale(meta, csv_path):
+    """True if csv_path is not the file the store was built from, or has changed since"""
+    if meta is None:
+        return True
+    source = os.stat(csv_path)
+    return (meta['source'] != os.path.abspath(csv_path)
+            or meta['source_size'] != source.st_size
+            or meta['source_mtime'] != source.st_mtime)
+
+
+def _open_series(instrument, granularity, start, end, rows, store_directory, csv_path):
+    """Memory-mapped (prices, times) of a stored series and the (first, stop) rows selected"""
+    meta = read_meta(instrument, granularity, store_directory)
+    if csv_path is not None and os.path.exists(csv_path) and is_stale(meta, csv_path):
+        import_csv(csv_path, instrument, granularity, store_directory)
+        meta = read_meta(instrument, granularity, store_directory)
+    if meta is None:
+        raise FileNotFoundError(
+            f"No stored candles for {instrument} {granularity} in {store_directory}; "
+            f"build them with candle_store.import_csv(csv_path, '{instrument}', '{granularity}')"
+        )
+
+    directory = series_directory(instrument, granularity, store_directory)
+    prices = np.load(os.path.join(directory, 'ohlc.npy'), mmap_mode='r')
+    times = np.load(os.path.join(directory, 'time.npy'), mmap_mode='r') if meta['has_time'] else None
+
+    first, stop = 0, meta['rows']
+    if start is not None or end is not None:
+        if not meta['has_time']:
+            raise ValueError(f"Stored candles for {instrument} {granularity} have no time column")
+        if start is not None:
+            first = int(np.searchsorted(times, pd.Timestamp(start).value, side='left'))
+        if end is not None:
+            stop = int(np.searchsorted(times, pd.Timestamp(end).value, side='left'))
+    if isinstance(rows, tuple):
+        first, stop = first + rows[0], min(stop, first + rows[1])
+    elif rows is not None:
+        first = max(first, stop - rows)
+    return prices, times, first, stop
+
+
+def _frame(prices, times, first, stop):
+    candles = pd.DataFrame(np.asarray(prices[:, first:stop]).T, columns=list(PRICE_COLUMNS), copy=False)
+    if times is not None:
+        candles['time'] = np.asarray(times[first:stop]).view('datetime64[ns]')
+    return candles
+
+
+def load_candles(
+    instrument,
+    granularity='M5',
+    start=None,
+    end=None,
+    rows=None,
+    store_directory=STORE_DIRECTORY,
+    csv_path=None,
+):
+    """
+    Memory-mapped candles for one instrument/granularity.
+
+    Args:
+        start, end: Optional datetime-like bounds on candle time (start inclusive, end exclusive)
+        rows: Keep only the last `rows` candles of the selected range (like DataFrame.tail),
+            or a (first, stop) row range
+        csv_path: CSV to (re)build the store from when it is missing or out of date
+
+    Returns:
+        DataFrame of open/high/low/close (plus time as datetime64 if stored) whose price
+        columns are views onto the memory-mapped file. Treat it as read-only.
+    """
+    prices, times, first, stop = _open_series(instrument, granularity, start, end, rows,
+                                              store_directory, csv_path)
+    return _frame(prices, times, first, stop)
+
+
+def iter_candles(
+    instrument,
+    granularity='M1',
+    start=None,
+    end=None,
+    chunk_rows=1_000_000,
+    store_directory=STORE_DIRECTORY,
+    csv_path=None,
+):
+    """
+    The candles load_candles would return, as consecutive DataFrames of at most chunk_rows rows.
+
+    Only one chunk is read from disk at a time, so years of M1 or tick data can be walked
+    without holding them in memory.
+    """
+    prices, times, first, stop = _open_series(instrument, granularity, start, end, None,
+                                              store_directory, csv_path)
+    for chunk_start in range(first, stop, chunk_rows):
+        yield _frame(prices, times, chunk_start, min(stop, chunk_start + chunk_rows))
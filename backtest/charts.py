@@ -0,0 +1,127 @@
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Chart rendering, kept off the backtest's critical path.
+#
+# run_backtest only writes the series a run's charts are drawn from (<instrument>_chart_series.npz
+# in its results folder). The PNGs are drawn from those files on request: for one run, for the
+# runs picked from a sweep, or for a sweep's top N, in a process pool. matplotlib is imported in
+# the process that draws, and only then, with the Agg canvas, so workers never need a display.
+
+CHART_NAMES = ("equity_curve", "drawdown", "profit_distribution", "cumulative_pips")
+SERIES_SUFFIX = "_chart_series.npz"
+
+
+def chart_series_path(folder_name, instrument):
+    return os.path.join(folder_name, f"{instrument}{SERIES_SUFFIX}")
+
+
+def write_chart_series(folder_name, instrument, equity_curve, drawdowns, profits_usd, cum_pips):
+    """Save the series save_backtest_charts draws into folder_name. Returns the file's path"""
+    os.makedirs(folder_name, exist_ok=True)
+    path = chart_series_path(folder_name, instrument)
+    np.savez(path, instrument=np.array(instrument), equity_curve=equity_curve, drawdowns=drawdowns,
+             profits_usd=profits_usd, cum_pips=cum_pips)
+    return path
+
+
+def chart_paths(folder_name, instrument):
+    return [os.path.join(folder_name, f"{instrument}_{name}.png") for name in CHART_NAMES]
+
+
+def save_backtest_charts(series_path, dpi=300):
+    """
+    Draw a run's equity curve, drawdown, profit distribution and cumulative pips PNGs next to its
+    chart series file. Returns the PNG paths.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    with np.load(series_path) as series:
+        instrument = str(series['instrument'])
+        equity_curve = series['equity_curve']
+        drawdowns = series['drawdowns']
+        profits_usd = series['profits_usd']
+        cum_pips = series['cum_pips']
+    folder_name = os.path.dirname(series_path)
+    equity_path, drawdown_path, distribution_path, pips_path = chart_paths(folder_name, instrument)
+
+    def new_axes():
+        figure = Figure(figsize=(8, 5))
+        FigureCanvasAgg(figure)
+        return figure, figure.add_subplot()
+
+    # Equity Curve
+    figure, axes = new_axes()
+    axes.plot(equity_curve, label="Equity Curve")
+    axes.set_title(f"{instrument} Equity Curve")
+    axes.set_xlabel("Trades")
+    axes.set_ylabel("Account Balance ($)")
+    axes.legend()
+    axes.grid(True)
+    figure.savefig(equity_path, dpi=dpi)
+
+    # Drawdown
+    figure, axes = new_axes()
+    axes.plot(drawdowns, color='red')
+    axes.set_title("Drawdown over Time")
+    axes.set_xlabel("Trades")
+    axes.set_ylabel("Drawdown ($)")
+    axes.grid(True)
+    figure.savefig(drawdown_path, dpi=dpi)
+
+    # Profit Distribution
+    figure, axes = new_axes()
+    axes.hist(profits_usd, bins=30, edgecolor='black')
+    axes.set_title("Distribution of Trade Profits")
+    axes.set_xlabel("Profit (USD)")
+    axes.set_ylabel("Frequency")
+    figure.savefig(distribution_path, dpi=dpi)
+
+    # Cumulative Pips
+    figure, axes = new_axes()
+    axes.plot(cum_pips)
+    axes.set_title("Cumulative Pips Over Time")
+    axes.set_xlabel("Trades")
+    axes.set_ylabel("Pips")
+    figure.savefig(pips_path, dpi=dpi)
+
+    return [equity_path, drawdown_path, distribution_path, pips_path]
+
+
+def render_charts(series_paths, dpi=300, max_workers=None):
+    """Draw the charts of every chart series file in a process pool. Returns {series_path: PNG paths}"""
+    series_paths = list(series_paths)
+    if not series_paths:
+        return {}
+    max_workers = min(max_workers or os.cpu_count(), len(series_paths))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(series_paths, executor.map(save_backtest_charts, series_paths, [dpi] * len(series_paths))))
+
+
+def render_sweep_charts(results, results_directory, top_n=10, sort_by='profit_factor', runs=None, dpi=300,
+                        max_workers=None):
+    """
+    Draw the charts of some of a sweep's runs.
+
+    Args:
+        results: run_sweep's DataFrame (or sweep_results.csv read back)
+        results_directory: the sweep's results_directory
+        top_n, sort_by: the top_n runs by the sort_by column (highest first)
+        runs: explicit run numbers to draw instead of the top N
+
+    Returns:
+        {series_path: PNG paths}
+    """
+    if runs is None:
+        runs = results.sort_values(sort_by, ascending=False).head(top_n)['run'].tolist()
+    series_paths = []
+    for run in runs:
+        series_paths.extend(sorted(glob.glob(os.path.join(results_directory, f'results_set_{run}', 'results',
+                                                          f'*{SERIES_SUFFIX}'))))
+    rendered = render_charts(series_paths, dpi=dpi, max_workers=max_workers)
+    print(f'Charts drawn for {len(rendered)} runs: {", ".join(str(run) for run in runs)}')
+    return rendered
@@ -0,0 +1,288 @@
+import numpy as np
+
+# Batch SL/TP/breakeven/trailing-stop exit resolution, equivalent to walking update_positions
+# candle by candle. Sell trades are mirrored into buys by negating every price (exact in float),
+# so one set of array operations handles both directions.
+#
+# resolve_exits_intrabar applies the same rules to a finer series (M1 bars or ticks) under the
+# candles, streamed chunk by chunk, so the order in which SL, TP and the trailing stop are hit inside
+# a candle comes from the data instead of the "SL first" assumption.
+
+INITIAL_HORIZON = 256
+MAX_HORIZON = 65536
+MAX_WINDOW_ELEMENTS = 4_000_000  # trades x bars evaluated per array pass
+
+
+def _first_true(mask):
+    """Index of the first True per row, or -1"""
+    first = mask.argmax(axis=1)
+    first[~mask[np.arange(len(mask)), first]] = -1
+    return first
+
+
+def resolve_exits(
+    entry_idx,
+    is_buy,
+    entry_price,
+    stop_loss,
+    take_profit,
+    highs,
+    lows,
+    trail_on=False,
+    trail_start=0.7,
+    trail_distance=0.25,
+    state=None,
+):
+    """
+    Resolve the exit of many trades at once.
+
+    Each trade is processed from bar entry_idx (the first candle update_positions sees for it)
+    with the same rules as the candle loop: highest/lowest price tracking, breakeven and trail-start
+    flags, the trailing stop ratchet (after which the TP is dropped), and "TP and SL in the same
+    candle counts as SL".
+
+    Args:
+        entry_idx, is_buy, entry_price, stop_loss, take_profit: one value per trade
+        highs, lows: candle arrays for the whole series
+        trail_on, trail_start, trail_distance: as in run_backtest
+        state: optional trade state to continue from (the state arrays of an earlier call's result);
+            entry_price, stop_loss and take_profit stay the trades' original values
+
+    Returns:
+        dict of per-trade arrays:
+            exit_idx: bar the trade closed on, -1 if still open at the end of the data
+            exit_price, win: close price and whether it was the TP (only valid where exit_idx >= 0)
+            stop_loss, take_profit_active, highest_price, lowest_price, be_reached, tp_pct_reached:
+                trade state after its exit bar (or the last bar if it never closed)
+    """
+    entry_idx = np.asarray(entry_idx, dtype=np.int64)
+    is_buy = np.asarray(is_buy, dtype=bool)
+    sign = np.where(is_buy, 1.0, -1.0)
+    entry = np.asarray(entry_price, dtype=np.float64)
+    sl0 = np.asarray(stop_loss, dtype=np.float64)
+    tp = np.asarray(take_profit, dtype=np.float64)
+    highs = np.asarray(highs, dtype=np.float64)
+    lows = np.asarray(lows, dtype=np.float64)
+    n_trades, n_bars = len(entry_idx), len(highs)
+
+    # Trade constants, mirrored so every trade is a buy
+    m_entry = sign * entry
+    m_tp = sign * tp
+    tp_distance = np.abs(tp - entry)
+    trigger = m_entry + trail_start * tp_distance
+    risk = np.abs(entry - sl0)
+    trail_gap = np.array([round(d * trail_distance, 5) for d in tp_distance])  # as in get_trailing_stop_distance_if_triggered
+    has_tp = (tp != 0) & ~np.isnan(tp)
+
+    # Running state, carried between horizon windows
+    if state is None:
+        m_highest = m_entry.copy()
+        m_lowest = m_entry.copy()
+        m_stop = sign * sl0
+        be_reached = np.zeros(n_trades, dtype=bool)
+        tp_pct_reached = np.zeros(n_trades, dtype=bool)
+        trail_started = np.zeros(n_trades, dtype=bool)
+    else:
+        m_highest = np.where(is_buy, state["highest_price"], -np.asarray(state["lowest_price"]))
+        m_lowest = np.where(is_buy, state["lowest_price"], -np.asarray(state["highest_price"]))
+        m_stop = sign * np.asarray(state["stop_loss"], dtype=np.float64)
+        be_reached = np.array(state["be_reached"], dtype=bool)
+        tp_pct_reached = np.array(state["tp_pct_reached"], dtype=bool)
+        trail_started = has_tp & ~np.asarray(state["take_profit_active"], dtype=bool)
+
+    exit_idx = np.full(n_trades, -1, dtype=np.int64)
+    exit_price = np.full(n_trades, np.nan)
+    win = np.zeros(n_trades, dtype=bool)
+
+    position = entry_idx.copy()
+    active = np.flatnonzero(position < n_bars)
+    horizon = INITIAL_HORIZON
+    while len(active):
+        still_open = []
+        chunks = max(1, -(-len(active) * horizon // MAX_WINDOW_ELEMENTS))
+        for chunk in np.array_split(active, chunks):
+            bars = position[chunk, None] + np.arange(horizon)
+            in_data = bars < n_bars
+            bars = np.minimum(bars, n_bars - 1)
+            # mirrored bar extremes: a sell's "high" is its negated low
+            buy = is_buy[chunk, None]
+            bar_high = np.where(buy, highs[bars], -lows[bars])
+            bar_low = np.where(buy, lows[bars], -highs[bars])
+
+            highest = np.maximum.accumulate(np.maximum(bar_high, m_highest[chunk, None]), axis=1)
+            lowest = np.minimum.accumulate(np.minimum(bar_low, m_lowest[chunk, None]), axis=1)
+            stop = np.broadcast_to(m_stop[chunk, None], bars.shape)
+            tp_live = np.broadcast_to((has_tp[chunk] & ~trail_started[chunk])[:, None], bars.shape)
+            be = np.broadcast_to(be_reached[chunk, None], bars.shape)
+            pct = np.broadcast_to(tp_pct_reached[chunk, None], bars.shape)
+            started = np.broadcast_to(trail_started[chunk, None], bars.shape)
+
+            if trail_on:
+                reaches_trigger = bar_high >= trigger[chunk, None]
+                pct = np.logical_or.accumulate(pct | reaches_trigger, axis=1)
+                be = np.logical_or.accumulate(be | (bar_high - m_entry[chunk, None] >= risk[chunk, None]), axis=1)
+                trailing = be & reaches_trigger
+                started = np.logical_or.accumulate(started | trailing, axis=1)
+                tp_live = tp_live & ~started
+                # the ratchet only ever moves with the running high, so the stop is the latest candidate.
+                # Candidates are ~5dp prices minus a 5dp gap, so np.round agrees with round(x, 6) here.
+                candidate = np.where(trailing, np.round(highest - trail_gap[chunk, None], 6), -np.inf)
+                stop = np.maximum(stop, np.maximum.accumulate(candidate, axis=1))
+
+            hit_sl = bar_low <= stop
+            hit_tp = tp_live & (bar_high >= m_tp[chunk, None])
+            first = _first_true((hit_sl | hit_tp) & in_data)
+            closed = first >= 0
+            at = np.where(closed, first, np.minimum(horizon, n_bars - position[chunk]) - 1)
+            rows = np.arange(len(chunk))
+
+            m_highest[chunk] = highest[rows, at]
+            m_lowest[chunk] = lowest[rows, at]
+            m_stop[chunk] = stop[rows, at]
+            be_reached[chunk] = be[rows, at]
+            tp_pct_reached[chunk] = pct[rows, at]
+            trail_started[chunk] = started[rows, at]
+
+            done = chunk[closed]
+            sl_exit = hit_sl[rows, at][closed]
+            exit_idx[done] = position[done] + first[closed]
+            exit_price[done] = np.where(sl_exit, m_stop[done], m_tp[done])
+            win[done] = ~sl_exit
+
+            position[chunk] += horizon
+            still_open.append(chunk[~closed & (position[chunk] < n_bars)])
+
+        active = np.concatenate(still_open)
+        horizon = min(horizon * 2, MAX_HORIZON)
+
+    # undo the mirroring
+    return {
+        "exit_idx": exit_idx,
+        "exit_price": sign * exit_price,
+        "win": win,
+        "stop_loss": sign * m_stop,
+        "take_profit_active": has_tp & ~trail_started,
+        "highest_price": np.where(is_buy, m_highest, -m_lowest),
+        "lowest_price": np.where(is_buy, m_lowest, -m_highest),
+        "be_reached": be_reached,
+        "tp_pct_reached": tp_pct_reached,
+    }
+
+
+STATE_KEYS = ("stop_loss", "take_profit_active", "highest_price", "lowest_price", "be_reached", "tp_pct_reached")
+
+
+def resolve_exits_intrabar(
+    entry_idx,
+    is_buy,
+    entry_price,
+    stop_loss,
+    take_profit,
+    times,
+    highs,
+    lows,
+    sub_bars,
+    trail_on=False,
+    trail_start=0.7,
+    trail_distance=0.25,
+):
+    """
+    resolve_exits with each candle's path taken from a finer series.
+
+    Trades are walked through the finer bars from the start of their entry candle, one chunk at a
+    time, with their state carried from chunk to chunk; each chunk is resolved with one
+    resolve_exits call. Candles with no finer bars under them (before the finer data starts, in a gap
+    inside it, or after it ends) fall back to the candle's high and low, resolved as in resolve_exits.
+
+    Args:
+        entry_idx, is_buy, entry_price, stop_loss, take_profit, highs, lows, trail_*: as in resolve_exits
+        times: candle open times, int64 nanoseconds
+        sub_bars: iterable of (times, highs, lows) array chunks of the finer series, in time order and
+            ending with the last candle (for ticks, highs and lows are both the tick price)
+
+    Returns:
+        resolve_exits' dict, exit_idx being the candle the trade closed in, plus
+        exit_time: time of the finer bar (or candle) the trade closed on
+    """
+    entry_idx = np.asarray(entry_idx, dtype=np.int64)
+    is_buy = np.asarray(is_buy, dtype=bool)
+    entry = np.asarray(entry_price, dtype=np.float64)
+    sl0 = np.asarray(stop_loss, dtype=np.float64)
+    tp = np.asarray(take_profit, dtype=np.float64)
+    times = np.asarray(times, dtype=np.int64)
+    highs = np.asarray(highs, dtype=np.float64)
+    lows = np.asarray(lows, dtype=np.float64)
+    n_trades, n_bars = len(entry_idx), len(times)
+
+    state = {
+        "stop_loss": sl0.copy(),
+        "take_profit_active": (tp != 0) & ~np.isnan(tp),
+        "highest_price": entry.copy(),
+        "lowest_price": entry.copy(),
+        "be_reached": np.zeros(n_trades, dtype=bool),
+        "tp_pct_reached": np.zeros(n_trades, dtype=bool),
+    }
+    exit_idx = np.full(n_trades, -1, dtype=np.int64)
+    exit_time = np.zeros(n_trades, dtype=np.int64)
+    exit_price = np.full(n_trades, np.nan)
+    win = np.zeros(n_trades, dtype=bool)
+    is_open = entry_idx < n_bars
+    entry_time = times[np.minimum(entry_idx, n_bars - 1)] if n_bars else np.zeros(n_trades, dtype=np.int64)
+
+    def advance(select, start, bar_highs, bar_lows):
+        """Run the selected trades through one series from `start`; returns (closed rows, their bar)"""
+        result = resolve_exits(start, is_buy[select], entry[select], sl0[select], tp[select],
+                               bar_highs, bar_lows, trail_on, trail_start, trail_distance,
+                               state={key: state[key][select] for key in STATE_KEYS})
+        for key in STATE_KEYS:
+            state[key][select] = result[key]
+        closed = result["exit_idx"] >= 0
+        done = select[closed]
+        exit_price[done] = result["exit_price"][closed]
+        win[done] = result["win"][closed]
+        is_open[done] = False
+        return done, result["exit_idx"][closed]
+
+    next_candle = 0  # first candle not yet covered by an earlier chunk
+    for sub_times, sub_highs, sub_lows in sub_bars:
+        sub_times = np.asarray(sub_times, dtype=np.int64)
+        if not len(sub_times) or not n_bars:
+            continue
+        sub_highs = np.asarray(sub_highs, dtype=np.float64)
+        sub_lows = np.asarray(sub_lows, dtype=np.float64)
+
+        # Candles up to this chunk's last one with no finer bars of their own (the ones before the finer
+        # data starts, or gaps in it) stand in for their finer bars with their own high and low
+        owner = np.searchsorted(times, sub_times, side="right") - 1
+        last_candle = int(owner[-1])
+        if last_candle >= next_candle:
+            missing = np.setdiff1d(np.arange(next_candle, last_candle + 1), owner)
+            if len(missing):
+                order = np.argsort(np.concatenate((times[missing], sub_times)), kind="stable")
+                sub_times = np.concatenate((times[missing], sub_times))[order]
+                sub_highs = np.concatenate((highs[missing], sub_highs))[order]
+                sub_lows = np.concatenate((lows[missing], sub_lows))[order]
+            next_candle = last_candle + 1
+
+        select = np.flatnonzero(is_open & (entry_time <= sub_times[-1]))
+        if len(select):
+            start = np.searchsorted(sub_times, entry_time[select], side="left")
+            done, sub_idx = advance(select, start, sub_highs, sub_lows)
+            exit_time[done] = sub_times[sub_idx]
+            exit_idx[done] = np.maximum(np.searchsorted(times, sub_times[sub_idx], side="right") - 1, 0)
+
+    # Candles after the finer data ends (all of them if there was none)
+    tail_start = next_candle
+    select = np.flatnonzero(is_open)
+    if len(select) and tail_start < n_bars:
+        done, bars = advance(select, np.maximum(entry_idx[select], tail_start), highs, lows)
+        exit_idx[done] = bars
+        exit_time[done] = times[bars]
+
+    return {
+        "exit_idx": exit_idx,
+        "exit_time": exit_time,
+        "exit_price": exit_price,
+        "win": win,
+        **state,
+    }
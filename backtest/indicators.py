@@ -0,0 +1,196 @@
+from collections import deque
+from itertools import islice
+
+
+class StreamingIndicators:
+    """
+    Incremental EMA, ATR and Wilder RSI, advanced one candle at a time.
+
+    Each update() is O(1) in the lookback length. With `window` set, values reproduce what the
+    strategies get from recomputing over the last `window` candles (EMAs and RSI seeded at the
+    window start, as pandas ewm(adjust=False) and calculate_rsi do). With window=None the
+    indicators run over the full history.
+
+    Args:
+        window: Number of candles the strategy would normally be given (None for unbounded)
+        ema_spans: EMA spans to track
+        atr_period: ATR rolling period
+        rsi_period: Wilder RSI period
+    """
+
+    def __init__(self, window=None, ema_spans=(9, 25, 200), atr_period=14, rsi_period=14):
+        self.window = window
+        self.ema_spans = tuple(ema_spans)
+        self.atr_period = atr_period
+        self.rsi_period = rsi_period
+        self.count = 0
+        self.recent = deque(maxlen=3)  # last 3 candles: N-2, N-1, N
+
+        # EMA: full-history value for the last 3 candles plus the seed error (close - ema)
+        # of every candle in the window, so the window-seeded value is a single correction
+        self._ema = {span: deque(maxlen=3) for span in self.ema_spans}
+        self._ema_seed_error = {span: deque(maxlen=window or 1) for span in self.ema_spans}
+
+        # ATR: last `atr_period` true ranges
+        self._true_ranges = deque(maxlen=atr_period)
+
+        # RSI: gains/losses and their full-history Wilder averages across the window
+        history = window or rsi_period
+        self._gains = deque(maxlen=history)
+        self._losses = deque(maxlen=history)
+        self._avg_gain_full = deque(maxlen=history)
+        self._avg_loss_full = deque(maxlen=history)
+        self._loss_flags = deque(maxlen=history)
+        self._loss_count = 0
+        self._rsi_anchor = None  # (gain, loss) seed corrections when window is None
+
+    @property
+    def window_length(self):
+        """Number of candles in the current window"""
+        return self.count if self.window is None else min(self.count, self.window)
+
+    def update(self, candle):
+        """Advance every indicator with one completed OHLC candle and return the latest values"""
+        high, low, close = float(candle["high"]), float(candle["low"]), float(candle["close"])
+        prev_close = self.recent[-1]["close"] if self.recent else None
+        self.recent.append(candle)
+        self.count += 1
+
+        # --- EMAs ---
+        for span in self.ema_spans:
+            alpha = 2 / (span + 1)
+            history = self._ema[span]
+            ema = close if not history else history[-1] + alpha * (close - history[-1])
+            history.append(ema)
+            if self.window is not None:
+                self._ema_seed_error[span].append(close - ema)
+
+        # --- ATR ---
+        if prev_close is None:
+            true_range = high - low
+        else:
+            true_range = max(high - low, abs(high - prev_close), abs(low - prev_close))
+        self._true_ranges.append(true_range)
+
+        # --- RSI (the first candle has no delta, so it counts as 0) ---
+        delta = 0.0 if prev_close is None else close - prev_close
+        gain = delta if delta > 0 else 0.0
+        loss = -delta if delta < 0 else 0.0
+        alpha = 1 / self.rsi_period
+        if self._avg_gain_full:
+            avg_gain = self._avg_gain_full[-1] + alpha * (gain - self._avg_gain_full[-1])
+            avg_loss = self._avg_loss_full[-1] + alpha * (loss - self._avg_loss_full[-1])
+        else:
+            avg_gain, avg_loss = gain, loss
+
+        flag = 1 if loss > 0 else 0
+        self._loss_count += flag
+        self._avg_gain_full.append(avg_gain)
+        self._avg_loss_full.append(avg_loss)
+        if self.window is not None:
+            if len(self._loss_flags) == self._loss_flags.maxlen:
+                self._loss_count -= self._loss_flags[0]
+            self._gains.append(gain)
+            self._losses.append(loss)
+            self._loss_flags.append(flag)
+        elif self.count <= self.rsi_period:
+            # unbounded history only needs the first `rsi_period` deltas for the seed
+            self._gains.append(gain)
+            self._losses.append(loss)
+            self._loss_flags.append(flag)
+
+        if self.window is None and self.count == self.rsi_period:
+            self._rsi_anchor = self._rsi_seed_correction()
+
+        return self.values()
+
+    def ema(self, span, offset=0):
+        """EMA `offset` candles back (0 = current), seeded at the start of the current window"""
+        history = self._ema[span]
+        if offset >= len(history):
+            return None
+        value = history[-1 - offset]
+        if self.window is None:
+            return value
+        seed_error = self._ema_seed_error[span]
+        decay = (1 - 2 / (span + 1)) ** (len(seed_error) - 1 - offset)
+        return value + decay * seed_error[0]
+
+    def atr(self):
+        if len(self._true_ranges) < self.atr_period:
+            return None
+        return sum(self._true_ranges) / self.atr_period
+
+    def rsi(self):
+        period = self.rsi_period
+        if self.window_length < period:
+            return None
+        # the window's first delta is treated as 0, so it never counts as a loss
+        if self._loss_count - self._loss_flags[0] == 0:
+            return 100.0
+        if self.window is None:
+            gain_correction, loss_correction = self._rsi_anchor
+        else:
+            gain_correction, loss_correction = self._rsi_seed_correction()
+
+        decay = ((period - 1) / period) ** (self.window_length - period)
+        avg_gain = self._avg_gain_full[-1] + decay * gain_correction
+        avg_loss = self._avg_loss_full[-1] + decay * loss_correction
+        return 100 - 100 / (1 + avg_gain / avg_loss)
+
+    def _rsi_seed_correction(self):
+        # Wilder's seed is the simple mean of the window's first `period` deltas (the first is 0),
+        # the full-history average at that candle is replaced by it and the difference decays
+        period = self.rsi_period
+        seed_gain = sum(islice(self._gains, 1, period)) / period
+        seed_loss = sum(islice(self._losses, 1, period)) / period
+        return seed_gain - self._avg_gain_full[period - 1], seed_loss - self._avg_loss_full[period - 1]
+
+    def values(self):
+        """Latest indicator values (None until each has enough candles)"""
+        values = {f"ema_{span}": self.ema(span) for span in self.ema_spans}
+        values["atr"] = self.atr()
+        values["rsi"] = self.rsi()
+        return values
+
+    def snapshot(self):
+        """Plain-data copy of the full state, safe to pickle or dump as JSON"""
+        return {
+            "config": {
+                "window": self.window,
+                "ema_spans": list(self.ema_spans),
+                "atr_period": self.atr_period,
+                "rsi_period": self.rsi_period,
+            },
+            "count": self.count,
+            "recent": [dict(c) for c in self.recent],
+            "ema": {str(span): list(values) for span, values in self._ema.items()},
+            "ema_seed_error": {str(span): list(values) for span, values in self._ema_seed_error.items()},
+            "true_ranges": list(self._true_ranges),
+            "gains": list(self._gains),
+            "losses": list(self._losses),
+            "avg_gain_full": list(self._avg_gain_full),
+            "avg_loss_full": list(self._avg_loss_full),
+            "loss_flags": list(self._loss_flags),
+            "loss_count": self._loss_count,
+            "rsi_anchor": list(self._rsi_anchor) if self._rsi_anchor is not None else None,
+        }
+
+    @classmethod
+    def restore(cls, state):
+        """Rebuild an engine from snapshot() output"""
+        engine = cls(**state["config"])
+        engine.count = state["count"]
+        engine.recent.extend(state["recent"])
+        for span in engine.ema_spans:
+            engine._ema[span].extend(state["ema"][str(span)])
+            engine._ema_seed_error[span].extend(state["ema_seed_error"][str(span)])
+        engine._true_ranges.extend(state["true_ranges"])
+        engine._gains.extend(state["gains"])
+        engine._losses.extend(state["losses"])
+        engine._avg_gain_full.extend(state["avg_gain_full"])
+        engine._avg_loss_full.extend(state["avg_loss_full"])
+        engine._loss_flags.extend(state["loss_flags"])
+        engine._loss_count = state["loss_count"]
+        engine._rsi_anchor = tuple(state["rsi_anchor"]) if state["rsi_anchor"] is not None else None
+        return engine
@@ -0,0 +1,291 @@
+import bisect
+import contextlib
+import cProfile
+import functools
+import json
+import math
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+
+# Named timing spans for the backtest and the live bot.
+#
+#   with span('data_load'):
+#       candles = ...
+#
+# Every span's durations are aggregated into a histogram (count, sum, min, max and fixed
+# Prometheus-style buckets), exported with write_json / write_prometheus. While disabled (the
+# default) span() hands back one shared no-op context manager (well under a microsecond), and
+# timed() hands back the function itself, so per-candle code wrapped once up front costs nothing.
+# Enable with enable() or BACKTEST_INSTRUMENTATION=1.
+#
+# Sweep workers keep their own histograms; run_sweep collects them with snapshot()/merge().
+# profile() wraps a block in cProfile and/or tracemalloc for a deeper look. Functions decorated with
+# instrumentable (run_backtest, run_sweep) take instrumentation_path= and profile= to do both for one call.
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+
+_enabled = os.environ.get('BACKTEST_INSTRUMENTATION', '') not in ('', '0')
+_histograms = {}
+_lock = threading.Lock()
+
+
+class Histogram:
+    """Durations of one span name"""
+
+    __slots__ = ('count', 'total', 'minimum', 'maximum', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.minimum = math.inf
+        self.maximum = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)  # last one is +Inf
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds < self.minimum:
+            self.minimum = seconds
+        if seconds > self.maximum:
+            self.maximum = seconds
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    def quantile(self, q):
+        """Estimate: upper bound of the bucket holding the q-th duration (capped at the maximum)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS + (math.inf,), self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.maximum)
+        return self.maximum
+
+    def to_dict(self):
+        return {'count': self.count, 'total': self.total, 'min': self.minimum, 'max': self.maximum,
+                'buckets': list(self.buckets)}
+
+
+class _Span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+_DISABLED = contextlib.nullcontext()
+
+
+def enable(on=True):
+    global _enabled
+    _enabled = on
+
+
+def disable():
+    enable(False)
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """Forget every recorded duration"""
+    with _lock:
+        _histograms.clear()
+
+
+def record(name, seconds):
+    """Add one duration to a span's histogram (also usable for timings measured elsewhere)"""
+    histogram = _histograms.get(name)
+    if histogram is None:
+        with _lock:
+            histogram = _histograms.setdefault(name, Histogram())
+    histogram.observe(seconds)
+
+
+def span(name):
+    """Context manager timing its block under `name` (a no-op while disabled)"""
+    return _Span(name) if _enabled else _DISABLED
+
+
+def timed(name, function):
+    """
+    `function` timed under `name` on every call. While disabled this is `function` itself, so wrap
+    hot per-candle functions once, outside the loop (enabling later does not affect that wrapper).
+    """
+    if not _enabled:
+        return function
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            record(name, time.perf_counter() - start)
+    return wrapper
+
+
+def snapshot(clear=False):
+    """Picklable copy of the histograms, e.g. to send from a worker process to merge()"""
+    with _lock:
+        data = {name: histogram.to_dict() for name, histogram in _histograms.items()}
+        if clear:
+            _histograms.clear()
+    return data
+
+
+def merge(data):
+    """Add a snapshot() from another process into this one's histograms"""
+    with _lock:
+        for name, other in data.items():
+            histogram = _histograms.setdefault(name, Histogram())
+            histogram.count += other['count']
+            histogram.total += other['total']
+            histogram.minimum = min(histogram.minimum, other['min'])
+            histogram.maximum = max(histogram.maximum, other['max'])
+            histogram.buckets = [a + b for a, b in zip(histogram.buckets, other['buckets'])]
+
+
+def summary():
+    """{span: {count, total, mean, min, max, p50, p95, p99}} in seconds, slowest total first"""
+    with _lock:
+        items = sorted(_histograms.items(), key=lambda item: -item[1].total)
+    return {
+        name: {
+            'count': h.count,
+            'total': round(h.total, 6),
+            'mean': round(h.total / h.count, 6),
+            'min': round(h.minimum, 6),
+            'max': round(h.maximum, 6),
+            'p50': round(h.quantile(0.5), 6),
+            'p95': round(h.quantile(0.95), 6),
+            'p99': round(h.quantile(0.99), 6),
+        }
+        for name, h in items if h.count
+    }
+
+
+def _write_atomic(path, text):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'w', encoding='utf-8') as file:
+        file.write(text)
+    os.replace(temporary, path)
+
+
+def write_json(path):
+    """Write summary() plus the raw bucket counts to path"""
+    with _lock:
+        histograms = {name: h.to_dict() for name, h in _histograms.items()}
+    _write_atomic(path, json.dumps({'buckets': list(BUCKETS), 'summary': summary(), 'histograms': histograms},
+                                   indent=2))
+
+
+def prometheus_text(metric='backtest_span_seconds'):
+    """The histograms in the Prometheus text exposition format, one series per span"""
+    lines = [f'# HELP {metric} Duration of instrumented spans in seconds.', f'# TYPE {metric} histogram']
+    with _lock:
+        items = sorted(_histograms.items())
+        for name, h in items:
+            label = name.replace('\\', '\\\\').replace('"', '\\"')
+            cumulative = 0
+            for bound, count in zip(BUCKETS, h.buckets):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{span="{label}",le="{bound:g}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{span="{label}",le="+Inf"}} {h.count}')
+            lines.append(f'{metric}_sum{{span="{label}"}} {h.total!r}')
+            lines.append(f'{metric}_count{{span="{label}"}} {h.count}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(path, metric='backtest_span_seconds'):
+    """Write prometheus_text() to path (written whole and renamed, for the node exporter textfile collector)"""
+    _write_atomic(path, prometheus_text(metric))
+
+
+@contextlib.contextmanager
+def profile(cprofile_path=None, trace_memory=False, top=20):
+    """
+    Run a block under cProfile and/or tracemalloc.
+
+    Args:
+        cprofile_path: write the cProfile stats there (open with pstats or snakeviz) and print the
+            `top` functions by cumulative time
+        trace_memory: trace allocations and print the `top` allocation sites and the peak
+
+    Yields:
+        dict filled in when the block ends: 'stats' (pstats.Stats), 'peak_mb', 'top_allocations'
+    """
+    result = {}
+    profiler = cProfile.Profile() if cprofile_path else None
+    if trace_memory:
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield result
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(cprofile_path)
+            result['stats'] = pstats.Stats(profiler).sort_stats('cumulative')
+            result['stats'].print_stats(top)
+        if trace_memory:
+            memory_snapshot = tracemalloc.take_snapshot()
+            result['peak_mb'] = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+            result['top_allocations'] = [str(stat) for stat in memory_snapshot.statistics('lineno')[:top]]
+            print(f"Peak traced memory: {result['peak_mb']:.1f} MB")
+            for line in result['top_allocations']:
+                print(line)
+
+
+@contextlib.contextmanager
+def session(path=None, cprofile_path=None):
+    """
+    Enable the spans for a block, optionally under cProfile (see profile), and write the histograms to
+    path when it ends: Prometheus text if it ends in .prom, JSON otherwise. The enabled state is restored.
+    """
+    was_enabled = _enabled
+    enable()
+    try:
+        with profile(cprofile_path) if cprofile_path else contextlib.nullcontext():
+            yield
+    finally:
+        enable(was_enabled)
+        if path:
+            if path.endswith('.prom'):
+                write_prometheus(path)
+            else:
+                write_json(path)
+
+
+def instrumentable(function):
+    """
+    Give function two optional keyword arguments: instrumentation_path (run it in a session() that writes
+    the span histograms there) and profile (cProfile stats path). Without either it runs as before.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, instrumentation_path=None, profile=None, **kwargs):
+        if instrumentation_path is None and profile is None:
+            return function(*args, **kwargs)
+        with session(instrumentation_path, profile):
+            return function(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,125 @@
+# CSV columns of a trade, in the order run_backtest has always written them
+TRADE_COLUMNS = [
+    "trade_id",
+    "instrument",
+    "action",
+    "entry_price",
+    "stop_loss",
+    "original_stop_loss",
+    "take_profit",
+    "original_take_profit",
+    "units",
+    "open_price",
+    "highest_price",
+    "lowest_price",
+    "close_price",
+    "be_reached",
+    "win",
+    "profit",
+    "profit_pips",
+    "profit_usd",
+    "%_TP_reached",
+]
+
+# Column name -> attribute name, for columns that are not valid identifiers
+_ATTRIBUTES = {column: column for column in TRADE_COLUMNS}
+_ATTRIBUTES["%_TP_reached"] = "tp_pct_reached"
+
+# Fields that are not CSV columns: candle index of entry and exit, for exposure
+_BAR_FIELDS = ("open_bar", "close_bar")
+# Every name dict-style access accepts
+_FIELDS = {**_ATTRIBUTES, **{field: field for field in _BAR_FIELDS}}
+
+
+class Trade:
+    """
+    One backtest trade as a fixed-size record.
+
+    Fields are attributes, but the old dict-style access (trade['stop_loss'], trade.get(...),
+    'win' in trade) still works so strategies and metrics written against trade dicts keep working.
+    """
+
+    __slots__ = tuple(_ATTRIBUTES.values()) + _BAR_FIELDS
+
+    def __init__(self, trade_id, instrument, action, entry_price, stop_loss, take_profit, units):
+        self.trade_id = trade_id
+        self.instrument = instrument
+        self.action = action
+        self.entry_price = entry_price
+        self.stop_loss = stop_loss
+        self.original_stop_loss = stop_loss
+        self.take_profit = take_profit
+        self.original_take_profit = take_profit
+        self.units = units
+        self.open_price = entry_price
+        self.highest_price = entry_price
+        self.lowest_price = entry_price
+        self.close_price = None
+        self.be_reached = False
+        self.win = None
+        self.profit = None
+        self.profit_pips = None
+        self.profit_usd = None
+        self.tp_pct_reached = False
+        self.open_bar = None
+        self.close_bar = None
+
+    def __getitem__(self, column):
+        return getattr(self, _FIELDS[column])
+
+    def __setitem__(self, column, value):
+        setattr(self, _FIELDS[column], value)
+
+    def __contains__(self, column):
+        return column in _FIELDS
+
+    def get(self, column, default=None):
+        attribute = _FIELDS.get(column)
+        return default if attribute is None else getattr(self, attribute)
+
+    def keys(self):
+        return list(TRADE_COLUMNS)
+
+    def to_dict(self):
+        return {column: getattr(self, attribute) for column, attribute in _ATTRIBUTES.items()}
+
+    def __repr__(self):
+        return f"Trade({self.to_dict()})"
+
+
+class TradeLedger:
+    """
+    Every trade opened in a backtest, plus an index of the ones still open.
+
+    Per-candle work only touches `open_trades`, and checking whether an instrument is free
+    is a dict lookup instead of a scan over every trade ever opened.
+    """
+
+    def __init__(self):
+        self.trades = []        # all trades, in the order they were opened
+        self.completed = []     # closed trades, in the order they were closed
+        self.open_trades = {}   # trade_id -> Trade
+        self._open_per_instrument = {}
+
+    def __len__(self):
+        return len(self.trades)
+
+    def open(self, instrument, action, entry_price, stop_loss, take_profit, units):
+        trade = Trade(len(self.trades), instrument, action, entry_price, stop_loss, take_profit, units)
+        self.trades.append(trade)
+        self.open_trades[trade.trade_id] = trade
+        self._open_per_instrument[instrument] = self._open_per_instrument.get(instrument, 0) + 1
+        return trade
+
+    def close(self, trade):
+        """Move a trade whose close_price/profit fields are set from the open index to completed"""
+        del self.open_trades[trade.trade_id]
+        self._open_per_instrument[trade.instrument] -= 1
+        self.completed.append(trade)
+
+    def is_available(self, instrument):
+        return self._open_per_instrument.get(instrument, 0) == 0
+
+    def iter_open(self):
+        # Snapshot so trades can be closed while iterating
+        return list(self.open_trades.values())
@@ -1,78 +1,253 @@
 import pandas as pd
+import numpy as np
 import time
 import os
 import csv
-import strategies.EMA_CROSS_9_25_WITH_TIME_RESTRICT as strat # Stat must return signal in format: {"instrument": instrument, "action": "sell", "entry_price": float(entry_formatted), "stop_loss": float(sl_formatted),"take_profit": float(tp_formatted),"rsi": float(rsi),"atr": float(atr),"ema_9": float(candle_1_ago["ema_9"]),"ema_25": float(candle_1_ago["ema_25"]), "ema_200": float(candle_1_ago["ema_200"]), "reason": "ema_crossover_sell"}
-import matplotlib.pyplot as plt
+import hashlib
+from collections import OrderedDict
+from indicators import StreamingIndicators
+import candle_store
+from ledger import TRADE_COLUMNS, TradeLedger
+from exits import resolve_exits, resolve_exits_intrabar
+from metrics import calculate_metrics, equity_curves
+from charts import chart_paths, save_backtest_charts, write_chart_series
+from instrumentation import instrumentable, span, timed
+from result_cache import ResultCache, result_key
+from timeframes import MultiTimeframe, derive_series, to_nanoseconds
+from strategy_registry import DEFAULT_STRATEGY, get_strategy # Strategies are looked up by name and imported on first use. Strat must return signal in format: {"instrument": instrument, "action": "sell", "entry_price": float(entry_formatted), "stop_loss": float(sl_formatted),"take_profit": float(tp_formatted),"rsi": float(rsi),"atr": float(atr),"ema_9": float(candle_1_ago["ema_9"]),"ema_25": float(candle_1_ago["ema_25"]), "ema_200": float(candle_1_ago["ema_200"]), "reason": "ema_crossover_sell"}
+
+# --- Signal generation stage ---
+# Signals only depend on the candles, the strategy and its lookback, never on money management,
+# so they are cached and shared by every risk/trailing permutation run on the same data
+SIGNAL_CACHE_SIZE = 8
+_signal_cache = OrderedDict()
+
+
+def dataset_fingerprint(candles, columns=('open', 'high', 'low', 'close')):
+    """Content hash of a DataFrame's columns (by default a candle DataFrame's OHLC)"""
+    digest = hashlib.blake2b(digest_size=16)
+    for col in columns:
+        digest.update(np.ascontiguousarray(candles[col].to_numpy(dtype=np.float64)).tobytes())
+    return digest.hexdigest()
+
+
+def generate_signals(candles, instrument="EUR_USD", lookback=200, signal_mode='vectorized', use_cache=True,
+                     precision='float', strategy=DEFAULT_STRATEGY, strategy_params=None, granularity='M5',
+                     timeframes=None):
+    """
+    Strategy signals for every candle, as a DataFrame with signal (1 buy, -1 sell, 0 hold),
+    stop_loss and take_profit columns.
+
+    signal_mode: 'vectorized' computes every signal once with strat.run_vectorized,
+    'streaming' advances a StreamingIndicators per candle and calls strat.run_streaming,
+    'window' calls strat.run on the trailing window each candle (slow, reference behaviour)
+
+    precision: 'decimal' runs strat.run on Decimal prices as it originally did ('window'), or has
+    run_vectorized redo the ATR behind each SL/TP on Decimal prices ('vectorized')
+
+    strategy: registered strategy name (see strategy_registry); strategy_params are checked against its
+    schema and passed to run_vectorized, the other modes only run the strategy's defaults
+
+    timeframes: for strategies registered with higher timeframes, a MultiTimeframe of their completed
+    bars (e.g. MultiTimeframe.from_store, whose history starts before the candles). By default they are
+    resampled from the candles (granularity is theirs). 'streaming' always builds them candle by candle
+    """
+    spec = get_strategy(strategy)
+    params = spec.validate_params(strategy_params)
+    if strategy_params and signal_mode != 'vectorized':
+        raise ValueError(f"strategy_params are only supported with signal_mode='vectorized', not {signal_mode}")
+    if lookback < spec.lookback:
+        print(f"Warning: {spec.name} needs {spec.lookback} candles per window but lookback is {lookback}, "
+              f"so it will never signal")
+    if spec.timeframes and signal_mode == 'window':
+        raise ValueError(f"{spec.name} reads higher timeframes, which signal_mode='window' does not provide")
+    key = (spec.name, instrument, dataset_fingerprint(candles), lookback, signal_mode, precision,
+           tuple(sorted(params.items())), granularity,
+           timeframes.fingerprint() if timeframes is not None else None)
+
+    if use_cache and key in _signal_cache:
+        _signal_cache.move_to_end(key)
+        return _signal_cache[key]
+
+    strat = spec.load()
+    candle_count = len(candles)
+    if signal_mode == 'vectorized':
+        if spec.timeframes:
+            if timeframes is None:
+                with span('timeframes'):
+                    timeframes = MultiTimeframe(granularity, spec.timeframes)
+                    timeframes.update(candles)
+            params['timeframes'] = timeframes
+        if precision != 'float':
+            params['precision'] = precision  # only strategies with a Decimal path take it
+        with span('strategy.run'):
+            signal_frame = strat.run_vectorized(candles, instrument=instrument, lookback=lookback, **params)
+        signal_frame = signal_frame[['signal', 'stop_loss', 'take_profit']].copy()
+    elif signal_mode in ('streaming', 'window'):
+        signals = np.zeros(candle_count, dtype=np.int8)
+        stop_losses = np.full(candle_count, np.nan)
+        take_profits = np.full(candle_count, np.nan)
+        indicators = StreamingIndicators(window=lookback)
+        records = candles[['open', 'high', 'low', 'close']].to_dict('records')
+        update_indicators = timed('indicator.update', indicators.update)
+        run_streaming = timed('strategy.run', strat.run_streaming)
+        run_window = timed('strategy.run', strat.run)
+        streaming_timeframes = {}
+        if spec.timeframes and signal_mode == 'streaming':
+            # Bars completed so far only, advanced with each candle
+            if 'time' not in candles:
+                raise ValueError("Candles need a time column to build higher timeframes")
+            timeframes = MultiTimeframe(granularity, spec.timeframes, max_bars=max(spec.timeframes.values()))
+            advance_timeframes = timed('timeframes', timeframes.advance)
+            times = to_nanoseconds(candles['time'].to_numpy())
+            prices = candles[['open', 'high', 'low', 'close']].to_numpy().T
+            streaming_timeframes['timeframes'] = timeframes
+        for idx, candle in enumerate(records):
+            if signal_mode == 'streaming':
+                update_indicators(candle)
+                if streaming_timeframes:
+                    advance_timeframes(times[idx:idx+1], prices[:, idx:idx+1])
+                signal = run_streaming(indicators, instrument=instrument, **streaming_timeframes)
+            elif idx >= 200:
+                start_idx = max(0, idx - lookback + 1)
+                signal = run_window(candles.iloc[start_idx:idx+1].to_dict('records'), instrument=instrument,
+                                    precision=precision)
+            else:
+                continue
+            if signal['action'] != 'hold':
+                signals[idx] = 1 if signal['action'] == 'buy' else -1
+                stop_losses[idx] = signal['stop_loss']
+                take_profits[idx] = signal['take_profit']
+        signal_frame = pd.DataFrame({'signal': signals, 'stop_loss': stop_losses, 'take_profit': take_profits})
+    else:
+        raise ValueError(f"Unknown signal_mode: {signal_mode}")
+
+    # The backtest only starts trading once 200 candles have been seen
+    signal_frame.iloc[:200, signal_frame.columns.get_loc('signal')] = 0
+
+    if use_cache:
+        _signal_cache[key] = signal_frame
+        if len(_signal_cache) > SIGNAL_CACHE_SIZE:
+            _signal_cache.popitem(last=False)
+    return signal_frame
+
+
+def load_timeframes(strategy, instrument, granularity='M5', store_directory=candle_store.STORE_DIRECTORY,
+                    csv_path=None):
+    """
+    MultiTimeframe of the strategy's higher timeframes over the whole stored series (derived bars are
+    cached in the store), or None if it reads only its own granularity
+    """
+    spec = get_strategy(strategy)
+    if not spec.timeframes:
+        return None
+    with span('timeframes'):
+        return MultiTimeframe.from_store(instrument, granularity, spec.timeframes, store_directory=store_directory,
+                                         csv_path=csv_path)
+
+
+# --- Position simulation stage ---
+def pip_size(instrument):
+    """Price move of one pip: 0.01 for JPY-quoted pairs, 0.0001 otherwise"""
+    return 0.01 if instrument[-3:] == "JPY" else 0.0001
+
+
+def calculate_units(account_balance, risk_percent, entry_price, stop_loss, instrument):
+    """Units that lose risk_percent of account_balance if the stop loss is hit"""
+    risk_usd = account_balance * risk_percent
+    if instrument[-3:] == "JPY":
+        pip_multiplier = 100
+    else:
+        pip_multiplier = 10000
+    sl_distance = abs(entry_price - stop_loss) * pip_multiplier
+    if sl_distance == 0:
+        return 0
+    return risk_usd / (sl_distance * pip_size(instrument))
+
+
+def resolve_signal_exits(candles, signal_frame, trail_on=False, trail_start=0.7, trail_distance=0.25,
+                         exit_mode='vectorized', sub_candles=None):
+    """
+    Entry price and exit of every signal as if it were taken, entering at the next candle's open.
+
+    Returns:
+        (signal_idx, entry_prices, exits) where exits is the resolve_exits(_intrabar) result
+    """
+    signals = signal_frame['signal'].to_numpy()
+    stop_losses = signal_frame['stop_loss'].to_numpy()
+    take_profits = signal_frame['take_profit'].to_numpy()
+    opens = candles['open'].to_numpy(dtype=float)
+    highs = candles['high'].to_numpy(dtype=float)
+    lows = candles['low'].to_numpy(dtype=float)
+    closes = candles['close'].to_numpy(dtype=float)
+    candle_count = len(candles)
+
+    signal_idx = np.flatnonzero(signals)
+    entry_idx = signal_idx + 1
+    entry_prices = np.where(entry_idx < candle_count, opens[np.minimum(entry_idx, candle_count - 1)], closes[signal_idx])
+    if exit_mode == 'intrabar':
+        if sub_candles is None or 'time' not in candles:
+            raise ValueError("exit_mode='intrabar' needs sub_candles and candles with a time column")
+        sub_bars = ((chunk['time'].to_numpy().astype('datetime64[ns]').view(np.int64),
+                     chunk['high'].to_numpy(dtype=float), chunk['low'].to_numpy(dtype=float))
+                    for chunk in sub_candles)
+        exits = resolve_exits_intrabar(entry_idx, signals[signal_idx] > 0, entry_prices,
+                                       stop_losses[signal_idx], take_profits[signal_idx],
+                                       candles['time'].to_numpy().astype('datetime64[ns]').view(np.int64),
+                                       highs, lows, sub_bars, trail_on, trail_start, trail_distance)
+    else:
+        exits = resolve_exits(entry_idx, signals[signal_idx] > 0, entry_prices, stop_losses[signal_idx],
+                              take_profits[signal_idx], highs, lows, trail_on, trail_start, trail_distance)
+    return signal_idx, entry_prices, exits
 
-def run_backtest(
+
+# simulate_positions' parameters that can be varied without new signals, with their defaults
+POSITION_PARAMS = {'risk_percent': 0.01, 'trail_on': False, 'trail_start': 0.7, 'trail_distance': 0.25}
+
+
+def simulate_positions(
+    candles,
+    signal_frame,
     instrument="EUR_USD",
     risk_percent=0.01,
     starting_balance=850,
-    candle_counter=2016,
     trail_on=False,
     trail_start=0.7,
     trail_distance=0.25,
-    min_number_of_required_candles_for_strategy=200,
     debug=False,
-    csv_filename="trades_made_1",
-    folder_name="results_set_1",
-    metric_filename="metric_set_1",
-    results_directory='results_sets',
-    details_file='details_set_1.txt'
+    exit_mode='vectorized',
+    strategy=DEFAULT_STRATEGY,
+    sub_candles=None,
+    verbose=False
 ):
+    """
+    Open a trade on each signal while the instrument is free and resolve its SL/TP/trailing exit.
+    Returns (completed_trades, account_balance).
+
+    exit_mode: 'vectorized' resolves every exit at once with exits.resolve_exits,
+    'loop' walks the candles through update_positions (reference behaviour), using the
+    strategy's get_trailing_stop_distance_if_triggered, 'intrabar' resolves them like 'vectorized'
+    but on the finer bars or ticks under each candle (exits.resolve_exits_intrabar)
+
+    sub_candles: for 'intrabar', iterable of DataFrame chunks (time, high, low) of the finer series,
+    e.g. candle_store.iter_candles(instrument, 'M1', ...). Needs candles with a time column
+
+    verbose: print every signal (and the loop's progress), as run_backtest does
+    """
     # --- Globals / State ---
-    trades = []
-    completed_trades = []
+    ledger = TradeLedger()
     account_balance = starting_balance
-    trades_made = 0
     trades_closed = 0
-    trades_unfinished = 0
     stategy_assesment_metrics = []
 
     # --- Helper functions ---
-    def calculate_units(account_balance, risk_percent, entry_price, stop_loss, instrument):
-        risk_usd = account_balance * risk_percent
-        if instrument[-3:] == "JPY":
-            pip_size = 0.01
-            pip_multiplier = 100
-        else:
-            pip_size = 0.0001
-            pip_multiplier = 10000
-        sl_distance = abs(entry_price - stop_loss) * pip_multiplier
-        if sl_distance == 0:
-            return 0
-        return risk_usd / (sl_distance * pip_size)
-
     def check_instrument_availability():
-        return not any(tr['instrument'] == instrument and tr['close_price'] is None for tr in trades)
+        return ledger.is_available(instrument)
 
     def execute_trade(signal, entry_price, date=None, time=None):
-        nonlocal trades_made, account_balance
         units = calculate_units(account_balance, risk_percent, entry_price, signal['stop_loss'], signal['instrument'])
-        trade = {
-            "trade_id": trades_made,
-            "instrument": signal['instrument'],
-            "action": signal['action'],
-            "entry_price": entry_price,
-            "stop_loss": signal['stop_loss'],
-            "original_stop_loss": signal['stop_loss'],
-            "take_profit": signal['take_profit'],
-            "original_take_profit": signal['take_profit'],
-            "units": units,
-            "open_price": entry_price,
-            "highest_price": entry_price,
-            "lowest_price": entry_price,
-            "close_price": None,
-            "be_reached": False,
-            "win": None,
-            "profit": None,
-            "profit_pips": None,
-            "profit_usd": None,
-            "%_TP_reached": False,
-        }
-        trades.append(trade)
-        trades_made += 1
+        trade = ledger.open(signal['instrument'], signal['action'], entry_price,
+                            signal['stop_loss'], signal['take_profit'], units)
         stategy_assesment_metrics.append({
             "entry_price": entry_price,
             "stop_loss": signal['stop_loss'],
@@ -80,294 +255,364 @@ def run_backtest(
             "units": units,
         })
         if debug:
-            print(f"Opened trade: {trade['action']} at {entry_price}, Units: {units}")
+            print(f"Opened trade: {trade.action} at {entry_price}, Units: {units}")
         return trade
 
-    def update_positions(candle):
-        nonlocal trades_closed, account_balance
-        for tr in trades:
-            if tr['close_price'] is not None:
-                continue
+    def update_positions(candle, idx):
+        for tr in ledger.iter_open():
+            action = tr.action
+            entry_price = tr.entry_price
 
-            action = tr['action']
-            entry_price = tr['entry_price']
-
-            tr['highest_price'] = max(tr['highest_price'], candle['high'])
-            tr['lowest_price'] = min(tr['lowest_price'], candle['low'])
+            tr.highest_price = max(tr.highest_price, candle['high'])
+            tr.lowest_price = min(tr.lowest_price, candle['low'])
 
             # Trailing stop logic if enabled
             if trail_on:
-                if not tr['%_TP_reached']:
-                    tp_distance = abs(tr["take_profit"] - entry_price)
+                if not tr.tp_pct_reached:
+                    tp_distance = abs(tr.take_profit - entry_price)
                     trigger_price = entry_price + trail_start * tp_distance if action == 'buy' else entry_price - trail_start * tp_distance
                     if (action == 'buy' and candle['high'] >= trigger_price) or (action == 'sell' and candle['low'] <= trigger_price):
-                        tr['%_TP_reached'] = True
+                        tr.tp_pct_reached = True
 
-                if not tr['be_reached']:
-                    risk_distance = abs(entry_price - tr['stop_loss'])
+                if not tr.be_reached:
+                    risk_distance = abs(entry_price - tr.stop_loss)
                     if (action == 'buy' and candle['high'] - entry_price >= risk_distance) or \
                        (action == 'sell' and entry_price - candle['low'] >= risk_distance):
-                        tr['be_reached'] = True
+                        tr.be_reached = True
 
-                if tr['be_reached']:
+                if tr.be_reached:
                     trail_dist = strat.get_trailing_stop_distance_if_triggered(candle, tr, trail_start, trail_distance)
                     if trail_dist is not None:
-                        tr["take_profit"] = None
+                        tr.take_profit = None
                         if action == 'buy':
-                            new_stop = tr['highest_price'] - trail_dist
-                            if new_stop > tr['stop_loss']:
-                                tr['stop_loss'] = round(new_stop, 6)
+                            new_stop = tr.highest_price - trail_dist
+                            if new_stop > tr.stop_loss:
+                                tr.stop_loss = round(new_stop, 6)
                         elif action == 'sell':
-                            new_stop = tr['lowest_price'] + trail_dist
-                            if new_stop < tr['stop_loss']:
-                                tr['stop_loss'] = round(new_stop, 6)
+                            new_stop = tr.lowest_price + trail_dist
+                            if new_stop < tr.stop_loss:
+                                tr.stop_loss = round(new_stop, 6)
 
             # Check exit conditions
             hit_tp = hit_sl = False
             if action == 'buy':
-                if tr["take_profit"]:
-                    hit_tp = candle['high'] >= tr['take_profit']
-                hit_sl = candle['low'] <= tr['stop_loss']
+                if tr.take_profit:
+                    hit_tp = candle['high'] >= tr.take_profit
+                hit_sl = candle['low'] <= tr.stop_loss
             else:
-                if tr["take_profit"]:
-                    hit_tp = candle['low'] <= tr['take_profit']
-                hit_sl = candle['high'] >= tr['stop_loss']
+                if tr.take_profit:
+                    hit_tp = candle['low'] <= tr.take_profit
+                hit_sl = candle['high'] >= tr.stop_loss
 
             if not hit_tp and not hit_sl:
                 continue
 
             # Resolve exit
             if hit_tp and hit_sl:
-                price, win = tr['stop_loss'], False
+                price, win = tr.stop_loss, False
             elif hit_tp:
-                price, win = tr['take_profit'], True
+                price, win = tr.take_profit, True
             elif hit_sl:
-                price, win = tr['stop_loss'], False
+                price, win = tr.stop_loss, False
 
-            tr['close_price'] = price
-            tr['win'] = win
-            tr['profit'] = round(price - entry_price, 6) if action == 'buy' else round(entry_price - price, 6)
-            tr['profit_pips'] = round(tr['profit'] * 10000, 1)
-            tr['profit_usd'] = round(tr['profit'] * tr['units'], 2)
-            account_balance += tr['profit_usd']
-            completed_trades.append(tr)
-            trades_closed += 1
+            close_trade(tr, price, win, idx)
 
-    # --- Load historical data ---
-    historical_candles = pd.read_csv('EURUSD5.csv')
-    historical_candles = historical_candles.tail(candle_counter).reset_index(drop=True)
-
-    # --- Backtest loop ---
-    start_time = time.perf_counter()  # start timer once before the loop
-
-    for idx, row in historical_candles.iterrows():
-        if idx % 200 == 0 and idx != 0:  # skip 0
-            end_time = time.perf_counter()
-            print(f'Candle count: {idx}, {candle_counter-idx} left')
-            print(f'Time elapsed for last 200 candles: {end_time - start_time:.4f} seconds')
-            start_time = time.perf_counter()  # reset timer for next batch
-        candle = {
-            "open": float(row['open']),
-            "high": float(row['high']),
-            "low": float(row['low']),
-            "close": float(row['close'])
-        }
-        update_positions(candle)
+    def close_trade(tr, price, win, bar):
+        nonlocal trades_closed, account_balance
+        tr.close_price = price
+        tr.win = win
+        tr.close_bar = bar
+        tr.profit = round(price - tr.entry_price, 6) if tr.action == 'buy' else round(tr.entry_price - price, 6)
+        tr.profit_pips = round(tr.profit / pip_size(tr.instrument), 1)
+        tr.profit_usd = round(tr.profit * tr.units, 2)
+        account_balance += tr.profit_usd
+        ledger.close(tr)
+        trades_closed += 1
+
+    signals = signal_frame['signal'].to_numpy()
+    stop_losses = signal_frame['stop_loss'].to_numpy()
+    take_profits = signal_frame['take_profit'].to_numpy()
+    opens = candles['open'].to_numpy(dtype=float)
+    highs = candles['high'].to_numpy(dtype=float)
+    lows = candles['low'].to_numpy(dtype=float)
+    closes = candles['close'].to_numpy(dtype=float)
+    dates = candles['date'].to_numpy() if 'date' in candles else None
+    times = candles['time'].to_numpy() if 'time' in candles else None
+    candle_count = len(candles)
+
+    if exit_mode in ('vectorized', 'intrabar'):
+        # --- Batch exits: resolve every signal as if it were taken, then keep the ones that
+        # find the instrument free (a signal on the bar a trade closes can open the next one) ---
+        with span('exits'):
+            signal_idx, entry_prices, exits = resolve_signal_exits(candles, signal_frame, trail_on, trail_start,
+                                                                   trail_distance, exit_mode, sub_candles)
+        free_from = 0
+        for i, idx in enumerate(signal_idx):
+            action = "buy" if signals[idx] > 0 else "sell"
+            if verbose:
+                print(f"Signal: TRADE TRIGGERED: {action} on {instrument}")
+            if idx < free_from:
+                continue
+            signal = {"instrument": instrument, "action": action,
+                      "stop_loss": float(stop_losses[idx]), "take_profit": float(take_profits[idx])}
+            tr = execute_trade(signal, float(entry_prices[i]),
+                               dates[idx] if dates is not None else None,
+                               times[idx] if times is not None else None)
+            tr.open_bar = min(idx + 1, candle_count - 1)
+            tr.stop_loss = exits['stop_loss'][i]
+            tr.take_profit = tr.take_profit if exits['take_profit_active'][i] else None
+            tr.highest_price = exits['highest_price'][i]
+            tr.lowest_price = exits['lowest_price'][i]
+            tr.be_reached = bool(exits['be_reached'][i])
+            tr.tp_pct_reached = bool(exits['tp_pct_reached'][i])
+            if exits['exit_idx'][i] < 0:
+                free_from = candle_count  # open until the end of the data
+            else:
+                close_trade(tr, exits['exit_price'][i], bool(exits['win'][i]), int(exits['exit_idx'][i]))
+                free_from = exits['exit_idx'][i]
+    elif exit_mode == 'loop':
+        strat = get_strategy(strategy).load()  # update_positions uses its trailing stop rule
+        update = timed('update_positions', update_positions)
 
-        if idx < 200:
-            continue
+        # --- Backtest loop ---
+        start_time = time.perf_counter()  # start timer once before the loop
 
-        number_of_required_candles_for_strategy = min_number_of_required_candles_for_strategy
-        start_idx = max(0, idx - number_of_required_candles_for_strategy + 1)
-        recent_candles = historical_candles.iloc[start_idx:idx+1].to_dict('records')
-        signal = strat.run(recent_candles, instrument=instrument)
-        if(signal['action'] == 'buy' or signal['action'] == 'sell'):
-            print(f'Signal: TRADE TRIGGERED: {signal['action']} on {signal['instrument']}')
-        if signal['action'] != 'hold' and check_instrument_availability():
-            entry_price = float(historical_candles.iloc[idx + 1]['open']) if idx + 1 < len(historical_candles) else candle['close']
-            execute_trade(signal, entry_price, row.get('date'), row.get('time'))
+        for idx in range(candle_count):
+            if verbose and idx % 200 == 0 and idx != 0:  # skip 0
+                end_time = time.perf_counter()
+                print(f'Candle count: {idx}, {candle_count-idx} left')
+                print(f'Time elapsed for last 200 candles: {end_time - start_time:.4f} seconds')
+                start_time = time.perf_counter()  # reset timer for next batch
+            candle = {
+                "open": opens[idx],
+                "high": highs[idx],
+                "low": lows[idx],
+                "close": closes[idx]
+            }
+            update(candle, idx)
+
+            if signals[idx] == 0:
+                continue
+            signal = {
+                "instrument": instrument,
+                "action": "buy" if signals[idx] > 0 else "sell",
+                "stop_loss": float(stop_losses[idx]),
+                "take_profit": float(take_profits[idx]),
+            }
+            if verbose:
+                print(f"Signal: TRADE TRIGGERED: {signal['action']} on {signal['instrument']}")
+            if check_instrument_availability():
+                entry_price = float(opens[idx + 1]) if idx + 1 < candle_count else candle['close']
+                tr = execute_trade(signal, entry_price,
+                                   dates[idx] if dates is not None else None,
+                                   times[idx] if times is not None else None)
+                tr.open_bar = min(idx + 1, candle_count - 1)
+    else:
+        raise ValueError(f"Unknown exit_mode: {exit_mode}")
 
     # Force close any remaining trades
-    for tr in trades:
-        if tr['close_price'] is None:
-            tr['close_price'] = historical_candles.iloc[-1]['close']
-            tr['profit'] = tr['close_price'] - tr['entry_price'] if tr['action'] == 'buy' else tr['entry_price'] - tr['close_price']
-            tr['profit_pips'] = round(tr['profit'] * 10000, 1)
-            tr['profit_usd'] = round(tr['profit'] * tr['units'], 2)
-            tr['win'] = tr['profit'] > 0
-            account_balance += tr['profit_usd']
-            completed_trades.append(tr)
-
-    trades.clear()
-
-    # --- Metrics Calculation ---
-    def calculate_metrics(trade_list):
-        if not trade_list:
-            return {}
-        total = len(trade_list)
-        wins = [t for t in trade_list if t['profit_usd'] > 0]
-        losses = [t for t in trade_list if t['profit_usd'] < 0]
-        breakeven = [t for t in trade_list if round(t['profit_usd'], 2) == 0]
-
-        rr_list = []
-        for t in trade_list:
-            if t['close_price'] is not None and t.get('original_stop_loss') is not None:
-                risk = abs(t['entry_price'] - t['original_stop_loss'])
-                reward = abs(t['close_price'] - t['entry_price'])
-                if risk > 0:
-                    rr_list.append(reward / risk)
-        avg_rrr = round(sum(rr_list) / len(rr_list), 2) if rr_list else 0.0
-
-        total_usd = sum(t['profit_usd'] for t in trade_list)
-        win_rate = len(wins) / total * 100 if total else 0
-        avg_win = sum(t['profit_usd'] for t in wins) / len(wins) if wins else 0
-        avg_loss = sum(t['profit_usd'] for t in losses) / len(losses) if losses else 0
-        profit_factor = (sum(t['profit_usd'] for t in wins) / abs(sum(t['profit_usd'] for t in losses))) if losses else float('inf')
-
-        be_reached = [t for t in trade_list if t.get('be_reached')]
-        trail_start_reached = [t for t in trade_list if t.get('%_TP_reached')]
-        trail_failures = [t for t in trail_start_reached if t['profit_usd'] <= 0]
-        trail_successes = [t for t in trail_start_reached if t['profit_usd'] > 0]
-
-        pct_tp_captured = []
-        for t in trail_start_reached:
-            tp_distance = abs(t['original_take_profit'] - t['entry_price'])
-            if tp_distance > 0:
-                profit_distance = abs(t['close_price'] - t['entry_price'])
-                pct_tp_captured.append((profit_distance / tp_distance) * 100)
-        avg_pct_tp_captured = sum(pct_tp_captured) / len(pct_tp_captured) if pct_tp_captured else 0
-
-        trades_hit_tp = [t for t in trade_list if t['win']]
-        win_rate_tp = round(len(trades_hit_tp) / total * 100, 2) if total else 0
-
-        return {
-            'total_trades': total,
-            'wins': len(wins),
-            'losses': len(losses),
-            'breakeven': len(breakeven),
-            'win_rate': round(win_rate, 2),
-            'avg_win': round(avg_win, 2),
-            'avg_loss': round(avg_loss, 2),
-            'profit_factor': round(profit_factor, 2),
-            'be_reached_count': len(be_reached),
-            'be_reached_pct': round(len(be_reached) / total * 100, 2) if total else 0,
-            'trail_start_reached_count': len(trail_start_reached),
-            'trail_start_reached_pct': round(len(trail_start_reached) / total * 100, 2) if total else 0,
-            'trail_failures': len(trail_failures),
-            'trail_successes': len(trail_successes),
-            'avg_pct_tp_captured': round(avg_pct_tp_captured, 2),
-            'avg_rrr': avg_rrr,
-            'win_rate_tp': win_rate_tp
-        }
+    for tr in ledger.iter_open():
+        tr.close_price = float(closes[-1])
+        tr.close_bar = candle_count - 1
+        tr.profit = tr.close_price - tr.entry_price if tr.action == 'buy' else tr.entry_price - tr.close_price
+        tr.profit_pips = round(tr.profit / pip_size(tr.instrument), 1)
+        tr.profit_usd = round(tr.profit * tr.units, 2)
+        tr.win = tr.profit > 0
+        account_balance += tr.profit_usd
+        ledger.close(tr)
 
-    metrics = calculate_metrics(completed_trades)
-
-    # --- Save trades and metrics into results_directory/folder_name/{results,metrics} ---
-    # Prepare run folder and subfolders (always create them so charts have a place)
-    run_folder = os.path.join(results_directory, folder_name)
-    results_subdir = os.path.join(run_folder, "results")
-    metrics_subdir = os.path.join(run_folder, "metrics")
-    os.makedirs(results_subdir, exist_ok=True)
-    os.makedirs(metrics_subdir, exist_ok=True)
-
-    # Save trades CSV (only if trades exist)
-    if completed_trades:
-        trades_csv_path = os.path.join(results_subdir, csv_filename)
-        with open(trades_csv_path, "w", newline="", encoding="utf-8") as file:
-            writer = csv.DictWriter(file, fieldnames=list(completed_trades[0].keys()))
-            writer.writeheader()
-            for tr in completed_trades:
-                writer.writerow(tr)
-    else:
-        trades_csv_path = None
+    return ledger.completed, account_balance
 
-    # Save metrics CSV (always create file with header; write values if present)
-    metrics_csv_path = os.path.join(metrics_subdir, metric_filename)
-    with open(metrics_csv_path, "w", newline="", encoding="utf-8") as file:
-        writer = csv.writer(file)
-        writer.writerow(["Metric", "Value"])
-        if metrics:
-            for k, v in metrics.items():
-                writer.writerow([k, v])
 
-    details_path = os.path.join(run_folder, details_file)
-    with open(details_path, "w", newline="", encoding="utf-8") as file:
-        writer = csv.writer(file)
-        writer.writerow([instrument, risk_percent, starting_balance, candle_counter, trail_on, trail_distance])
+@instrumentable
+def run_backtest(
+    instrument="EUR_USD",
+    risk_percent=0.01,
+    starting_balance=850,
+    candle_counter=2016,
+    trail_on=False,
+    trail_start=0.7,
+    trail_distance=0.25,
+    min_number_of_required_candles_for_strategy=200,
+    debug=False,
+    csv_filename="trades_made_1",
+    folder_name="results_set_1",
+    metric_filename="metric_set_1",
+    results_directory='results_sets',
+    details_file='details_set_1.txt',
+    signal_mode='vectorized',
+    candles=None,
+    signal_frame=None,
+    exit_mode='vectorized',
+    granularity='M5',
+    start=None,
+    end=None,
+    csv_path='EURUSD5.csv',
+    store_directory=candle_store.STORE_DIRECTORY,
+    strategy=DEFAULT_STRATEGY,
+    strategy_params=None,
+    intrabar_granularity='M1',
+    intrabar_csv_path=None,
+    intrabar_chunk_rows=1_000_000,
+    cache_directory=None,
+    charts=False,
+    write_files=True
+):
+    # Candles come from the columnar store for instrument/granularity, limited to [start, end)
+    # and then to the last candle_counter rows. csv_path is only read to build the store the first
+    # time (or after the CSV changes).
+    # signal_mode: see generate_signals, exit_mode: see simulate_positions
+    # candles / signal_frame: already loaded candles and generate_signals output (used by the sweep
+    # so every permutation shares one copy instead of re-reading the CSV and recomputing signals)
+    # strategy / strategy_params: registered strategy name and its parameters (see strategy_registry)
+    # intrabar_*: with exit_mode='intrabar', exits are resolved on the instrument's intrabar_granularity
+    # series ('M1', 'tick', ...) from the store (built from intrabar_csv_path), streamed
+    # intrabar_chunk_rows rows at a time over the candles' time range
+    # cache_directory: ResultCache directory; a run whose candles, strategy/engine source and
+    # parameters (and signal_frame, when one is given) match a cached one skips signals and
+    # simulation (and charts already drawn)
+    # charts: draw the PNG charts now; otherwise only the series they are drawn from are saved, for
+    # charts.save_backtest_charts / render_sweep_charts to draw later
+    # write_files: False writes nothing under results_directory (the caller stores the returned
+    # trades and metrics itself, e.g. in a results_db.ResultsDB)
+    # instrumentation_path / profile (keyword only, see instrumentation.instrumentable): time this run's
+    # spans and write them there (.json, or .prom for Prometheus text) / write its cProfile stats there
 
+    # --- Load historical data ---
+    if candles is None:
+        with span('data_load'):
+            historical_candles = candle_store.load_candles(instrument, granularity, start=start, end=end,
+                                                           rows=candle_counter, store_directory=store_directory,
+                                                           csv_path=csv_path)
+    else:
+        historical_candles = candles
+
+    # --- Result cache: a run seen before skips both stages ---
+    result_cache = ResultCache(cache_directory) if cache_directory else None
+    cached = None
+    if result_cache is not None:
+        spec = get_strategy(strategy)
+        cache_params = {
+            'instrument': instrument, 'risk_percent': risk_percent, 'starting_balance': starting_balance,
+            'trail_on': trail_on, 'trail_start': trail_start, 'trail_distance': trail_distance,
+            'lookback': min_number_of_required_candles_for_strategy, 'signal_mode': signal_mode,
+            'exit_mode': exit_mode, 'strategy': spec.name, 'strategy_params': spec.validate_params(strategy_params),
+        }
+        if exit_mode == 'intrabar':
+            intrabar_source = os.stat(intrabar_csv_path) if intrabar_csv_path and os.path.exists(intrabar_csv_path) else None
+            cache_params['intrabar'] = [intrabar_granularity,
+                                        candle_store.read_meta(instrument, intrabar_granularity, store_directory),
+                                        intrabar_source and [intrabar_source.st_size, intrabar_source.st_mtime]]
+        if spec.timeframes and candles is None and signal_mode == 'vectorized':
+            # Higher-timeframe bars come from the whole stored series (see load_timeframes), not just
+            # these candles, so the base and derived series' store state is part of the key
+            cache_params['timeframes'] = [candle_store.read_meta(instrument, granularity, store_directory)] + [
+                candle_store.read_meta(instrument, derive_series(instrument, timeframe, granularity,
+                                                                 store_directory=store_directory, csv_path=csv_path),
+                                       store_directory)
+                for timeframe in sorted(spec.timeframes)]
+        if signal_frame is not None:
+            # Supplied signals replace the ones the parameters above would generate
+            cache_params['signals'] = dataset_fingerprint(signal_frame, ('signal', 'stop_loss', 'take_profit'))
+        cache_key = result_key(dataset_fingerprint(historical_candles), spec.module_path, cache_params)
+        with span('cache.get'):
+            cached = result_cache.get(cache_key)
+
+    if cached is not None:
+        completed_trades, account_balance, metrics, _ = cached
+        print(f"Cached result {cache_key}: {len(completed_trades)} trades")
+    else:
+        # --- Stage 1: signals (cached per instrument, dataset and strategy params) ---
+        if signal_frame is None:
+            timeframes = None
+            if candles is None and signal_mode == 'vectorized':
+                timeframes = load_timeframes(strategy, instrument, granularity, store_directory, csv_path)
+            signal_frame = generate_signals(historical_candles, instrument=instrument,
+                                            lookback=min_number_of_required_candles_for_strategy,
+                                            signal_mode=signal_mode, strategy=strategy,
+                                            strategy_params=strategy_params, granularity=granularity,
+                                            timeframes=timeframes)
+
+        # --- Stage 2: position simulation (the only part that depends on risk/trailing params) ---
+        sub_candles = None
+        if exit_mode == 'intrabar':
+            if 'time' not in historical_candles:
+                raise ValueError("exit_mode='intrabar' needs candles with a time column")
+            candle_times = historical_candles['time']
+            candle_end = candle_times.iloc[-1] + pd.Timedelta(seconds=candle_store.GRANULARITY_SECONDS[granularity])
+            sub_candles = candle_store.iter_candles(instrument, intrabar_granularity, start=candle_times.iloc[0],
+                                                    end=candle_end, chunk_rows=intrabar_chunk_rows,
+                                                    store_directory=store_directory, csv_path=intrabar_csv_path)
+        with span('simulate'):
+            completed_trades, account_balance = simulate_positions(
+                historical_candles, signal_frame, instrument, risk_percent, starting_balance,
+                trail_on, trail_start, trail_distance, debug, exit_mode, strategy, sub_candles, verbose=True
+            )
+
+        # --- Metrics Calculation ---
+        with span('metrics'):
+            metrics = calculate_metrics(completed_trades, starting_balance, len(historical_candles))
+
+        if result_cache is not None:
+            with span('cache.put'):
+                result_cache.put(cache_key, completed_trades, account_balance, metrics, starting_balance,
+                                 label=f"{instrument} {strategy} {cache_params}")
 
     # --- Equity curve, drawdowns, cumulative pips ---
-    equity_curve = [starting_balance]
-    balance = starting_balance
-    for t in completed_trades:
-        balance += t['profit_usd']
-        equity_curve.append(balance)
-
-    drawdowns = []
-    peak = starting_balance
-    balance = starting_balance
-    for t in completed_trades:
-        balance += t['profit_usd']
-        peak = max(peak, balance)
-        drawdowns.append(peak - balance)
-
-    profits_usd = [t['profit_usd'] for t in completed_trades]
-
-    cum_pips = [0]
-    total = 0
-    for t in completed_trades:
-        total += t['profit_pips']
-        cum_pips.append(total)
-
-    # --- Plots ---
-    def save_backtest_charts(equity_curve, drawdowns, profits_usd, cum_pips, instrument, folder_name):
-        os.makedirs(folder_name, exist_ok=True)
-
-        # Equity Curve
-        plt.figure(figsize=(8, 5))
-        plt.plot(equity_curve, label="Equity Curve")
-        plt.title(f"{instrument} Equity Curve")
-        plt.xlabel("Trades")
-        plt.ylabel("Account Balance ($)")
-        plt.legend()
-        plt.grid(True)
-        plt.savefig(os.path.join(folder_name, f"{instrument}_equity_curve.png"), dpi=300)
-        plt.close()
-
-        # Drawdown
-        plt.figure(figsize=(8, 5))
-        plt.plot(drawdowns, color='red')
-        plt.title("Drawdown over Time")
-        plt.xlabel("Trades")
-        plt.ylabel("Drawdown ($)")
-        plt.grid(True)
-        plt.savefig(os.path.join(folder_name, f"{instrument}_drawdown.png"), dpi=300)
-        plt.close()
-
-        # Profit Distribution
-        plt.figure(figsize=(8, 5))
-        plt.hist(profits_usd, bins=30, edgecolor='black')
-        plt.title("Distribution of Trade Profits")
-        plt.xlabel("Profit (USD)")
-        plt.ylabel("Frequency")
-        plt.savefig(os.path.join(folder_name, f"{instrument}_profit_distribution.png"), dpi=300)
-        plt.close()
-
-        # Cumulative Pips
-        plt.figure(figsize=(8, 5))
-        plt.plot(cum_pips)
-        plt.title("Cumulative Pips Over Time")
-        plt.xlabel("Trades")
-        plt.ylabel("Pips")
-        plt.savefig(os.path.join(folder_name, f"{instrument}_cumulative_pips.png"), dpi=300)
-        plt.close()
-
-    # Save charts into the results subfolder so charts live under results_directory/folder_name/results/
-    save_backtest_charts(equity_curve, drawdowns, profits_usd, cum_pips, instrument, results_subdir)
+    profits_usd = np.array([t['profit_usd'] for t in completed_trades], dtype=float)
+    profit_pips = np.array([t['profit_pips'] for t in completed_trades], dtype=float)
+    equity_curve, drawdowns = equity_curves(profits_usd, starting_balance)
+    cum_pips = np.r_[0.0, np.cumsum(profit_pips)]
+
+    if write_files:
+        with span('io.write'):
+            # --- Save trades and metrics into results_directory/folder_name/{results,metrics} ---
+            # (skipped for sweeps that write to a ResultsDB instead)
+            # Prepare run folder and subfolders (always create them so charts have a place)
+            run_folder = os.path.join(results_directory, folder_name)
+            results_subdir = os.path.join(run_folder, "results")
+            metrics_subdir = os.path.join(run_folder, "metrics")
+            os.makedirs(results_subdir, exist_ok=True)
+            os.makedirs(metrics_subdir, exist_ok=True)
+
+            # Save trades CSV (only if trades exist)
+            if completed_trades:
+                trades_csv_path = os.path.join(results_subdir, csv_filename)
+                with open(trades_csv_path, "w", newline="", encoding="utf-8") as file:
+                    writer = csv.DictWriter(file, fieldnames=TRADE_COLUMNS)
+                    writer.writeheader()
+                    for tr in completed_trades:
+                        writer.writerow(tr.to_dict())
+            else:
+                trades_csv_path = None
+
+            # Save metrics CSV (always create file with header; write values if present)
+            metrics_csv_path = os.path.join(metrics_subdir, metric_filename)
+            with open(metrics_csv_path, "w", newline="", encoding="utf-8") as file:
+                writer = csv.writer(file)
+                writer.writerow(["Metric", "Value"])
+                if metrics:
+                    for k, v in metrics.items():
+                        writer.writerow([k, v])
+
+            details_path = os.path.join(run_folder, details_file)
+            with open(details_path, "w", newline="", encoding="utf-8") as file:
+                writer = csv.writer(file)
+                writer.writerow([instrument, risk_percent, starting_balance, candle_counter, trail_on, trail_distance])
+
+            series_path = write_chart_series(results_subdir, instrument, equity_curve, drawdowns, profits_usd,
+                                             cum_pips)
+
+        # --- Plots ---
+        # The series are always saved next to the trades; the PNGs are only drawn on request
+        # (a cached run keeps the charts it already has)
+        if charts and (cached is None or not all(os.path.exists(path) for path in chart_paths(results_subdir, instrument))):
+            with span('charts'):
+                save_backtest_charts(series_path)
 
     # --- Print summary ---
-    total_usd = sum(t['profit_usd'] for t in completed_trades)
-    total_pips = sum(t['profit_pips'] for t in completed_trades)
+    total_usd = round(float(equity_curve[-1]) - starting_balance, 2)
+    total_pips = round(float(cum_pips[-1]), 1)
     percentage_PL = (total_usd / starting_balance) * 100
 
     print("\n" + "="*40)
@@ -386,27 +631,29 @@ def run_backtest(
     return completed_trades, account_balance, metrics
 
 
-min_number_of_required_candles_for_strategy = 300
-
-test_risk_percent_values = [0.01, 0.03, 0.05, 0.1]
-test_trail_start_values = [0.3, 0.5, 0.7, 0.9]
-test_trail_on = [True, False]
-test_trail_distance_valuse = [0.1, 0.25, 0.5, 0.75, 0.9]
-master_directory = 'master_set_1' # the name of the top level directory for your results to be stored in eg: if the name is "master_set_1", results will be stored like: master_set_1/results_set_1, master_set_1/results_set_2 etc
-
-
-permutations = len(test_trail_on) * len(test_risk_percent_values) * len(test_trail_start_values) * len(test_trail_distance_valuse) # 160
-counter = 0
-start_time = time.perf_counter()
-for trail_on in test_trail_on:
-    for risk_percent in test_risk_percent_values:
-        for start_values in test_trail_start_values:
-            for trail_distance in test_trail_distance_valuse:
-                counter += 1
-                print(f'Permutation: {counter} of {permutations}, {permutations-counter} remaining')
-                results_filename = f'results_permutation_{counter}.csv'
-                folder_name = f'results_set_{counter}'
-                metric_filename = f'metrics_{counter}.csv' 
-                run_backtest('EUR_USD', risk_percent, 850, 8928, trail_on, start_values, trail_distance, min_number_of_required_candles_for_strategy, False, results_filename, folder_name, metric_filename, master_directory)
-                end_time = time.perf_counter()
-                print(f'time elapsed for session {counter}: {end_time-start_time}')
\ No newline at end of file
+if __name__ == "__main__":
+    import argparse
+    from sweep import run_sweep
+
+    parser = argparse.ArgumentParser(description='Parameter sweep over the backtest')
+    parser.add_argument('--instrumentation', metavar='PATH',
+                        help='time the sweep\'s spans and write them there (.json, or .prom for Prometheus text)')
+    parser.add_argument('--profile', metavar='PATH', help='write cProfile stats of the sweep (parent process) there')
+    args = parser.parse_args()
+
+    min_number_of_required_candles_for_strategy = 300
+
+    param_grid = {
+        'trail_on': [True, False],
+        'risk_percent': [0.01, 0.03, 0.05, 0.1],
+        'trail_start': [0.3, 0.5, 0.7, 0.9],
+        'trail_distance': [0.1, 0.25, 0.5, 0.75, 0.9],
+    }  # 160 permutations
+    master_directory = 'master_set_1' # the name of the top level directory for your results to be stored in eg: if the name is "master_set_1", results will be stored like: master_set_1/results_set_1, master_set_1/results_set_2 etc
+
+    start_time = time.perf_counter()
+    sweep_results = run_sweep(param_grid, instrument='EUR_USD', starting_balance=850, candle_counter=8928,
+                              lookback=min_number_of_required_candles_for_strategy, results_directory=master_directory,
+                              charts_top_n=10, instrumentation_path=args.instrumentation, profile=args.profile)
+    print(sweep_results.sort_values('profit_factor', ascending=False).head(10).to_string(index=False))
+    print(f'time elapsed for sweep: {time.perf_counter()-start_time}')
@@ -0,0 +1,209 @@
+import math
+from operator import itemgetter
+
+import numpy as np
+
+# Trade statistics computed on arrays instead of one Python pass per metric.
+#
+# batch_metrics scores a 2D batch of trade PnLs (one row per run, NaN-padded to the longest run),
+# so many permutations are scored in one call. calculate_metrics gathers a trade list's fields in
+# one pass and adds the statistics that need more than the PnL (breakeven, trailing, reward:risk).
+#
+# Sums go through np.cumsum, which adds left to right like the built-in sum, so the values match
+# what the per-trade loops produced before to the last bit.
+
+_FIELDS = ('profit_usd', 'profit_pips', 'entry_price', 'close_price', 'original_stop_loss',
+           'original_take_profit', 'be_reached', '%_TP_reached', 'win')
+_get_fields = itemgetter(*_FIELDS)
+
+
+def _running_total(values):
+    """Left-to-right sums along the last axis, as sum() would add them (0 for an empty row)"""
+    if values.shape[-1] == 0:
+        return np.zeros(values.shape[:-1])
+    return np.cumsum(values, axis=-1)[..., -1]
+
+
+def pad_rows(rows):
+    """List of 1D arrays (one per run) -> 2D float array, shorter rows padded with NaN"""
+    width = max((len(row) for row in rows), default=0)
+    padded = np.full((len(rows), width), np.nan)
+    for i, row in enumerate(rows):
+        padded[i, :len(row)] = row
+    return padded
+
+
+def trade_arrays(trade_list):
+    """Columns of the fields the metrics use, gathered in one pass (None becomes NaN)"""
+    values = np.array([_get_fields(t) for t in trade_list], dtype=float).reshape(-1, len(_FIELDS))
+    return {field: values[:, i] for i, field in enumerate(_FIELDS)}
+
+
+def equity_curves(pnl, starting_balance):
+    """
+    Balance and drawdown after every trade.
+
+    Args:
+        pnl: 1D or 2D (runs x trades, NaN-padded) trade profits in account currency
+
+    Returns:
+        (balances, drawdowns): balances start with starting_balance (one column longer than pnl),
+        drawdowns are the fall from the running peak after each trade
+    """
+    pnl = np.nan_to_num(np.asarray(pnl, dtype=float))
+    start = np.full(pnl.shape[:-1] + (1,), float(starting_balance))
+    balances = np.concatenate([start, starting_balance + np.cumsum(pnl, axis=-1)], axis=-1)
+    drawdowns = np.maximum.accumulate(balances, axis=-1)[..., 1:] - balances[..., 1:]
+    return balances, drawdowns
+
+
+def batch_metrics(pnl, starting_balance, bars_held=None, total_bars=None):
+    """
+    Score many runs at once from their trade PnLs.
+
+    Args:
+        pnl: 2D array, one row of trade profits (in close order) per run, NaN after a run's last
+            trade (pad_rows builds it from ragged lists); a 1D array is one run
+        starting_balance: balance every run starts from (scalar or one per run)
+        bars_held, total_bars: candles each trade was open (same shape as pnl) and candles in the
+            test, for exposure
+
+    Returns:
+        dict of metric -> array with one (unrounded) value per run:
+            total_trades, wins, losses, breakeven, win_rate, avg_win, avg_loss, profit_factor,
+            total_profit, final_balance, max_drawdown (currency), max_drawdown_pct (of the peak),
+            max_drawdown_duration (trades from a peak until it is regained), sharpe and sortino
+            (per trade, on returns relative to the balance before each trade, not annualised),
+            mar (return over the test / max drawdown, both in percent) and exposure (percent of
+            candles with a trade open, when bars_held and total_bars are given)
+    """
+    pnl = np.atleast_2d(np.asarray(pnl, dtype=float))
+    starting_balance = np.broadcast_to(np.asarray(starting_balance, dtype=float), pnl.shape[:1])[:, None]
+    valid = ~np.isnan(pnl)
+    profits = np.where(valid, pnl, 0.0)
+    total = valid.sum(axis=1)
+    has_trades = total > 0
+
+    wins = profits > 0
+    losses = profits < 0
+    win_count = wins.sum(axis=1)
+    loss_count = losses.sum(axis=1)
+    win_sum = _running_total(np.where(wins, profits, 0.0))
+    loss_sum = _running_total(np.where(losses, profits, 0.0))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        metrics = {
+            'total_trades': total,
+            'wins': win_count,
+            'losses': loss_count,
+            'breakeven': (valid & (np.round(profits, 2) == 0)).sum(axis=1),
+            'win_rate': np.where(has_trades, win_count / total * 100, 0.0),
+            'avg_win': np.where(win_count > 0, win_sum / win_count, 0.0),
+            'avg_loss': np.where(loss_count > 0, loss_sum / loss_count, 0.0),
+            'profit_factor': np.where(loss_count > 0, win_sum / np.abs(loss_sum), np.inf),
+        }
+
+        # --- Equity curve: drawdown depth and duration ---
+        balances = np.concatenate([starting_balance, starting_balance + np.cumsum(profits, axis=1)], axis=1)
+        peaks = np.maximum.accumulate(balances, axis=1)
+        drawdowns = peaks - balances
+        positions = np.arange(balances.shape[1])
+        last_peak = np.maximum.accumulate(np.where(balances >= peaks, positions, 0), axis=1)
+        in_run = np.concatenate([np.ones((len(valid), 1), dtype=bool), valid], axis=1)
+        final_balance = balances[:, -1]
+        total_profit = final_balance - starting_balance[:, 0]
+        max_drawdown_pct = np.max(drawdowns / np.where(peaks > 0, peaks, 1), axis=1) * 100
+        return_pct = total_profit / starting_balance[:, 0] * 100
+
+        metrics['total_profit'] = _running_total(profits)
+        metrics['final_balance'] = final_balance
+        metrics['max_drawdown'] = drawdowns.max(axis=1)
+        metrics['max_drawdown_pct'] = max_drawdown_pct
+        metrics['max_drawdown_duration'] = np.where(in_run, positions - last_peak, 0).max(axis=1)
+
+        # --- Risk-adjusted returns, per trade on the balance it was sized from ---
+        returns = np.where(valid, profits / balances[:, :-1], 0.0)
+        mean = np.where(has_trades, returns.sum(axis=1) / total, 0.0)
+        deviations = np.where(valid, returns - mean[:, None], 0.0)
+        std = np.sqrt((deviations ** 2).sum(axis=1) / (total - 1))
+        downside = np.sqrt((np.minimum(returns, 0.0) ** 2).sum(axis=1) / total)
+        metrics['sharpe'] = np.where((total > 1) & (std > 0), mean / std, 0.0)
+        metrics['sortino'] = np.where(downside > 0, mean / downside, np.where(mean > 0, np.inf, 0.0))
+        metrics['mar'] = np.where(max_drawdown_pct > 0, return_pct / max_drawdown_pct,
+                                  np.where(return_pct > 0, np.inf, 0.0))
+
+    if bars_held is not None and total_bars:
+        bars_held = np.atleast_2d(np.asarray(bars_held, dtype=float))
+        metrics['exposure'] = np.minimum(np.nansum(bars_held, axis=1) / total_bars * 100, 100.0)
+    return metrics
+
+
+def calculate_metrics(trade_list, starting_balance=None, total_bars=None):
+    """
+    Win/loss, profit factor, breakeven/trailing and reward:risk statistics of completed trades.
+
+    With starting_balance the balance-based metrics of batch_metrics are added (drawdown,
+    drawdown duration, Sharpe, Sortino, MAR); with total_bars, exposure too (from the trades'
+    open_bar/close_bar).
+    """
+    if not trade_list:
+        return {}
+    columns = trade_arrays(trade_list)
+    pnl = columns['profit_usd']
+    entry = columns['entry_price']
+    close = columns['close_price']
+
+    bars_held = None
+    if total_bars:
+        bars_held = np.array([np.nan if t.open_bar is None or t.close_bar is None else t.close_bar - t.open_bar + 1
+                              for t in trade_list], dtype=float)
+    batch = batch_metrics(pnl, 0.0 if starting_balance is None else starting_balance, bars_held, total_bars)
+    total = len(trade_list)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        risk = np.abs(entry - columns['original_stop_loss'])
+        has_risk = ~np.isnan(close) & (risk > 0)
+        rr = np.abs(close[has_risk] - entry[has_risk]) / risk[has_risk]
+        avg_rrr = round(float(_running_total(rr)) / len(rr), 2) if len(rr) else 0.0
+
+        be_reached = columns['be_reached'] > 0
+        trail_start_reached = columns['%_TP_reached'] > 0
+        tp_distance = np.abs(columns['original_take_profit'] - entry)
+        captured = trail_start_reached & (tp_distance > 0)
+        pct_tp_captured = np.abs(close[captured] - entry[captured]) / tp_distance[captured] * 100
+    avg_pct_tp_captured = float(_running_total(pct_tp_captured)) / len(pct_tp_captured) if len(pct_tp_captured) else 0
+
+    metrics = {
+        'total_trades': total,
+        'wins': int(batch['wins'][0]),
+        'losses': int(batch['losses'][0]),
+        'breakeven': int(batch['breakeven'][0]),
+        'win_rate': round(float(batch['win_rate'][0]), 2),
+        'avg_win': round(float(batch['avg_win'][0]), 2),
+        'avg_loss': round(float(batch['avg_loss'][0]), 2),
+        'profit_factor': round(float(batch['profit_factor'][0]), 2),
+        'be_reached_count': int(be_reached.sum()),
+        'be_reached_pct': round(int(be_reached.sum()) / total * 100, 2),
+        'trail_start_reached_count': int(trail_start_reached.sum()),
+        'trail_start_reached_pct': round(int(trail_start_reached.sum()) / total * 100, 2),
+        'trail_failures': int((trail_start_reached & (pnl <= 0)).sum()),
+        'trail_successes': int((trail_start_reached & (pnl > 0)).sum()),
+        'avg_pct_tp_captured': round(avg_pct_tp_captured, 2),
+        'avg_rrr': avg_rrr,
+        'win_rate_tp': round(int((columns['win'] > 0).sum()) / total * 100, 2),
+    }
+    if starting_balance is not None:
+        for name in ('max_drawdown', 'max_drawdown_pct', 'sharpe', 'sortino', 'mar'):
+            metrics[name] = round(float(batch[name][0]), 2 if name.startswith('max') else 3)
+        metrics['max_drawdown_duration'] = int(batch['max_drawdown_duration'][0])
+    if 'exposure' in batch:
+        metrics['exposure'] = round(float(batch['exposure'][0]), 2)
+    return metrics
+
+
+def objective_score(metrics, objective, min_trades=0):
+    """Value of `objective` in a run's metrics, for ranking runs; too few trades (or no value) ranks it last"""
+    value = metrics.get(objective)
+    if metrics.get('total_trades', 0) < min_trades or value is None or (isinstance(value, float) and math.isnan(value)):
+        return -math.inf
+    return value
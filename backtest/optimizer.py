@@ -0,0 +1,427 @@
+import math
+import os
+import random
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import candle_store
+from main import POSITION_PARAMS, calculate_metrics, generate_signals, simulate_positions
+from metrics import objective_score
+from strategy_registry import DEFAULT_STRATEGY, get_strategy
+from sweep import CANDLE_COLUMNS, _attach, share_frames
+
+# Model-based parameter search, as an alternative to run_sweep's exhaustive grid.
+#
+# A search space mixes simulate_positions parameters (risk_percent, trail_on, trail_start,
+# trail_distance) with the strategy's registered parameters (EMA spans, ATR multipliers, ...):
+#     {'trail_on': [True, False],            list: one of these values
+#      'trail_start': (0.3, 0.9),            float pair: uniform range (rounded to FLOAT_DECIMALS)
+#      'slow_ema_span': (15, 40)}            int pair: integer range
+#
+# 'tpe' proposes candidates from a Tree-structured Parzen Estimator fitted to the trials so far,
+# 'ga' evolves a population with tournament selection, uniform crossover and mutation.
+#
+# Every candidate is simulated once in a worker process (signals are generated once per strategy-param
+# tuple and shared by the candidates that only differ in position params), then checked at each
+# checkpoint from the trades closed by then: a candidate whose drawdown is already too deep, or whose
+# interim objective trails most earlier candidates at the same checkpoint, is pruned there. Results are
+# cached per parameter tuple, so candidates proposed twice are only evaluated once.
+
+FLOAT_DECIMALS = 4
+CHECKPOINTS = (0.25, 0.5, 0.75, 1.0)
+SIGNAL_CACHE_SIZE = 16  # per worker, strategy-param tuples whose signals are kept
+
+# Worker-side state, set once per process by _init_worker
+_shared = {}
+
+
+# --- Search space ---
+def _dimension(name, values):
+    if isinstance(values, list):
+        return {'name': name, 'kind': 'choice', 'choices': values}
+    if isinstance(values, tuple) and len(values) == 2:
+        low, high = values
+        kind = 'int' if isinstance(low, int) and isinstance(high, int) else 'float'
+        return {'name': name, 'kind': kind, 'low': low, 'high': high}
+    raise ValueError(f"Search space entry {name} must be a list of values or a (low, high) pair, got {values!r}")
+
+
+def _sample(dimension, rng):
+    if dimension['kind'] == 'choice':
+        return rng.choice(dimension['choices'])
+    if dimension['kind'] == 'int':
+        return rng.randint(dimension['low'], dimension['high'])
+    return round(rng.uniform(dimension['low'], dimension['high']), FLOAT_DECIMALS)
+
+
+def _clip(dimension, value):
+    value = min(max(value, dimension['low']), dimension['high'])
+    return int(round(value)) if dimension['kind'] == 'int' else round(value, FLOAT_DECIMALS)
+
+
+def params_key(params):
+    return tuple(sorted(params.items()))
+
+
+def default_constraint(spec):
+    """
+    The constraint optimize uses for a strategy by default: with fast_ema_span and slow_ema_span
+    parameters, candidates whose fast EMA is not faster than the slow one are skipped. None (no
+    constraint) for strategies without both.
+    """
+    if 'fast_ema_span' not in spec.params or 'slow_ema_span' not in spec.params:
+        return None
+    fast_default = spec.params['fast_ema_span']['default']
+    slow_default = spec.params['slow_ema_span']['default']
+
+    def constraint(params):
+        return params.get('fast_ema_span', fast_default) < params.get('slow_ema_span', slow_default)
+    return constraint
+
+
+# --- TPE ---
+def _parzen_numeric(dimension, points, values):
+    """Density of `values` under a Gaussian mixture on `points` plus a uniform prior component"""
+    low, high = dimension['low'], dimension['high']
+    width = max(high - low, 1e-12)
+    density = np.full(len(values), 1.0 / width)
+    if points:
+        bandwidth = width * max(0.05, len(points) ** -0.2 / 3)
+        diff = (np.asarray(values, dtype=float)[:, None] - np.asarray(points, dtype=float)[None, :]) / bandwidth
+        kernels = np.exp(-0.5 * diff ** 2) / (bandwidth * math.sqrt(2 * math.pi))
+        density = (density + kernels.sum(axis=1)) / (len(points) + 1)
+    return density
+
+
+def _parzen_choice(dimension, points):
+    counts = {choice: 1.0 for choice in dimension['choices']}  # one prior observation each
+    for point in points:
+        counts[point] += 1
+    total = sum(counts.values())
+    return {choice: count / total for choice, count in counts.items()}
+
+
+def propose_tpe(space, trials, rng, gamma=0.25, n_candidates=24):
+    """
+    One candidate from the TPE model of `trials` (list of (params, score)): every dimension is
+    drawn from the density of the best gamma fraction of trials, keeping the draw that most favours
+    them over the rest.
+    """
+    ranked = sorted(trials, key=lambda trial: trial[1], reverse=True)
+    n_good = max(1, int(math.ceil(gamma * len(ranked))))
+    good = [params for params, _ in ranked[:n_good]]
+    bad = [params for params, _ in ranked[n_good:]]
+
+    candidate = {}
+    for dimension in space:
+        name = dimension['name']
+        good_points = [params[name] for params in good]
+        bad_points = [params[name] for params in bad]
+        if dimension['kind'] == 'choice':
+            l_probs = _parzen_choice(dimension, good_points)
+            g_probs = _parzen_choice(dimension, bad_points)
+            choices = list(l_probs)
+            draws = rng.choices(choices, weights=[l_probs[c] for c in choices], k=n_candidates)
+            candidate[name] = max(draws, key=lambda c: l_probs[c] / g_probs[c])
+        else:
+            width = dimension['high'] - dimension['low']
+            bandwidth = width * max(0.05, max(1, len(good_points)) ** -0.2 / 3)
+            draws = []
+            for _ in range(n_candidates):
+                if good_points and rng.random() > 1 / (len(good_points) + 1):
+                    draws.append(_clip(dimension, rng.gauss(rng.choice(good_points), bandwidth)))
+                else:
+                    draws.append(_sample(dimension, rng))
+            ratio = _parzen_numeric(dimension, good_points, draws) / _parzen_numeric(dimension, bad_points, draws)
+            candidate[name] = draws[int(np.argmax(ratio))]
+    return candidate
+
+
+# --- GA ---
+def _tournament(population, rng, size=3):
+    return max(rng.sample(population, min(size, len(population))), key=lambda trial: trial[1])[0]
+
+
+def breed(space, population, rng, mutation_rate=None):
+    """A child of two tournament-selected parents: uniform crossover, then mutation"""
+    mutation_rate = mutation_rate or 1 / len(space)
+    mother, father = _tournament(population, rng), _tournament(population, rng)
+    child = {}
+    for dimension in space:
+        name = dimension['name']
+        value = mother[name] if rng.random() < 0.5 else father[name]
+        if rng.random() < mutation_rate:
+            if dimension['kind'] == 'choice':
+                value = rng.choice(dimension['choices'])
+            else:
+                value = _clip(dimension, rng.gauss(value, (dimension['high'] - dimension['low']) * 0.15))
+        child[name] = value
+    return child
+
+
+# --- Candidate evaluation (worker side) ---
+def _init_worker(shm_name, shape, settings):
+    shm = _attach(shm_name)
+    block = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    candles = pd.DataFrame({col: block[i] for i, col in enumerate(CANDLE_COLUMNS)}, copy=False)
+    _shared.update(shm=shm, candles=candles, settings=settings, signals=OrderedDict())
+
+
+def _signals(strategy_params):
+    """Signals for every candle, generated once per strategy params (the SIGNAL_CACHE_SIZE latest are kept)"""
+    settings = _shared['settings']
+    cache = _shared['signals']
+    key = params_key(strategy_params)
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+    cache[key] = generate_signals(_shared['candles'], instrument=settings['instrument'], lookback=settings['lookback'],
+                                  use_cache=False, strategy=settings['strategy'], strategy_params=strategy_params)
+    if len(cache) > SIGNAL_CACHE_SIZE:
+        cache.popitem(last=False)
+    return cache[key]
+
+
+def _checkpoint_trades(trades, stop, candles, signal_frame, instrument, starting_balance, position_params):
+    """
+    (trades, balance) that simulate_positions reports for candles[:stop], from the trades of a longer
+    simulation: the ones closed before candle `stop`, then the one open at it. Only that one is simulated
+    again, on its own from the balance so far, so it is force-closed at candle stop - 1 as the shorter run
+    would close it (trades are taken one at a time, so everything before it has closed by its entry).
+    """
+    result = [tr for tr in trades if tr.close_bar < stop]  # in the order they closed
+    balance = starting_balance
+    for tr in result:
+        balance += tr.profit_usd
+    for tr in trades:
+        if tr.open_bar <= stop <= tr.close_bar:
+            only_signal = signal_frame.iloc[:stop].copy()
+            keep = np.zeros(stop, dtype=bool)
+            keep[tr.open_bar - 1] = True
+            only_signal.loc[~keep, 'signal'] = 0
+            boundary, balance = simulate_positions(candles.iloc[:stop], only_signal, instrument,
+                                                   starting_balance=balance, **position_params)
+            for boundary_trade in boundary:
+                boundary_trade.trade_id = tr.trade_id
+                result.append(boundary_trade)
+    return result, balance
+
+
+def _evaluate(job):
+    """
+    Simulate one candidate once, then check it checkpoint by checkpoint.
+
+    Returns:
+        dict with params, score (-inf when pruned), metrics at the last checkpoint reached,
+        checkpoint reached, interim objective values and whether it was pruned
+    """
+    params, thresholds = job
+    settings = _shared['settings']
+    stops = [int(round(fraction * len(_shared['candles']))) for fraction in settings['checkpoints']]
+    candles = _shared['candles'].iloc[:stops[-1]]
+    strategy_params = {k: v for k, v in params.items() if k not in POSITION_PARAMS}
+    position_params = {**POSITION_PARAMS, **{k: v for k, v in params.items() if k in POSITION_PARAMS}}
+
+    signal_frame = _signals(strategy_params).iloc[:stops[-1]]
+    trades, balance = simulate_positions(candles, signal_frame, settings['instrument'],
+                                         starting_balance=settings['starting_balance'], **position_params)
+    interim = []
+    for segment, stop in enumerate(stops):
+        if stop == stops[-1]:
+            metrics = calculate_metrics(trades, settings['starting_balance'], stop)
+            metrics['final_balance'] = round(balance, 2)
+            interim.append(metrics.get(settings['objective'], -math.inf))
+            break
+        so_far, balance_so_far = _checkpoint_trades(trades, stop, candles, signal_frame, settings['instrument'],
+                                                    settings['starting_balance'], position_params)
+        metrics = calculate_metrics(so_far, settings['starting_balance'], stop)
+        metrics['final_balance'] = round(balance_so_far, 2)
+        value = metrics.get(settings['objective'], -math.inf)
+        interim.append(value)
+        drawdown = metrics.get('max_drawdown_pct', 0.0) / 100
+        threshold = thresholds[segment]
+        if drawdown > settings['max_drawdown'] or (threshold is not None and value < threshold):
+            return {'params': params, 'score': -math.inf, 'metrics': metrics, 'checkpoint': segment,
+                    'interim': interim, 'pruned': True}
+    return {'params': params, 'score': objective_score(metrics, settings['objective'], settings['min_trades']),
+            'metrics': metrics, 'checkpoint': len(stops) - 1, 'interim': interim, 'pruned': False}
+
+
+# --- Driver ---
+def optimize(
+    search_space,
+    method='tpe',
+    n_trials=60,
+    instrument="EUR_USD",
+    granularity='M5',
+    start=None,
+    end=None,
+    candle_counter=8928,
+    csv_path='EURUSD5.csv',
+    store_directory=candle_store.STORE_DIRECTORY,
+    starting_balance=850,
+    lookback=300,
+    objective='profit_factor',
+    min_trades=20,
+    checkpoints=CHECKPOINTS,
+    max_drawdown=0.5,
+    prune_quantile=0.1,
+    n_startup=10,
+    population_size=16,
+    constraint=None,
+    cache=None,
+    seed=0,
+    max_workers=None,
+    strategy=DEFAULT_STRATEGY,
+    results_directory=None,
+):
+    """
+    Search simulate_positions and strategy parameters for the best `objective`.
+
+    Args:
+        search_space: {parameter: [values] or (low, high)}, see the module comment
+        method: 'tpe' or 'ga'
+        n_trials: candidates to evaluate (cache hits and constraint rejects are free)
+        instrument, granularity, start, end, candle_counter, csv_path, store_directory: candle
+            selection, as in run_backtest
+        objective: calculate_metrics key (or 'final_balance') to maximise; candidates with fewer than
+            min_trades trades score -inf
+        checkpoints: fractions of the candles at which a candidate is checked (and can be pruned); the
+            last one is where the simulation ends
+        max_drawdown: stop a candidate whose drawdown exceeds this fraction of its peak balance
+        prune_quantile: stop a candidate whose interim objective is below this quantile of the
+            earlier candidates' values at the same checkpoint (after n_startup of them; None disables)
+        n_startup: random candidates before the TPE model (and pruning) kick in
+        population_size: GA population
+        constraint: callable(params) -> bool; candidates it rejects are never evaluated
+            (default: default_constraint of the strategy; pass lambda params: True for none)
+        cache: dict of params_key -> result to reuse (and extend) across calls
+        max_workers: Worker processes (default: every core); candidates are evaluated in batches of this size
+
+    Returns:
+        dict with best_params, best_score, best_metrics, trials (DataFrame, one row per proposal:
+        params, score, objective, total_trades, checkpoint reached, pruned, cached) and the number of
+        evaluations, pruned candidates, cache hits (results reused from `cache`) and duplicates
+        (re-proposals of a candidate already tried in this search, mutated before use)
+    """
+    if method not in ('tpe', 'ga'):
+        raise ValueError(f"Unknown method: {method}")
+    spec = get_strategy(strategy)
+    unknown = set(search_space) - set(POSITION_PARAMS) - set(spec.params)
+    if unknown:
+        raise ValueError(f"Unknown parameter(s) for {spec.name}: {', '.join(sorted(unknown))}")
+    space = [_dimension(name, values) for name, values in search_space.items()]
+    if constraint is None:
+        constraint = default_constraint(spec)
+    rng = random.Random(seed)
+    cache = cache if cache is not None else {}
+    max_workers = max_workers or os.cpu_count()
+
+    candles = candle_store.load_candles(instrument, granularity, start=start, end=end, rows=candle_counter,
+                                        store_directory=store_directory, csv_path=csv_path)
+    settings = {
+        'instrument': instrument,
+        'starting_balance': starting_balance,
+        'lookback': lookback,
+        'strategy': strategy,
+        'objective': objective,
+        'min_trades': min_trades,
+        'checkpoints': tuple(checkpoints),
+        'max_drawdown': max_drawdown,
+    }
+
+    trials = []           # (params, score) of every evaluated candidate, for the models
+    interim_values = [[] for _ in checkpoints]
+    rows = []
+    counts = {'evaluations': 0, 'pruned': 0, 'cache_hits': 0, 'duplicates': 0}
+
+    def thresholds():
+        if prune_quantile is None:
+            return [None] * len(checkpoints)
+        return [float(np.quantile(values, prune_quantile, method='lower')) if len(values) >= n_startup else None
+                for values in interim_values]
+
+    def record(result, cached):
+        trials.append((result['params'], result['score']))
+        metrics = result['metrics']
+        rows.append({**result['params'], 'score': result['score'], objective: metrics.get(objective),
+                     'total_trades': metrics.get('total_trades', 0), 'checkpoint': result['checkpoint'],
+                     'pruned': result['pruned'], 'cached': cached})
+
+    seen = set()  # keys of the candidates already in `trials`
+
+    def propose(batch):
+        """
+        Up to `batch` new candidates. A candidate evaluated in an earlier call (passed-in cache) is
+        recorded for free; one already seen in this search is mutated until it is new.
+        """
+        proposals = []
+        misses = 0
+        candidate = None
+        while len(proposals) < batch and misses < 100:
+            if candidate is None:
+                if method == 'tpe':
+                    candidate = (propose_tpe(space, trials, rng) if len(trials) >= n_startup
+                                 else {d['name']: _sample(d, rng) for d in space})
+                else:
+                    population = sorted(trials, key=lambda trial: trial[1], reverse=True)[:population_size]
+                    candidate = (breed(space, population, rng) if len(population) >= population_size
+                                 else {d['name']: _sample(d, rng) for d in space})
+            key = params_key(candidate)
+            if key in seen or (constraint is not None and not constraint(candidate)):
+                if key in seen:
+                    counts['duplicates'] += 1
+                misses += 1
+                dimension = rng.choice(space)
+                candidate = {**candidate, dimension['name']: _sample(dimension, rng)}
+                continue
+            seen.add(key)
+            if key in cache:
+                counts['cache_hits'] += 1
+                record(cache[key], cached=True)
+            else:
+                proposals.append(candidate)
+            candidate = None
+        return proposals
+
+    shm, shape = share_frames(candles)
+    try:
+        start_time = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                 initargs=(shm.name, shape, settings)) as executor:
+            while counts['evaluations'] < n_trials:
+                proposals = propose(min(max_workers, n_trials - counts['evaluations']))
+                if not proposals:
+                    print('Search space exhausted')
+                    break
+                limits = thresholds()
+                for result in executor.map(_evaluate, [(params, limits) for params in proposals]):
+                    counts['evaluations'] += 1
+                    counts['pruned'] += result['pruned']
+                    for checkpoint, value in enumerate(result['interim'][:len(checkpoints) - 1]):
+                        interim_values[checkpoint].append(value)
+                    cache[params_key(result['params'])] = result
+                    record(result, cached=False)
+                best_score = max(score for _, score in trials)
+                print(f"Evaluated {counts['evaluations']} of {n_trials} ({counts['pruned']} stopped early), "
+                      f"best {objective}: {best_score}, time elapsed: {time.perf_counter() - start_time:.2f}s")
+    finally:
+        shm.close()
+        shm.unlink()
+
+    trial_frame = pd.DataFrame(rows)
+    best_params, best_score = max(trials, key=lambda trial: trial[1]) if trials else (None, -math.inf)
+    if results_directory is not None:
+        os.makedirs(results_directory, exist_ok=True)
+        trial_frame.to_csv(os.path.join(results_directory, f'optimizer_{method}_trials.csv'), index=False)
+    return {
+        'best_params': best_params,
+        'best_score': best_score,
+        'best_metrics': cache[params_key(best_params)]['metrics'] if best_params is not None else {},
+        'trials': trial_frame,
+        **counts,
+    }
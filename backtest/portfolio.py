@@ -0,0 +1,244 @@
+import csv
+import heapq
+import os
+
+import numpy as np
+import pandas as pd
+
+import candle_store
+from ledger import TRADE_COLUMNS, TradeLedger
+from main import calculate_metrics, calculate_units, generate_signals, load_timeframes, pip_size, resolve_signal_exits
+from strategy_registry import DEFAULT_STRATEGY
+
+# Portfolio backtest: several instruments traded against one account balance, like the live bot.
+# Exits never depend on the balance (only position sizes do), so each instrument is loaded,
+# signalled and exit-resolved on its own, leaving a short list of planned trades. The instruments'
+# entry/exit events are then k-way merged by time with a heap and replayed against the shared
+# balance. Only one instrument's candles are in memory at any time.
+
+# Event kinds. At equal times exits sort first, so a balance freed by one instrument's close sizes
+# another's entry on the same candle, as update_positions runs before execute_trade in the loop
+EXIT, ENTRY = 0, 1
+
+
+def plan_trades(candles, signal_frame, trail_on=False, trail_start=0.7, trail_distance=0.25,
+                exit_mode='vectorized', sub_candles=None):
+    """
+    The trades one instrument takes (one open at a time), independent of position size.
+
+    Returns:
+        List of dicts with open_time/close_time (int64 ns, close_time None if still open at the end),
+        entry_time (the candle it is entered on, for exposure), action, entry_price, stop_loss, take_profit, close_price, win and the trade state after its exit
+    """
+    times = candles['time'].to_numpy().astype('datetime64[ns]').view(np.int64)
+    signals = signal_frame['signal'].to_numpy()
+    stop_losses = signal_frame['stop_loss'].to_numpy()
+    take_profits = signal_frame['take_profit'].to_numpy()
+    signal_idx, entry_prices, exits = resolve_signal_exits(candles, signal_frame, trail_on, trail_start,
+                                                           trail_distance, exit_mode, sub_candles)
+    candle_count = len(candles)
+
+    plans = []
+    free_from = 0
+    for i, idx in enumerate(signal_idx):
+        if idx < free_from:
+            continue
+        exit_idx = exits['exit_idx'][i]
+        plans.append({
+            'open_time': int(times[idx]),
+            'close_time': int(times[exit_idx]) if exit_idx >= 0 else None,
+            'entry_time': int(times[min(idx + 1, candle_count - 1)]),
+            'action': 'buy' if signals[idx] > 0 else 'sell',
+            'entry_price': float(entry_prices[i]),
+            'stop_loss': float(stop_losses[idx]),
+            'take_profit': float(take_profits[idx]),
+            'close_price': exits['exit_price'][i],
+            'win': bool(exits['win'][i]),
+            'final_stop_loss': exits['stop_loss'][i],
+            'take_profit_active': bool(exits['take_profit_active'][i]),
+            'highest_price': exits['highest_price'][i],
+            'lowest_price': exits['lowest_price'][i],
+            'be_reached': bool(exits['be_reached'][i]),
+            'tp_pct_reached': bool(exits['tp_pct_reached'][i]),
+        })
+        free_from = candle_count if exit_idx < 0 else exit_idx
+    return plans
+
+
+def _events(order, plans):
+    """(time, kind, instrument order, plan index) of one instrument's entries and exits, in time order"""
+    for k, plan in enumerate(plans):
+        yield plan['open_time'], ENTRY, order, k
+        if plan['close_time'] is not None:
+            yield plan['close_time'], EXIT, order, k
+
+
+def run_portfolio_backtest(
+    instruments,
+    risk_percent=0.01,
+    starting_balance=850,
+    trail_on=False,
+    trail_start=0.7,
+    trail_distance=0.25,
+    lookback=200,
+    granularity='M5',
+    start=None,
+    end=None,
+    candle_counter=None,
+    csv_paths=None,
+    store_directory=candle_store.STORE_DIRECTORY,
+    signal_mode='vectorized',
+    exit_mode='vectorized',
+    strategy=DEFAULT_STRATEGY,
+    strategy_params=None,
+    intrabar_granularity='M1',
+    intrabar_csv_paths=None,
+    results_directory=None,
+):
+    """
+    Backtest several instruments against one shared account balance.
+
+    Every trade is sized from the balance at its signal (calculate_units, with JPY pip sizes),
+    and the balance changes as trades on any instrument close.
+
+    Args:
+        instruments: Instruments to trade, each read from the candle store for granularity
+        start, end, candle_counter: candle selection per instrument, as in run_backtest
+        csv_paths, intrabar_csv_paths: optional {instrument: CSV} to build the store from
+        exit_mode: 'vectorized' or 'intrabar' (see simulate_positions)
+        results_directory: if given, portfolio_trades.csv and portfolio_metrics.csv are written there
+
+    Returns:
+        (completed_trades, account_balance, metrics, equity_curve)
+        metrics: calculate_metrics of all trades (with the balance-based metrics) plus final_balance, and
+            'instruments': {instrument: calculate_metrics of its trades}; exposure in both is the percent of
+            the merged timeline (the union of the instruments' candle times) with a trade open
+        equity_curve: DataFrame of time, instrument and balance after every close
+    """
+    if exit_mode not in ('vectorized', 'intrabar'):
+        raise ValueError(f"Unknown exit_mode for a portfolio backtest: {exit_mode}")
+    csv_paths = csv_paths or {}
+    intrabar_csv_paths = intrabar_csv_paths or {}
+
+    # --- Per instrument: candles -> signals -> planned trades (candles are dropped after each) ---
+    plans = []
+    last_close = {}
+    last_time = {}
+    timeline = np.empty(0, dtype=np.int64)  # union of every instrument's candle times, for exposure
+    for instrument in instruments:
+        candles = candle_store.load_candles(instrument, granularity, start=start, end=end, rows=candle_counter,
+                                            store_directory=store_directory, csv_path=csv_paths.get(instrument))
+        if 'time' not in candles:
+            raise ValueError(f"Stored candles for {instrument} {granularity} have no time column")
+        if not len(candles):
+            plans.append([])
+            continue
+        timeframes = None
+        if signal_mode == 'vectorized':
+            timeframes = load_timeframes(strategy, instrument, granularity, store_directory, csv_paths.get(instrument))
+        signal_frame = generate_signals(candles, instrument=instrument, lookback=lookback, signal_mode=signal_mode,
+                                        use_cache=False, strategy=strategy, strategy_params=strategy_params,
+                                        granularity=granularity, timeframes=timeframes)
+        sub_candles = None
+        if exit_mode == 'intrabar':
+            candle_end = candles['time'].iloc[-1] + pd.Timedelta(seconds=candle_store.GRANULARITY_SECONDS[granularity])
+            sub_candles = candle_store.iter_candles(instrument, intrabar_granularity, start=candles['time'].iloc[0],
+                                                    end=candle_end, store_directory=store_directory,
+                                                    csv_path=intrabar_csv_paths.get(instrument))
+        instrument_plans = plan_trades(candles, signal_frame, trail_on, trail_start, trail_distance,
+                                       exit_mode, sub_candles)
+        plans.append(instrument_plans)
+        last_close[instrument] = float(candles['close'].iloc[-1])
+        times = candles['time'].to_numpy().astype('datetime64[ns]').view(np.int64)
+        last_time[instrument] = int(times[-1])
+        timeline = np.union1d(timeline, times)
+        print(f"{instrument}: {len(candles)} candles, {int(np.count_nonzero(signal_frame['signal']))} signals, "
+              f"{len(instrument_plans)} trades")
+        del candles, signal_frame, timeframes
+
+    # --- Replay every instrument's entries and exits in time order against one balance ---
+    ledger = TradeLedger()
+    account_balance = starting_balance
+    open_trades = {}    # (instrument order, plan index) -> Trade
+    trade_times = {}    # trade_id -> [open_time, close_time]
+    equity = []
+
+    for event_time, kind, order, k in heapq.merge(*(_events(order, p) for order, p in enumerate(plans))):
+        instrument = instruments[order]
+        plan = plans[order][k]
+        if kind == ENTRY:
+            units = calculate_units(account_balance, risk_percent, plan['entry_price'], plan['stop_loss'], instrument)
+            tr = ledger.open(instrument, plan['action'], plan['entry_price'], plan['stop_loss'],
+                             plan['take_profit'], units)
+            tr.stop_loss = plan['final_stop_loss']
+            tr.take_profit = tr.take_profit if plan['take_profit_active'] else None
+            tr.highest_price = plan['highest_price']
+            tr.lowest_price = plan['lowest_price']
+            tr.be_reached = plan['be_reached']
+            tr.tp_pct_reached = plan['tp_pct_reached']
+            tr.open_bar = int(np.searchsorted(timeline, plan['entry_time']))
+            open_trades[order, k] = tr
+            trade_times[tr.trade_id] = [event_time, None]
+            continue
+
+        tr = open_trades.pop((order, k))
+        price = plan['close_price']
+        tr.close_price = price
+        tr.win = plan['win']
+        tr.profit = round(price - tr.entry_price, 6) if tr.action == 'buy' else round(tr.entry_price - price, 6)
+        tr.profit_pips = round(tr.profit / pip_size(instrument), 1)
+        tr.profit_usd = round(tr.profit * tr.units, 2)
+        account_balance += tr.profit_usd
+        tr.close_bar = int(np.searchsorted(timeline, event_time))
+        ledger.close(tr)
+        trade_times[tr.trade_id][1] = event_time
+        equity.append((event_time, instrument, account_balance))
+
+    # Force close whatever is still open at each instrument's last close
+    for tr in ledger.iter_open():
+        tr.close_price = last_close[tr.instrument]
+        tr.profit = tr.close_price - tr.entry_price if tr.action == 'buy' else tr.entry_price - tr.close_price
+        tr.profit_pips = round(tr.profit / pip_size(tr.instrument), 1)
+        tr.profit_usd = round(tr.profit * tr.units, 2)
+        tr.win = tr.profit > 0
+        account_balance += tr.profit_usd
+        tr.close_bar = int(np.searchsorted(timeline, last_time[tr.instrument]))
+        ledger.close(tr)
+
+    completed_trades = ledger.completed
+    equity_curve = pd.DataFrame(equity, columns=['time', 'instrument', 'balance'])
+    equity_curve['time'] = equity_curve['time'].to_numpy(dtype=np.int64).view('datetime64[ns]')
+
+    # --- Combined and per-instrument metrics ---
+    # Exposure is measured against the merged timeline: every time any instrument has a candle
+    total_bars = len(timeline)
+    metrics = calculate_metrics(completed_trades, starting_balance, total_bars=total_bars)
+    metrics['final_balance'] = round(account_balance, 2)
+    metrics['instruments'] = {
+        instrument: calculate_metrics([t for t in completed_trades if t.instrument == instrument],
+                                      total_bars=total_bars)
+        for instrument in instruments
+    }
+
+    if results_directory is not None:
+        os.makedirs(results_directory, exist_ok=True)
+        with open(os.path.join(results_directory, 'portfolio_trades.csv'), 'w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file)
+            writer.writerow(TRADE_COLUMNS + ['open_time', 'close_time'])
+            for tr in completed_trades:
+                opened, closed = trade_times[tr.trade_id]
+                writer.writerow([tr[column] for column in TRADE_COLUMNS]
+                                + [pd.Timestamp(opened), pd.Timestamp(closed) if closed is not None else None])
+        with open(os.path.join(results_directory, 'portfolio_metrics.csv'), 'w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file)
+            writer.writerow(['Metric', 'Value'])
+            for k, v in metrics.items():
+                if k != 'instruments':
+                    writer.writerow([k, v])
+            for instrument, instrument_metrics in metrics['instruments'].items():
+                for k, v in instrument_metrics.items():
+                    writer.writerow([f'{instrument}.{k}', v])
+
+    print(f"Portfolio {', '.join(instruments)}: {len(completed_trades)} trades, "
+          f"final balance ${round(account_balance, 2)}")
+    return completed_trades, account_balance, metrics, equity_curve
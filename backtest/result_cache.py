@@ -0,0 +1,228 @@
+import ast
+import functools
+import hashlib
+import importlib.util
+import json
+import os
+import time
+
+import numpy as np
+
+from ledger import TRADE_COLUMNS, Trade
+
+# Content-addressed cache of run_backtest results.
+#
+# A result is stored under a hash of everything it depends on: the candles' content, the source of
+# the strategy module and of the backtest engine, and every parameter that changes the simulation.
+# Re-running a sweep (or one where only some values changed) therefore only simulates the
+# permutations it has never seen; editing the strategy or the engine (main.py and every backtest
+# module it imports, directly or through other backtest modules) invalidates everything.
+#
+#   <directory>/<key>.npz   trades column by column, metrics (JSON) and the equity curve
+#   <directory>/index.json  key -> size, created and label, for listing and eviction
+#
+# A hit only bumps the entry file's mtime, which is its last use for LRU eviction, so reads never
+# take the lock or rewrite the index. Several sweep workers can share a directory: entries are
+# written to a temporary file and renamed, and the index is only rewritten (by put) while holding
+# <directory>/index.lock.
+
+CACHE_VERSION = 2
+DEFAULT_MAX_BYTES = 512 * 1024 ** 2
+ENGINE_ENTRY = 'main.py'
+LOCK_TIMEOUT = 10.0
+
+_FLOAT_COLUMNS = [c for c in TRADE_COLUMNS if c not in ('trade_id', 'instrument', 'action', 'be_reached', 'win',
+                                                         '%_TP_reached')]
+_BOOL_COLUMNS = ['be_reached', 'win', '%_TP_reached']
+_BAR_COLUMNS = ['open_bar', 'close_bar']
+
+
+@functools.lru_cache(maxsize=None)
+def engine_modules():
+    """ENGINE_ENTRY plus every backtest module it imports, directly or indirectly (file paths, sorted)"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    found = set()
+    pending = [os.path.join(here, ENGINE_ENTRY)]
+    while pending:
+        path = pending.pop()
+        if path in found:
+            continue
+        found.add(path)
+        with open(path, 'rb') as file:
+            tree = ast.parse(file.read(), filename=path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                candidate = os.path.join(here, f"{name.split('.')[0]}.py")
+                if os.path.exists(candidate):
+                    pending.append(candidate)
+    return sorted(found)
+
+
+@functools.lru_cache(maxsize=None)
+def source_fingerprint(module_path):
+    """Hash of a strategy module's source plus the backtest engine's, read once per process"""
+    digest = hashlib.blake2b(digest_size=16)
+    paths = [importlib.util.find_spec(module_path).origin] + engine_modules()
+    for path in paths:
+        with open(path, 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def result_key(dataset, module_path, params):
+    """
+    Cache key of one run.
+
+    Args:
+        dataset: content fingerprint of the candles (main.dataset_fingerprint)
+        module_path: the strategy's module path, whose source is part of the key
+        params: every parameter that affects the result (JSON-serialisable)
+    """
+    payload = json.dumps({'version': CACHE_VERSION, 'dataset': dataset, 'source': source_fingerprint(module_path),
+                          'params': params}, sort_keys=True, default=str)
+    return hashlib.blake2b(payload.encode(), digest_size=20).hexdigest()
+
+
+class _IndexLock:
+    """Cross-process lock: a lock file created exclusively, taken over if older than LOCK_TIMEOUT"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while True:
+            try:
+                os.close(os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return self
+            except FileExistsError:
+                if time.monotonic() > deadline:
+                    try:
+                        if time.time() - os.path.getmtime(self.path) > LOCK_TIMEOUT:
+                            os.remove(self.path)  # left behind by a crashed process
+                    except OSError:
+                        pass
+                    deadline = time.monotonic() + LOCK_TIMEOUT
+                time.sleep(0.005)
+
+    def __exit__(self, *exc):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class ResultCache:
+    """
+    run_backtest results on disk, keyed by result_key, limited to max_bytes (least recently used
+    entries are evicted first).
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._index_path = os.path.join(directory, 'index.json')
+        self._lock = _IndexLock(os.path.join(directory, 'index.lock'))
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, f'{key}.npz')
+
+    def _read_index(self):
+        try:
+            with open(self._index_path, encoding='utf-8') as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _write_index(self, index):
+        temporary = f'{self._index_path}.{os.getpid()}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump(index, file)
+        os.replace(temporary, self._index_path)
+
+    def __contains__(self, key):
+        return os.path.exists(self._entry_path(key))
+
+    def index(self):
+        return self._read_index()
+
+    def get(self, key):
+        """(trades, account_balance, metrics, equity_curve) or None"""
+        path = self._entry_path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                columns = {column: data[column].tolist() for column in TRADE_COLUMNS + _BAR_COLUMNS}
+                meta = json.loads(str(data['meta']))
+                equity_curve = data['equity_curve']
+        except (FileNotFoundError, KeyError, ValueError, OSError):
+            return None
+        try:
+            os.utime(path)  # last use, for eviction
+        except OSError:
+            pass
+
+        trades = []
+        for row in zip(*(columns[column] for column in TRADE_COLUMNS + _BAR_COLUMNS)):
+            values = dict(zip(TRADE_COLUMNS + _BAR_COLUMNS, row))
+            trade = Trade(values['trade_id'], values['instrument'], values['action'], values['entry_price'],
+                          values['stop_loss'], values['take_profit'], values['units'])
+            for column in TRADE_COLUMNS:
+                value = values[column]
+                if column in _FLOAT_COLUMNS and value != value:  # NaN stands for None
+                    value = None
+                trade[column] = value
+            for column in _BAR_COLUMNS:
+                setattr(trade, column, None if values[column] < 0 else values[column])  # -1 stands for None
+            trades.append(trade)
+        return trades, meta['account_balance'], meta['metrics'], equity_curve
+
+    def put(self, key, trades, account_balance, metrics, starting_balance, label=None):
+        """Store a run's trades, final balance and metrics; the equity curve is derived from the trades"""
+        arrays = {
+            'trade_id': np.array([t.trade_id for t in trades], dtype=np.int64),
+            'instrument': np.array([t.instrument for t in trades], dtype=str),
+            'action': np.array([t.action for t in trades], dtype=str),
+        }
+        for column in _FLOAT_COLUMNS:
+            arrays[column] = np.array([np.nan if t[column] is None else t[column] for t in trades], dtype=np.float64)
+        for column in _BOOL_COLUMNS:
+            arrays[column] = np.array([bool(t[column]) for t in trades], dtype=bool)
+        for column in _BAR_COLUMNS:
+            arrays[column] = np.array([-1 if getattr(t, column) is None else getattr(t, column) for t in trades],
+                                      dtype=np.int64)
+        arrays['equity_curve'] = starting_balance + np.cumsum([0.0] + [t['profit_usd'] for t in trades])
+        arrays['meta'] = np.array(json.dumps({'account_balance': float(account_balance), 'metrics': metrics,
+                                              'label': label}, default=float))
+
+        path = self._entry_path(key)
+        temporary = f'{path}.{os.getpid()}.tmp.npz'
+        np.savez_compressed(temporary, **arrays)
+        os.replace(temporary, path)
+        size = os.path.getsize(path)
+
+        with self._lock:
+            index = self._read_index()
+            index[key] = {'size': size, 'created': time.time(), 'label': label}
+            last_used = {}
+            for old_key in list(index):
+                try:
+                    last_used[old_key] = os.path.getmtime(self._entry_path(old_key))
+                except OSError:
+                    del index[old_key]  # removed by hand or by another cache on the directory
+            total = sum(entry['size'] for entry in index.values())
+            for old_key in sorted(index, key=last_used.get):
+                if total <= self.max_bytes or old_key == key:
+                    continue
+                total -= index.pop(old_key)['size']
+                try:
+                    os.remove(self._entry_path(old_key))
+                except OSError:
+                    pass
+            self._write_index(index)
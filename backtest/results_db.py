@@ -0,0 +1,205 @@
+import json
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import span
+from ledger import TRADE_COLUMNS
+
+# One SQLite file for sweep output, instead of a results_set_{n}/{results,metrics} folder tree
+# with three small CSVs per run.
+#
+#   sweeps   one row per run_sweep call: candle selection, strategy and the param_grid
+#   runs     one row per permutation: the details_file fields plus every parameter (as JSON)
+#   metrics  one row per run, one column per calculate_metrics key, indexed on the keys runs
+#            are usually ranked or filtered by
+#   trades   every trade of every run, keyed by (run_id, trade_id)
+#
+# Runs are inserted in batches, each batch in one transaction, with WAL journaling, so writing
+# stays flat at hundreds of thousands of runs. Only the sweep's parent process writes.
+
+RUN_COLUMNS = ['run', 'instrument', 'risk_percent', 'starting_balance', 'candle_counter', 'trail_on',
+               'trail_start', 'trail_distance', 'final_balance', 'params']
+METRIC_COLUMNS = [
+    'total_trades', 'wins', 'losses', 'breakeven', 'win_rate', 'avg_win', 'avg_loss', 'profit_factor',
+    'be_reached_count', 'be_reached_pct', 'trail_start_reached_count', 'trail_start_reached_pct',
+    'trail_failures', 'trail_successes', 'avg_pct_tp_captured', 'avg_rrr', 'win_rate_tp',
+    'max_drawdown', 'max_drawdown_pct', 'max_drawdown_duration', 'sharpe', 'sortino', 'mar', 'exposure',
+]
+INDEXED_METRICS = ['profit_factor', 'max_drawdown_pct', 'sharpe']  # final_balance is indexed on runs
+
+# SQL column names of the trade columns ('%_TP_reached' is not a valid identifier)
+TRADE_SQL_COLUMNS = ['tp_pct_reached' if column == '%_TP_reached' else column for column in TRADE_COLUMNS]
+
+_TRADE_TYPES = {'trade_id': 'INTEGER', 'instrument': 'TEXT', 'action': 'TEXT', 'be_reached': 'INTEGER',
+                'win': 'INTEGER', 'tp_pct_reached': 'INTEGER'}
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS sweeps (
+    sweep_id INTEGER PRIMARY KEY,
+    created REAL,
+    instrument TEXT,
+    granularity TEXT,
+    candle_count INTEGER,
+    strategy TEXT,
+    strategy_params TEXT,
+    param_grid TEXT
+);
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    sweep_id INTEGER REFERENCES sweeps(sweep_id),
+    run INTEGER,
+    instrument TEXT,
+    risk_percent REAL,
+    starting_balance REAL,
+    candle_counter INTEGER,
+    trail_on INTEGER,
+    trail_start REAL,
+    trail_distance REAL,
+    final_balance REAL,
+    params TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_sweep ON runs (sweep_id, run);
+CREATE INDEX IF NOT EXISTS runs_final_balance ON runs (final_balance);
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id INTEGER PRIMARY KEY REFERENCES runs(run_id),
+    {', '.join(f'{column} REAL' for column in METRIC_COLUMNS)},
+    other TEXT
+);
+{' '.join(f'CREATE INDEX IF NOT EXISTS metrics_{column} ON metrics ({column});' for column in INDEXED_METRICS)}
+CREATE TABLE IF NOT EXISTS trades (
+    run_id INTEGER,
+    {', '.join(f'{column} {_TRADE_TYPES.get(column, "REAL")}' for column in TRADE_SQL_COLUMNS)},
+    PRIMARY KEY (run_id, trade_id)
+) WITHOUT ROWID;
+"""
+
+
+def trade_row(trade):
+    """A trade's TRADE_COLUMNS values as plain Python values sqlite3 can store"""
+    return tuple(value.item() if isinstance(value, np.generic) else value
+                 for value in (trade[column] for column in TRADE_COLUMNS))
+
+
+class ResultsDB:
+    """
+    Sweep results in one SQLite database.
+
+    Args:
+        path: database file (created with its tables if missing)
+        batch_size: runs buffered by add_run before they are written in one transaction
+    """
+
+    def __init__(self, path, batch_size=500):
+        self.path = path
+        self.batch_size = batch_size
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(_SCHEMA)
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.connection.close()
+
+    def start_sweep(self, instrument, granularity, candle_count, strategy, strategy_params, param_grid):
+        """Record a sweep. Returns its sweep_id"""
+        with self.connection:
+            cursor = self.connection.execute(
+                'INSERT INTO sweeps (created, instrument, granularity, candle_count, strategy, strategy_params, '
+                'param_grid) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (time.time(), instrument, granularity, candle_count, strategy,
+                 json.dumps(strategy_params, sort_keys=True, default=str), json.dumps(param_grid, default=str)))
+        return cursor.lastrowid
+
+    def add_run(self, sweep_id, run, details, params, final_balance, metrics, trade_rows):
+        """
+        Buffer one run; written with the batch it completes (or on flush/close).
+
+        Args:
+            details: instrument, risk_percent, starting_balance, candle_counter, trail_on, trail_start,
+                trail_distance (the run_backtest details_file fields)
+            params: the permutation, stored as JSON
+            trade_rows: trade_row of each trade
+        """
+        self._pending.append((sweep_id, run, details, params, final_balance, metrics, trade_rows))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered runs in one transaction"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        with span('io.write'), self.connection:
+            cursor = self.connection.execute('SELECT COALESCE(MAX(run_id), 0) FROM runs')
+            next_id = cursor.fetchone()[0] + 1
+            runs, metric_rows, trades = [], [], []
+            for run_id, (sweep_id, run, details, params, final_balance, metrics, trade_rows) in enumerate(pending,
+                                                                                                        next_id):
+                runs.append((run_id, sweep_id, run, details['instrument'], details['risk_percent'],
+                             details['starting_balance'], details['candle_counter'], int(details['trail_on']),
+                             details['trail_start'], details['trail_distance'], final_balance,
+                             json.dumps(params, sort_keys=True, default=str)))
+                other = {k: v for k, v in metrics.items() if k not in METRIC_COLUMNS and k != 'final_balance'}
+                metric_rows.append((run_id, *(metrics.get(column) for column in METRIC_COLUMNS),
+                                    json.dumps(other, default=str) if other else None))
+                trades.extend((run_id, *row) for row in trade_rows)
+
+            self.connection.executemany(
+                f'INSERT INTO runs (run_id, sweep_id, {", ".join(RUN_COLUMNS)}) '
+                f'VALUES ({", ".join("?" * (len(RUN_COLUMNS) + 2))})', runs)
+            self.connection.executemany(
+                f'INSERT INTO metrics VALUES ({", ".join("?" * (len(METRIC_COLUMNS) + 2))})', metric_rows)
+            self.connection.executemany(
+                f'INSERT INTO trades (run_id, {", ".join(TRADE_SQL_COLUMNS)}) '
+                f'VALUES ({", ".join("?" * (len(TRADE_SQL_COLUMNS) + 1))})', trades)
+
+    def query(self, sql, params=()):
+        """DataFrame of any SQL query on the database"""
+        self.flush()
+        return pd.read_sql_query(sql, self.connection, params=params)
+
+    def top_runs(self, n=10, by='profit_factor', max_drawdown_pct=None, min_trades=0, sweep_id=None):
+        """
+        The n best runs by a metric column (highest first), with their parameters and metrics.
+
+        Args:
+            max_drawdown_pct: only runs whose max drawdown (percent of the peak) is below this
+            min_trades: only runs with at least this many trades
+            sweep_id: only this sweep's runs (default: every sweep in the database)
+        """
+        if by not in METRIC_COLUMNS and by != 'final_balance':
+            raise ValueError(f"Unknown metric to rank by: {by}")
+        conditions, params = ['m.total_trades >= ?'], [min_trades]
+        if max_drawdown_pct is not None:
+            conditions.append('m.max_drawdown_pct < ?')
+            params.append(max_drawdown_pct)
+        if sweep_id is not None:
+            conditions.append('r.sweep_id = ?')
+            params.append(sweep_id)
+        order = 'r.final_balance' if by == 'final_balance' else f'm.{by}'
+        return self.query(
+            f'SELECT r.*, {", ".join(f"m.{column}" for column in METRIC_COLUMNS)} '
+            f'FROM runs r JOIN metrics m ON m.run_id = r.run_id '
+            f'WHERE {" AND ".join(conditions)} ORDER BY {order} DESC LIMIT ?', params + [n])
+
+    def trades(self, run_id):
+        """A run's trades as a DataFrame with the trade CSV's columns"""
+        frame = self.query(f'SELECT {", ".join(TRADE_SQL_COLUMNS)} FROM trades WHERE run_id = ? ORDER BY trade_id',
+                           (run_id,))
+        frame.columns = TRADE_COLUMNS
+        for column in ('be_reached', 'win', '%_TP_reached'):
+            frame[column] = frame[column].astype(bool)
+        return frame
@@ -1,6 +1,9 @@
+import numpy as np
 import pandas as pd
 from decimal import Decimal, ROUND_HALF_UP
 
+from instrumentation import span
+
 trail_distance = 0.25 # trail by 25% of tp pips (so if tp is 50 pip, then trail will be 12.5 pips)
 
 def calculate_atr(df, period=14):
@@ -19,6 +22,19 @@ def calculate_atr(df, period=14):
         print(f"Error calculating ATR: {e}")
         return Decimal('0')
 
+def calculate_atr_float(df, period=14):
+    """calculate_atr on float64 prices, without the round trip through Decimal"""
+    highs = df["high"].to_numpy(dtype=np.float64)
+    lows = df["low"].to_numpy(dtype=np.float64)
+    closes = df["close"].to_numpy(dtype=np.float64)
+    prev_close = np.concatenate(([np.nan], closes[:-1]))
+    tr = pd.DataFrame({
+        "high_low": highs - lows,
+        "high_close_prev": np.abs(highs - prev_close),
+        "low_close_prev": np.abs(lows - prev_close),
+    }).max(axis=1)
+    return float(tr.rolling(window=period).mean().iloc[-1])
+
 def calculate_rsi(df, period=14):
     df = df.copy()
     delta = df['close'].diff().apply(lambda x: Decimal(str(x)))
@@ -43,6 +59,32 @@ def calculate_rsi(df, period=14):
 
     return rsi[-1]
 
+def calculate_rsi_float(df, period=14):
+    """
+    Same Wilder RSI as calculate_rsi, in float64 without the per-candle Decimal loop.
+
+    Wilder's smoothing is an ewm with alpha=1/period; seeding it from the first delta instead of
+    the mean of the first `period` deltas only leaves an error that decays by (1 - 1/period) per
+    candle, so it is subtracted out at the end.
+    """
+    closes = df['close'].to_numpy(dtype=np.float64)
+    delta = np.diff(closes, prepend=closes[0])  # first delta counts as 0, like sum() skipping NaN
+    gain = np.where(delta > 0, delta, 0.0)
+    loss = np.where(delta < 0, -delta, 0.0)
+
+    decay = (1 - 1 / period) ** (len(closes) - period)
+
+    def wilder_average(values):
+        smoothed = pd.Series(values).ewm(alpha=1 / period, adjust=False).mean().to_numpy()
+        seed = values[:period].sum() / period
+        return smoothed[-1] + decay * (seed - smoothed[period - 1])
+
+    avg_gain = wilder_average(gain)
+    avg_loss = wilder_average(loss)
+    if avg_loss <= 0:
+        return 100.0
+    return 100 - 100 / (1 + avg_gain / avg_loss)
+
 def format_price(price, decimal_places=5):
     """Format price to specified decimal places for Oanda compatibility"""
     if decimal_places > 5:
@@ -85,14 +127,20 @@ def get_trailing_stop_distance_if_triggered(candle, trade, trail_start, trail_di
     return None
 
 
-def run(candles, instrument="EUR_USD"):
+def run(candles, instrument="EUR_USD", precision="float"):
     """
     Main trading strategy function with integrated risk management
     
     Args:
         candles: List of OHLC candle dicts
         instrument: Trading pair (default: EUR_USD)
+        precision: 'float' computes the indicators in float64 and only uses Decimal when
+            format_price quantizes entry/SL/TP; 'decimal' converts every price to Decimal first
+            (the original, much slower path). See verify_precision for how far the two drift apart.
     """
+    if precision not in ("float", "decimal"):
+        raise ValueError(f"Unknown precision: {precision}")
+
     # Input validation
     if not candles or len(candles) < 201:  # Need 200 + 1 for EMA_200
         print(len(candles))
@@ -107,18 +155,29 @@ def run(candles, instrument="EUR_USD"):
             print(f"Missing required columns. Found: {df.columns.tolist()}")
             return {"instrument": instrument, "action": "hold", "reason": "invalid_data"}
 
-        # Convert to Decimal for precision
-        for col in required_columns:
-            df[col] = df[col].apply(lambda x: Decimal(str(x)))
+        if precision == "decimal":
+            # Convert to Decimal for precision
+            for col in required_columns:
+                df[col] = df[col].apply(lambda x: Decimal(str(x)))
+        else:
+            df = df.astype({col: np.float64 for col in required_columns})
 
-        # Calculate EMAs using Decimal arithmetic
+        # Calculate EMAs
         df["ema_200"] = df["close"].ewm(span=200, adjust=False).mean()
         df["ema_9"] = df["close"].ewm(span=9, adjust=False).mean()
         df["ema_25"] = df["close"].ewm(span=25, adjust=False).mean()
 
         # Calculate indicators
-        atr = calculate_atr(df, period=14)
-        rsi = calculate_rsi(df, period=14)
+        if precision == "decimal":
+            atr = calculate_atr(df, period=14)
+            rsi = calculate_rsi(df, period=14)
+            sl_multiplier, tp_multiplier = Decimal('1.5'), Decimal('3')
+            rsi_overbought, rsi_oversold = Decimal('70'), Decimal('30')
+        else:
+            atr = calculate_atr_float(df, period=14)
+            rsi = calculate_rsi_float(df, period=14)
+            sl_multiplier, tp_multiplier = 1.5, 3.0
+            rsi_overbought, rsi_oversold = 70.0, 30.0
 
         # **FIXED INDEXING LOGIC**: Use consistent lookback periods
         # We need at least 3 candles for signal confirmation
@@ -138,12 +197,12 @@ def run(candles, instrument="EUR_USD"):
         buy_crossover = (candle_2_ago["ema_9"] < candle_2_ago["ema_25"] and 
                         candle_1_ago["ema_9"] > candle_1_ago["ema_25"])
         buy_trend_filter = candle_1_ago["close"] > candle_1_ago["ema_200"]
-        buy_rsi_filter = rsi <= Decimal('70')
+        buy_rsi_filter = rsi <= rsi_overbought
 
         if buy_crossover and buy_trend_filter and buy_rsi_filter:
             entry_price = current_candle["open"]
-            sl = candle_1_ago["close"] - (Decimal('1.5') * atr)
-            tp = candle_1_ago["close"] + (Decimal('3') * atr)
+            sl = candle_1_ago["close"] - (sl_multiplier * atr)
+            tp = candle_1_ago["close"] + (tp_multiplier * atr)
             
             # Format for Oanda (max 5 decimal places)
             entry_formatted = format_price(entry_price)
@@ -168,13 +227,13 @@ def run(candles, instrument="EUR_USD"):
         sell_crossover = (candle_2_ago["ema_9"] > candle_2_ago["ema_25"] and 
                          candle_1_ago["ema_9"] < candle_1_ago["ema_25"])
         sell_trend_filter = candle_1_ago["close"] < candle_1_ago["ema_200"]
-        sell_rsi_filter = rsi >= Decimal('30')
+        sell_rsi_filter = rsi >= rsi_oversold
 
         if sell_crossover and sell_trend_filter and sell_rsi_filter:
             
             entry_price = current_candle["open"]
-            sl = candle_1_ago["close"] + (Decimal('1.5') * atr)
-            tp = candle_1_ago["close"] - (Decimal('3') * atr)
+            sl = candle_1_ago["close"] + (sl_multiplier * atr)
+            tp = candle_1_ago["close"] - (tp_multiplier * atr)
             
             # Format for Oanda (max 5 decimal places)
             entry_formatted = format_price(entry_price)
@@ -209,3 +268,278 @@ def run(candles, instrument="EUR_USD"):
         print(f"Error in strategy execution: {e}")
         return {"instrument": instrument, "action": "hold", "reason": "error", "error": str(e)}
 
+
+def verify_precision(candles, instrument="EUR_USD", lookback=300, step=1):
+    """
+    Run run() with both precisions over the same candle windows and report how far the float64
+    path drifts from the Decimal one.
+
+    Args:
+        candles: DataFrame (or list of dicts) of OHLC candles
+        lookback: Candles per window, as passed to run() by the backtest
+        step: Check every `step`-th candle only; the Decimal path is slow on long datasets
+
+    Returns:
+        dict with the number of windows checked, the largest absolute difference per indicator,
+        and how many windows disagreed on the action or on the formatted entry/SL/TP
+    """
+    df = pd.DataFrame(candles)
+    records = df[['open', 'high', 'low', 'close']].to_dict('records')
+    indicators = ("rsi", "atr", "ema_9", "ema_25", "ema_200")
+    prices = ("entry_price", "stop_loss", "take_profit")
+    report = {
+        "windows": 0,
+        "action_mismatches": 0,
+        "price_mismatches": 0,
+        "max_abs_diff": {name: 0.0 for name in indicators + prices},
+    }
+
+    for idx in range(200, len(records), step):
+        window = records[max(0, idx - lookback + 1):idx + 1]
+        exact = run(window, instrument, precision="decimal")
+        fast = run(window, instrument, precision="float")
+        report["windows"] += 1
+
+        if exact["action"] != fast["action"]:
+            report["action_mismatches"] += 1
+        elif exact["action"] != "hold" and any(exact[name] != fast[name] for name in prices):
+            report["price_mismatches"] += 1
+
+        for name in indicators + prices:
+            if name in exact and name in fast:
+                diff = abs(exact[name] - fast[name])
+                report["max_abs_diff"][name] = max(report["max_abs_diff"][name], diff)
+
+    return report
+
+
+def _windowed_ema(values, full_ema, alpha, starts, ends):
+    """
+    EMA (adjust=False) at each index in `ends`, seeded at the matching index in `starts`.
+
+    An EMA seeded at s differs from the full-series EMA only by the decayed seed error,
+    so each windowed value is full_ema[e] + (1 - alpha)**(e - s) * (values[s] - full_ema[s]).
+    """
+    decay = (1 - alpha) ** (ends - starts)
+    return full_ema[ends] + decay * (values[starts] - full_ema[starts])
+
+
+def _window_atr(highs, lows, closes, start, end, period):
+    """ATR for one window, computed on Decimal prices exactly as run() does"""
+    window = pd.DataFrame({
+        col: [Decimal(str(x)) for x in values[start:end + 1]]
+        for col, values in (("high", highs), ("low", lows), ("close", closes))
+    })
+    return float(calculate_atr(window, period=period))
+
+
+def run_vectorized(candles, instrument="EUR_USD", lookback=300, rsi_period=14, atr_period=14,
+                   fast_ema_span=9, slow_ema_span=25, sl_atr_multiplier=1.5, tp_atr_multiplier=3.0,
+                   precision="float"):
+    """
+    Whole-series version of run() for backtesting.
+
+    Calling run(candles[idx - lookback + 1:idx + 1]) for every idx recomputes every indicator
+    over the window. This computes them once for the full series and corrects for the window's
+    EMA/RSI seed, so row idx holds exactly what run() would see for that window.
+
+    Args:
+        candles: DataFrame (or list of OHLC dicts) for the full series
+        instrument: Trading pair (default: EUR_USD)
+        lookback: Number of candles run() receives per call (the backtest window)
+        fast_ema_span, slow_ema_span: EMAs whose cross triggers a signal (9 and 25 in run())
+        sl_atr_multiplier, tp_atr_multiplier: SL/TP distance from the close in ATRs (1.5 and 3 in run())
+        precision: 'float' takes SL/TP from the rolling float ATR, like run(); 'decimal' recomputes the
+            ATR on each signal row's Decimal window, like run(precision='decimal')
+
+    Returns:
+        DataFrame indexed like `candles` with columns:
+            signal: 1 (buy), -1 (sell), 0 (hold)
+            stop_loss, take_profit, entry_price: formatted prices on signal rows, NaN elsewhere
+            rsi, atr: values at the current candle
+            ema_9, ema_25, ema_200: values at the confirmation candle (N-1); ema_9/ema_25 hold the
+                fast/slow EMAs when other spans are given
+
+    Indicator values agree with run() to ~1e-11 (RSI) and ~1e-14 (EMA/ATR). Signals, SL and TP
+    match exactly unless an EMA cross or the RSI filter sits within that distance of its threshold.
+    """
+    df = pd.DataFrame(candles)
+    opens = df["open"].to_numpy(dtype=np.float64)
+    highs = df["high"].to_numpy(dtype=np.float64)
+    lows = df["low"].to_numpy(dtype=np.float64)
+    closes = df["close"].to_numpy(dtype=np.float64)
+    n = len(closes)
+
+    ends = np.arange(n)
+    starts = np.maximum(0, ends - lookback + 1)
+    window_len = ends - starts + 1
+    close_series = pd.Series(closes)
+
+    # --- EMAs at the confirmation candle (N-1), seeded at the start of window N ---
+    prev = np.maximum(ends - 1, 0)
+    emas = {}
+    with span('indicator.ema'):
+        for ema_span in {fast_ema_span, slow_ema_span, 200}:
+            alpha = 2 / (ema_span + 1)
+            full = close_series.ewm(span=ema_span, adjust=False).mean().to_numpy()
+            emas[ema_span] = (
+                _windowed_ema(closes, full, alpha, starts, np.maximum(ends - 2, 0)),
+                _windowed_ema(closes, full, alpha, starts, prev),
+            )
+
+    # --- ATR: rolling mean of true range, only ever sees the last `atr_period` rows ---
+    with span('indicator.atr'):
+        prev_close = np.concatenate(([np.nan], closes[:-1]))
+        tr = pd.DataFrame({
+            "high_low": highs - lows,
+            "high_close_prev": np.abs(highs - prev_close),
+            "low_close_prev": np.abs(lows - prev_close),
+        }).max(axis=1)
+        atr = tr.rolling(window=atr_period).mean().to_numpy().copy()
+
+    # --- Wilder RSI seeded at the start of each window (first delta in a window counts as 0) ---
+    with span('indicator.rsi'):
+        delta = np.concatenate(([0.0], np.diff(closes)))
+        gain = np.where(delta > 0, delta, 0.0)
+        loss = np.where(delta < 0, -delta, 0.0)
+        seed_idx = np.minimum(starts + rsi_period - 1, n - 1)
+        rsi_valid = window_len >= rsi_period
+        smoothing = (rsi_period - 1) / rsi_period
+
+        def wilder_average(values):
+            full = pd.Series(values).ewm(alpha=1 / rsi_period, adjust=False).mean().to_numpy()
+            seed_sum = pd.Series(values).rolling(window=rsi_period - 1).sum().to_numpy()
+            seed = seed_sum[seed_idx] / rsi_period
+            decay = smoothing ** (ends - seed_idx)
+            return full[ends] + decay * (seed - full[seed_idx])
+
+        avg_gain = wilder_average(gain)
+        avg_loss = wilder_average(loss)
+        loss_count = np.cumsum(loss > 0)
+        has_loss = (loss_count[ends] - loss_count[starts]) > 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rsi = np.where(has_loss, 100 - 100 / (1 + avg_gain / avg_loss), 100.0)
+        rsi = np.where(rsi_valid, rsi, np.nan)
+
+    # --- Signals (same conditions and candle offsets as run()) ---
+    ema_9_2, ema_9_1 = emas[fast_ema_span]
+    ema_25_2, ema_25_1 = emas[slow_ema_span]
+    _, ema_200_1 = emas[200]
+    close_1 = closes[prev]
+    enough_data = (window_len >= 201) & (ends >= 2)
+
+    buy = (
+        enough_data
+        & (ema_9_2 < ema_25_2) & (ema_9_1 > ema_25_1)
+        & (close_1 > ema_200_1)
+        & (rsi <= 70)
+    )
+    sell = (
+        enough_data & ~buy
+        & (ema_9_2 > ema_25_2) & (ema_9_1 < ema_25_1)
+        & (close_1 < ema_200_1)
+        & (rsi >= 30)
+    )
+    signal = np.zeros(n, dtype=np.int8)
+    signal[buy] = 1
+    signal[sell] = -1
+
+    # SL/TP only exist on signal rows, so format_price stays cheap. They use the same arithmetic as
+    # run() with the same precision; for 'decimal' the ATR is redone on the Decimal window there.
+    if precision not in ("float", "decimal"):
+        raise ValueError(f"Unknown precision: {precision}")
+    stop_loss = np.full(n, np.nan)
+    take_profit = np.full(n, np.nan)
+    entry_price = np.full(n, np.nan)
+    if precision == "decimal":
+        sl_multiplier = Decimal(str(sl_atr_multiplier))
+        tp_multiplier = Decimal(str(tp_atr_multiplier))
+    else:
+        sl_multiplier, tp_multiplier = float(sl_atr_multiplier), float(tp_atr_multiplier)
+    with span('strategy.sl_tp'):
+        for idx in np.flatnonzero(signal):
+            if precision == "decimal":
+                atr[idx] = _window_atr(highs, lows, closes, starts[idx], idx, atr_period)
+                close = Decimal(str(close_1[idx]))
+                atr_dec = Decimal(str(atr[idx]))
+            else:
+                close, atr_dec = float(close_1[idx]), float(atr[idx])
+            if signal[idx] == 1:
+                sl = close - (sl_multiplier * atr_dec)
+                tp = close + (tp_multiplier * atr_dec)
+            else:
+                sl = close + (sl_multiplier * atr_dec)
+                tp = close - (tp_multiplier * atr_dec)
+            stop_loss[idx] = float(format_price(sl))
+            take_profit[idx] = float(format_price(tp))
+            entry_price[idx] = float(format_price(opens[idx]))
+
+    return pd.DataFrame({
+        "signal": signal,
+        "entry_price": entry_price,
+        "stop_loss": stop_loss,
+        "take_profit": take_profit,
+        "rsi": rsi,
+        "atr": atr,
+        "ema_9": ema_9_1,
+        "ema_25": ema_25_1,
+        "ema_200": ema_200_1,
+    }, index=df.index)
+
+
+def run_streaming(indicators, instrument="EUR_USD"):
+    """
+    run() for a StreamingIndicators that has been fed every candle up to the current one.
+
+    Args:
+        indicators: StreamingIndicators (window = the lookback run() would be given)
+        instrument: Trading pair (default: EUR_USD)
+
+    Signals match run(). SL/TP can differ by one 0.00001 step when the ATR lands on a
+    format_price rounding tie, since run() gets its ATR from a pandas rolling mean.
+    Like run()'s default float path, only format_price uses Decimal.
+    """
+    if indicators.window_length < 201:  # Need 200 + 1 for EMA_200
+        return {"instrument": instrument, "action": "hold", "reason": "insufficient_data"}
+
+    candle_1_ago, current_candle = indicators.recent[-2], indicators.recent[-1]
+    ema_9_2, ema_9_1 = indicators.ema(9, 2), indicators.ema(9, 1)
+    ema_25_2, ema_25_1 = indicators.ema(25, 2), indicators.ema(25, 1)
+    ema_200_1 = indicators.ema(200, 1)
+    atr = float(indicators.atr())
+    rsi = indicators.rsi()
+    close_1 = float(candle_1_ago["close"])
+
+    if ema_9_2 < ema_25_2 and ema_9_1 > ema_25_1 and close_1 > ema_200_1 and rsi <= 70:
+        action = "buy"
+        sl = close_1 - (1.5 * atr)
+        tp = close_1 + (3.0 * atr)
+    elif ema_9_2 > ema_25_2 and ema_9_1 < ema_25_1 and close_1 < ema_200_1 and rsi >= 30:
+        action = "sell"
+        sl = close_1 + (1.5 * atr)
+        tp = close_1 - (3.0 * atr)
+    else:
+        return {
+            "instrument": instrument,
+            "action": "hold",
+            "rsi": float(rsi),
+            "atr": float(atr),
+            "ema_9": float(ema_9_1),
+            "ema_25": float(ema_25_1),
+            "ema_200": float(ema_200_1),
+            "reason": "no_signal"
+        }
+
+    return {
+        "instrument": instrument,
+        "action": action,
+        "entry_price": float(format_price(current_candle["open"])),
+        "stop_loss": float(format_price(sl)),
+        "take_profit": float(format_price(tp)),
+        "rsi": float(rsi),
+        "atr": float(atr),
+        "ema_9": float(ema_9_1),
+        "ema_25": float(ema_25_1),
+        "ema_200": float(ema_200_1),
+        "reason": f"ema_crossover_{action}"
+    }
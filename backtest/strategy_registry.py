@@ -0,0 +1,112 @@
+import importlib
+
+# Strategies by name. Registering a strategy only records its metadata; the module (and whatever
+# pandas/numpy work it does on import) is imported the first time the strategy is actually used.
+#
+# Module paths are resolved against the `strategies` folder on the current path: backtest/strategies
+# when running the backtester from backtest/, the top-level strategies/ for the live bot.
+
+
+class StrategySpec:
+    """
+    One registered strategy.
+
+    Args:
+        name: Name used by run_backtest(strategy=...) and trading_bot
+        module: Dotted module path, imported lazily by .load()
+        lookback: Minimum number of candles the strategy needs before it can signal
+        params: {param: {'type': int/float/bool, 'default': value, 'min': ..., 'max': ...}}
+            for the keyword parameters its signal functions accept
+        timeframes: {granularity: completed bars needed} of the higher timeframes it reads. Its
+            run_vectorized and run_streaming are then also given timeframes=, a
+            timeframes.MultiTimeframe of those bars (see backtest/timeframes.py)
+    """
+
+    __slots__ = ('name', 'module_path', 'lookback', 'params', 'timeframes', '_module')
+
+    def __init__(self, name, module, lookback, params=None, timeframes=None):
+        self.name = name
+        self.module_path = module
+        self.lookback = lookback
+        self.params = params or {}
+        self.timeframes = timeframes or {}
+        self._module = None
+
+    def load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self.module_path)
+        return self._module
+
+    def validate_params(self, params=None):
+        """
+        Check params against the schema.
+
+        Returns:
+            Every schema param, with defaults filled in for the ones not given
+        """
+        params = params or {}
+        unknown = set(params) - set(self.params)
+        if unknown:
+            raise ValueError(f"Unknown parameter(s) for {self.name}: {', '.join(sorted(unknown))}")
+
+        validated = {}
+        for param, schema in self.params.items():
+            value = params.get(param, schema['default'])
+            expected = schema['type']
+            if expected is float and isinstance(value, int) and not isinstance(value, bool):
+                value = float(value)
+            if not isinstance(value, expected) or (expected is not bool and isinstance(value, bool)):
+                raise ValueError(f"{self.name}.{param} must be {expected.__name__}, got {value!r}")
+            if 'min' in schema and value < schema['min']:
+                raise ValueError(f"{self.name}.{param} must be >= {schema['min']}, got {value}")
+            if 'max' in schema and value > schema['max']:
+                raise ValueError(f"{self.name}.{param} must be <= {schema['max']}, got {value}")
+            validated[param] = value
+        return validated
+
+    def __repr__(self):
+        return f"StrategySpec({self.name!r}, module={self.module_path!r}, lookback={self.lookback})"
+
+
+_registry = {}
+
+
+def register(name, module, lookback, params=None, timeframes=None):
+    if name in _registry:
+        raise ValueError(f"Strategy {name} is already registered")
+    _registry[name] = StrategySpec(name, module, lookback, params, timeframes)
+    return _registry[name]
+
+
+def get_strategy(name):
+    try:
+        return _registry[name]
+    except KeyError:
+        raise ValueError(f"Unknown strategy: {name}. Registered: {', '.join(available_strategies())}") from None
+
+
+def load_strategy(name):
+    """The strategy's module, imported on first use"""
+    return get_strategy(name).load()
+
+
+def available_strategies():
+    return sorted(_registry)
+
+
+# --- Strategy bank ---
+register(
+    'EMA_CROSS_9_25',
+    module='strategies.EMA_CROSS_9_25_bot',
+    lookback=201,  # EMA_200 + 1
+    params={
+        'rsi_period': {'type': int, 'default': 14, 'min': 2},
+        'atr_period': {'type': int, 'default': 14, 'min': 1},
+        'fast_ema_span': {'type': int, 'default': 9, 'min': 2, 'max': 199},
+        'slow_ema_span': {'type': int, 'default': 25, 'min': 3, 'max': 199},
+        'sl_atr_multiplier': {'type': float, 'default': 1.5, 'min': 0.1},
+        'tp_atr_multiplier': {'type': float, 'default': 3.0, 'min': 0.1},
+    },
+)
+
+DEFAULT_STRATEGY = 'EMA_CROSS_9_25'
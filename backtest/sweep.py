@@ -0,0 +1,237 @@
+import inspect
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+import candle_store
+import instrumentation
+from charts import render_sweep_charts, write_chart_series
+from main import POSITION_PARAMS, generate_signals, load_timeframes, run_backtest
+from metrics import equity_curves
+from results_db import ResultsDB, trade_row
+from strategy_registry import DEFAULT_STRATEGY
+
+# Columns shared with the workers: candle OHLC plus the generate_signals output they read
+CANDLE_COLUMNS = ['open', 'high', 'low', 'close']
+SIGNAL_COLUMNS = ['signal', 'stop_loss', 'take_profit']
+
+# Worker-side state, set once per process by _init_worker
+_shared = {}
+
+# run_backtest's position parameters, recorded with every run in a ResultsDB
+_RUN_DEFAULTS = {name: parameter.default for name, parameter in inspect.signature(run_backtest).parameters.items()
+                 if name in POSITION_PARAMS}
+
+
+def expand_grid(param_grid):
+    """Every combination of a {param: [values]} grid, in nested-loop order (first key outermost)"""
+    keys = list(param_grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*param_grid.values())]
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def _init_worker(shm_name, shape, settings):
+    shm = _attach(shm_name)
+    block = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    candles = pd.DataFrame({col: block[i] for i, col in enumerate(CANDLE_COLUMNS)}, copy=False)
+    signal_frame = pd.DataFrame(
+        {col: block[len(CANDLE_COLUMNS) + i] for i, col in enumerate(SIGNAL_COLUMNS)}, copy=False
+    )
+    _shared.update(shm=shm, candles=candles, signal_frame=signal_frame, settings=settings)
+    instrumentation.enable(settings.get('instrumentation', False))
+    instrumentation.reset()  # a forked worker starts with a copy of the parent's timings
+
+
+def share_frames(candles, signal_frame=None):
+    """
+    Copy the candle OHLC and signal columns into a new shared memory block for _init_worker.
+    Without signal_frame only the candle OHLC is shared (rows: CANDLE_COLUMNS).
+    Returns (shm, shape); the caller closes and unlinks shm.
+    """
+    columns = SIGNAL_COLUMNS if signal_frame is not None else []
+    shape = (len(CANDLE_COLUMNS) + len(columns), len(candles))
+    shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * 8))
+    block = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    for i, col in enumerate(CANDLE_COLUMNS):
+        block[i] = candles[col].to_numpy(dtype=np.float64)
+    for i, col in enumerate(columns):
+        block[len(CANDLE_COLUMNS) + i] = signal_frame[col].to_numpy(dtype=np.float64)
+    return shm, shape
+
+
+def _run_permutation(job):
+    counter, params = job
+    settings = _shared['settings']
+    results_directory = settings['results_directory']
+    with instrumentation.span('sweep.permutation'):
+        trades, final_balance, metrics = run_backtest(
+            instrument=settings['instrument'],
+            starting_balance=settings['starting_balance'],
+            candle_counter=len(_shared['candles']),
+            min_number_of_required_candles_for_strategy=settings['lookback'],
+            csv_filename=f'results_permutation_{counter}.csv',
+            folder_name=f'results_set_{counter}',
+            metric_filename=f'metrics_{counter}.csv',
+            results_directory=results_directory,
+            candles=_shared['candles'],
+            signal_frame=_shared['signal_frame'],
+            strategy=settings['strategy'],
+            strategy_params=settings['strategy_params'],
+            cache_directory=settings['cache_directory'],
+            write_files=not settings['results_db'],
+            **params,
+        )
+    row = {'run': counter, **params, 'final_balance': round(final_balance, 2), **metrics}
+    # With a ResultsDB the trades go back to the parent, which writes them in batches. The worker's
+    # span timings go back too, to be merged into the parent's
+    return (row, [trade_row(tr) for tr in trades] if settings['results_db'] else None,
+            instrumentation.snapshot(clear=True) if settings['instrumentation'] else None)
+
+
+def _chart_series_from_db(db, sweep_id, runs, results_directory):
+    """Write the chart series of some runs of a ResultsDB sweep, for render_sweep_charts"""
+    for run in runs:
+        run_id, instrument, starting_balance = db.connection.execute(
+            'SELECT run_id, instrument, starting_balance FROM runs WHERE sweep_id = ? AND run = ?',
+            (sweep_id, run)).fetchone()
+        trades = db.trades(run_id)
+        profits_usd = trades['profit_usd'].to_numpy(dtype=float)
+        equity_curve, drawdowns = equity_curves(profits_usd, starting_balance)
+        cum_pips = np.r_[0.0, np.cumsum(trades['profit_pips'].to_numpy(dtype=float))]
+        write_chart_series(os.path.join(results_directory, f'results_set_{run}', 'results'), instrument,
+                           equity_curve, drawdowns, profits_usd, cum_pips)
+
+
+@instrumentation.instrumentable
+def run_sweep(
+    param_grid,
+    instrument="EUR_USD",
+    granularity='M5',
+    start=None,
+    end=None,
+    candle_counter=8928,
+    csv_path='EURUSD5.csv',
+    starting_balance=850,
+    lookback=300,
+    results_directory='results_sets',
+    max_workers=None,
+    store_directory=candle_store.STORE_DIRECTORY,
+    strategy=DEFAULT_STRATEGY,
+    strategy_params=None,
+    cache_directory=None,
+    charts_top_n=0,
+    charts_sort_by='profit_factor',
+    chart_runs=None,
+    results_db=None,
+):
+    """
+    Run run_backtest for every permutation of param_grid across a process pool.
+
+    The candles are read and the strategy signals generated once, then placed in shared memory
+    that every worker maps instead of receiving its own copy. Workers only run the position
+    simulation, since signals do not depend on the risk/trailing parameters.
+
+    Args:
+        param_grid: {run_backtest keyword: [values]}, e.g. risk_percent, trail_on, trail_start, trail_distance
+        granularity, start, end, candle_counter, csv_path, store_directory: candle selection, as in run_backtest
+        max_workers: Worker processes (default: every core)
+        strategy, strategy_params: registered strategy and its parameters; only the parent process
+            imports the strategy, workers just simulate positions on its signals
+        cache_directory: ResultCache directory shared by the workers; permutations already in it
+            (same candles, strategy source and parameters) are not simulated again
+        charts_top_n, charts_sort_by, chart_runs: runs only save their chart series; once every
+            permutation is done, charts are drawn in a process pool for the top charts_top_n runs
+            by charts_sort_by, or for the run numbers in chart_runs (see charts.render_sweep_charts)
+        results_db: path of a results_db.ResultsDB SQLite file. Runs, metrics and trades are then
+            written there in batches instead of a results_set_{n} folder tree per permutation
+            (only sweep_results.csv and requested charts are written to results_directory)
+        instrumentation_path, profile: keyword only (see instrumentation.instrumentable); the span
+            histograms, including the workers', are written to instrumentation_path, and the parent
+            process's cProfile stats to profile
+
+    Returns:
+        DataFrame with one row per permutation: run number, parameters, final balance and metrics.
+        Also written to results_directory/sweep_results.csv. With results_db, results.attrs['sweep_id']
+        is the sweep's id in the database
+    """
+    jobs = list(enumerate(expand_grid(param_grid), start=1))
+
+    with instrumentation.span('data_load'):
+        candles = candle_store.load_candles(instrument, granularity, start=start, end=end,
+                                            rows=candle_counter, store_directory=store_directory,
+                                            csv_path=csv_path)
+    timeframes = load_timeframes(strategy, instrument, granularity, store_directory, csv_path)
+    signal_frame = generate_signals(candles, instrument=instrument, lookback=lookback,
+                                    strategy=strategy, strategy_params=strategy_params, granularity=granularity,
+                                    timeframes=timeframes)
+
+    settings = {
+        'instrument': instrument,
+        'starting_balance': starting_balance,
+        'lookback': lookback,
+        'results_directory': results_directory,
+        'strategy': strategy,
+        'strategy_params': strategy_params,
+        'cache_directory': cache_directory,
+        'results_db': results_db is not None,
+        'instrumentation': instrumentation.is_enabled(),
+    }
+    max_workers = max_workers or os.cpu_count()
+    chunksize = max(1, len(jobs) // (max_workers * 4))
+
+    # The database is closed (flushing the runs received so far) even if a worker fails or the sweep
+    # is interrupted, so a partial sweep is kept
+    db = ResultsDB(results_db) if results_db is not None else None
+    try:
+        sweep_id = None
+        if db is not None:
+            sweep_id = db.start_sweep(instrument, granularity, len(candles), strategy, strategy_params, param_grid)
+
+        rows = []
+        shm, shape = share_frames(candles, signal_frame)
+        try:
+            start_time = time.perf_counter()
+            with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                     initargs=(shm.name, shape, settings)) as executor:
+                for (counter, params), (row, trade_rows, timings) in zip(jobs, executor.map(_run_permutation, jobs,
+                                                                                             chunksize=chunksize)):
+                    rows.append(row)
+                    if timings:
+                        instrumentation.merge(timings)
+                    if db is not None:
+                        details = {'instrument': instrument, 'starting_balance': starting_balance,
+                                   'candle_counter': len(candles), **_RUN_DEFAULTS, **params}
+                        db.add_run(sweep_id, counter, details, params, row['final_balance'], row, trade_rows)
+                    print(f'Permutation: {row["run"]} of {len(jobs)} done, '
+                          f'time elapsed: {time.perf_counter() - start_time:.2f}s')
+        finally:
+            shm.close()
+            shm.unlink()
+
+        results = pd.DataFrame(rows)
+        os.makedirs(results_directory, exist_ok=True)
+        results.to_csv(os.path.join(results_directory, 'sweep_results.csv'), index=False)
+        if charts_top_n or chart_runs:
+            if db is not None:
+                if chart_runs is None:
+                    chart_runs = results.sort_values(charts_sort_by, ascending=False).head(charts_top_n)['run'].tolist()
+                _chart_series_from_db(db, sweep_id, chart_runs, results_directory)
+            render_sweep_charts(results, results_directory, top_n=charts_top_n, sort_by=charts_sort_by,
+                                runs=chart_runs, max_workers=max_workers)
+        if db is not None:
+            results.attrs['sweep_id'] = sweep_id
+    finally:
+        if db is not None:
+            db.close()
+    return results
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+import main
+from benchmark import synthetic_candles
+from metrics import batch_metrics, calculate_metrics, pad_rows
+from result_cache import ResultCache
+
+# backtest/ has no __init__.py, so pytest puts it on sys.path and the flat imports resolve
+# (python -m pytest from the repository root or from backtest/).
+
+LOOKBACK = 300
+POSITION_CASES = [
+    {'trail_on': False},
+    {'trail_on': True, 'trail_start': 0.5, 'trail_distance': 0.25},
+    {'trail_on': True, 'trail_start': 0.3, 'trail_distance': 0.9, 'risk_percent': 0.05},
+]
+
+
+@pytest.fixture(scope='module')
+def candles():
+    return synthetic_candles(4000, seed=1)
+
+
+@pytest.fixture(scope='module')
+def signal_frame(candles):
+    return main.generate_signals(candles, lookback=LOOKBACK, use_cache=False)
+
+
+def _rows(trades):
+    return [trade.to_dict() | {'open_bar': trade.open_bar, 'close_bar': trade.close_bar} for trade in trades]
+
+
+def test_synthetic_candles_signal(signal_frame):
+    assert np.count_nonzero(signal_frame['signal']) >= 20
+
+
+@pytest.mark.parametrize('params', POSITION_CASES)
+def test_vectorized_exits_match_loop(candles, signal_frame, params):
+    vectorized = main.simulate_positions(candles, signal_frame, exit_mode='vectorized', **params)
+    loop = main.simulate_positions(candles, signal_frame, exit_mode='loop', **params)
+    assert _rows(vectorized[0]) == _rows(loop[0])
+    assert vectorized[1] == loop[1]
+
+
+def test_batch_metrics_match_calculate_metrics(candles, signal_frame):
+    runs = [main.simulate_positions(candles, signal_frame, **params)[0] for params in POSITION_CASES]
+    runs.append(runs[0][:5])  # a shorter run, so the others' rows are padded
+    batch = batch_metrics(pad_rows([[trade.profit_usd for trade in trades] for trades in runs]), 850)
+    for row, trades in enumerate(runs):
+        metrics = calculate_metrics(trades, 850)
+        for name in ('wins', 'losses', 'breakeven', 'max_drawdown_duration'):
+            assert int(batch[name][row]) == metrics[name], name
+        for name in ('win_rate', 'avg_win', 'avg_loss', 'profit_factor', 'max_drawdown', 'max_drawdown_pct'):
+            assert round(float(batch[name][row]), 2) == metrics[name], name
+        for name in ('sharpe', 'sortino', 'mar'):
+            assert round(float(batch[name][row]), 3) == metrics[name], name
+        assert batch['total_trades'][row] == metrics['total_trades']
+        assert batch['final_balance'][row] == pytest.approx(850 + sum(trade.profit_usd for trade in trades))
+
+
+@pytest.mark.parametrize('signal_mode', ['window', 'streaming'])
+def test_vectorized_signals_match(candles, signal_mode):
+    window = candles.iloc[:900].reset_index(drop=True)  # 'window' calls strat.run per candle
+    vectorized = main.generate_signals(window, lookback=LOOKBACK, use_cache=False)
+    other = main.generate_signals(window, lookback=LOOKBACK, signal_mode=signal_mode, use_cache=False)
+    assert np.count_nonzero(vectorized['signal'])
+    np.testing.assert_array_equal(vectorized['signal'], other['signal'])
+    np.testing.assert_array_equal(vectorized['stop_loss'], other['stop_loss'])
+    np.testing.assert_array_equal(vectorized['take_profit'], other['take_profit'])
+
+
+def test_result_cache_round_trip(candles, signal_frame, tmp_path):
+    trades, balance = main.simulate_positions(candles, signal_frame, trail_on=True)
+    trades[-1].take_profit = None  # trailed trades store None for the dropped TP
+    metrics = calculate_metrics(trades, 850, len(candles))
+    cache = ResultCache(str(tmp_path))
+    cache.put('key', trades, balance, metrics, 850)
+
+    assert 'key' in cache and 'other' not in cache
+    assert cache.get('other') is None
+    cached_trades, cached_balance, cached_metrics, equity_curve = cache.get('key')
+    assert _rows(cached_trades) == _rows(trades)
+    assert cached_balance == balance
+    assert cached_metrics == metrics
+    assert equity_curve[0] == 850 and equity_curve[-1] == pytest.approx(balance)
+
+
+def test_run_backtest_cache_hit(candles, tmp_path):
+    def run(**kwargs):
+        return main.run_backtest(candles=candles, candle_counter=len(candles), trail_on=True,
+                                 min_number_of_required_candles_for_strategy=LOOKBACK, write_files=False,
+                                 cache_directory=str(tmp_path), **kwargs)
+
+    first = run()
+    assert len(list(tmp_path.glob('*.npz'))) == 1
+    second = run()
+    assert _rows(second[0]) == _rows(first[0])
+    assert second[1:] == first[1:]
+    run(risk_percent=0.02)  # a changed parameter is a new entry
+    assert len(list(tmp_path.glob('*.npz'))) == 2
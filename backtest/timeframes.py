@@ -0,0 +1,390 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    import candle_store
+except ImportError:  # imported as backtest.timeframes by the live bot
+    from backtest import candle_store
+
+# Higher-timeframe bars (M15, H1, H4, D, ...) derived from one base series, so a strategy can read
+# e.g. an H1 trend filter next to its M5 candles without a second data source.
+#
+# Bars are built with a grouped OHLC aggregation: every base candle is assigned to the bucket its
+# open time falls in (UTC, shifted by `offset` seconds, e.g. for a 17:00 New York daily close), then
+# open/high/low/close are taken per bucket with np.maximum/minimum.reduceat.
+#
+# A bar counts as completed once the base candles have reached its end time. Aligning base candles
+# to a higher timeframe maps each candle to the last bar completed by that candle's close, so a
+# strategy never sees a bar that was still forming (or one that ends after a weekend gap before the
+# next candle shows up).
+#
+#   MultiTimeframe.from_store(...)  completed bars from the candle store, cached on disk as
+#                                   <instrument>/<granularity>_from_<base>/ and extended
+#                                   incrementally when the base series grows (backtests)
+#   MultiTimeframe(...).update(c)   bars kept in memory and advanced with each batch of new base
+#                                   candles (the live bot, streaming signals)
+
+NANOSECONDS = 1_000_000_000
+
+
+def period_seconds(granularity, base_granularity):
+    """Length of a `granularity` bar, checked to be a whole number of base candles"""
+    try:
+        period = candle_store.GRANULARITY_SECONDS[granularity]
+        base_period = candle_store.GRANULARITY_SECONDS[base_granularity]
+    except KeyError as e:
+        raise ValueError(f"Unknown granularity: {e.args[0]}") from None
+    if not base_period or period <= base_period or period % base_period:
+        raise ValueError(f"{granularity} bars cannot be built from {base_granularity} candles")
+    return period
+
+
+def derived_name(granularity, base_granularity, offset=0):
+    """Store granularity name of a derived series, e.g. 'H1_from_M5'"""
+    return f"{granularity}_from_{base_granularity}" + (f"_{offset}s" if offset else "")
+
+
+def to_nanoseconds(times):
+    """Candle times (datetime64, RFC3339 strings, datetimes or epoch seconds) -> int64 ns UTC"""
+    times = np.asarray(times)
+    if times.dtype.kind == 'M':
+        return times.astype('datetime64[ns]').view(np.int64)
+    if times.dtype.kind in 'iuf':
+        return np.round(times.astype(np.float64) * NANOSECONDS).astype(np.int64)
+    return pd.to_datetime(times, utc=True).tz_convert(None).as_unit('ns').asi8
+
+
+def resample_ohlc(times, prices, period, offset=0):
+    """
+    Group base candles into period-long bars.
+
+    Args:
+        times: int64 ns open times, sorted
+        prices: float array of shape (4, n): open, high, low, close rows
+        period, offset: bar length and alignment shift, in seconds
+
+    Returns:
+        (bar_times, bar_prices, starts): bar open times, their (4, bars) OHLC and the index of each
+        bar's first base candle
+    """
+    period_ns, offset_ns = period * NANOSECONDS, offset * NANOSECONDS
+    if not len(times):
+        return np.empty(0, dtype=np.int64), np.empty((4, 0)), np.empty(0, dtype=np.intp)
+    buckets = (times - offset_ns) // period_ns * period_ns + offset_ns
+    starts = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))
+    ends = np.append(starts[1:], len(times)) - 1
+    bar_prices = np.vstack([
+        prices[0, starts],
+        np.maximum.reduceat(prices[1], starts),
+        np.minimum.reduceat(prices[2], starts),
+        prices[3, ends],
+    ])
+    return buckets[starts], bar_prices, starts
+
+
+def first_whole_bar(times, period, offset=0):
+    """
+    Index of the first candle of the first bar that starts within `times`: a series starting
+    mid-bar cannot build that bar whole, so its candles are skipped.
+    """
+    period_ns, offset_ns = period * NANOSECONDS, offset * NANOSECONDS
+    if not len(times) or (times[0] - offset_ns) % period_ns == 0:
+        return 0
+    next_bar = (times[0] - offset_ns) // period_ns * period_ns + period_ns + offset_ns
+    return int(np.searchsorted(times, next_bar, side='left'))
+
+
+def base_candles_needed(timeframes, base_granularity):
+    """Base candles that complete `bars` bars of every {granularity: bars} (plus a partial first one)"""
+    base_period = candle_store.GRANULARITY_SECONDS[base_granularity]
+    return max((bars + 1) * period_seconds(granularity, base_granularity) // base_period
+               for granularity, bars in timeframes.items())
+
+
+def last_completed(candle_times, bar_times, period, base_period):
+    """
+    For every base candle, the index of the last bar that had ended by the candle's close (-1 if none).
+
+    Args:
+        candle_times, bar_times: int64 ns open times, both sorted
+    """
+    bar_ends = bar_times + period * NANOSECONDS
+    return np.searchsorted(bar_ends, candle_times + base_period * NANOSECONDS, side='right') - 1
+
+
+class Resampler:
+    """
+    Completed `granularity` bars of one base series, advanced incrementally.
+
+    Only the bar still forming is carried between updates, so each update costs the aggregation of
+    the new candles alone.
+
+    Args:
+        max_bars: keep at least the last max_bars completed bars and drop older ones in batches
+            (None keeps all)
+    """
+
+    def __init__(self, granularity, base_granularity, offset=0, max_bars=None):
+        self.granularity = granularity
+        self.base_granularity = base_granularity
+        self.period = period_seconds(granularity, base_granularity)
+        self.base_period = candle_store.GRANULARITY_SECONDS[base_granularity]
+        self.offset = offset
+        self.max_bars = max_bars
+        self.times = np.empty(0, dtype=np.int64)
+        self.prices = np.empty((4, 0))
+        self.count = 0
+        self.forming = None       # [open time, open, high, low, close] of the bar not yet completed
+        self.last_time = None     # open time of the last base candle seen
+
+    def _append(self, times, prices):
+        if not len(times):
+            return 0
+        needed = self.count + len(times)
+        if needed > len(self.times):
+            capacity = max(needed, 2 * len(self.times), 64)
+            grown_times = np.empty(capacity, dtype=np.int64)
+            grown_prices = np.empty((4, capacity))
+            grown_times[:self.count] = self.times[:self.count]
+            grown_prices[:, :self.count] = self.prices[:, :self.count]
+            self.times, self.prices = grown_times, grown_prices
+        self.times[self.count:needed] = times
+        self.prices[:, self.count:needed] = prices
+        self.count = needed
+        if self.max_bars is not None and self.count > 2 * self.max_bars:
+            # Trimmed in one move once the buffer holds twice what is kept
+            keep = slice(self.count - self.max_bars, self.count)
+            self.times[:self.max_bars] = self.times[keep]
+            self.prices[:, :self.max_bars] = self.prices[:, keep]
+            self.count = self.max_bars
+        return len(times)
+
+    def load(self, times, prices, last_time=None):
+        """Start from already completed bars (e.g. a derived series from the store)"""
+        self.count = 0
+        self.forming = None
+        self._append(np.asarray(times, dtype=np.int64), np.asarray(prices, dtype=np.float64))
+        self.last_time = last_time
+
+    def update(self, times, prices):
+        """
+        Add base candles (int64 ns open times and (4, n) OHLC), skipping any not newer than the last
+        one seen. Returns the number of bars completed.
+        """
+        times = np.asarray(times, dtype=np.int64)
+        if self.last_time is not None:
+            newer = times > self.last_time
+            if not newer.all():
+                times, prices = times[newer], prices[:, newer]
+        if not len(times):
+            return 0
+        self.last_time = int(times[-1])
+        if not self.count and self.forming is None:
+            first = first_whole_bar(times, self.period, self.offset)
+            times, prices = times[first:], prices[:, first:]
+            if not len(times):
+                return 0
+        bar_times, bar_prices, _ = resample_ohlc(times, np.asarray(prices, dtype=np.float64), self.period,
+                                                 self.offset)
+
+        completed = 0
+        if self.forming is not None:
+            if bar_times[0] == self.forming[0]:
+                bar_prices[0, 0] = self.forming[1]
+                bar_prices[1, 0] = max(bar_prices[1, 0], self.forming[2])
+                bar_prices[2, 0] = min(bar_prices[2, 0], self.forming[3])
+            else:
+                completed += self._append(self.forming[:1], np.array(self.forming[1:])[:, None])
+            self.forming = None
+
+        # The last bar is completed once its final base candle has closed
+        bar_end = bar_times[-1] + self.period * NANOSECONDS
+        if times[-1] + self.base_period * NANOSECONDS >= bar_end:
+            completed += self._append(bar_times, bar_prices)
+        else:
+            completed += self._append(bar_times[:-1], bar_prices[:, :-1])
+            self.forming = [int(bar_times[-1]), *bar_prices[:, -1].tolist()]
+        return completed
+
+    def frame(self, count=None):
+        """Completed bars (the last `count`) as a DataFrame of time, open, high, low, close"""
+        first = 0 if count is None else max(0, self.count - count)
+        frame = pd.DataFrame(self.prices[:, first:self.count].T, columns=list(candle_store.PRICE_COLUMNS))
+        frame.insert(0, 'time', self.times[first:self.count].view('datetime64[ns]'))
+        return frame
+
+
+def derive_series(instrument, granularity, base_granularity='M5', offset=0,
+                  store_directory=candle_store.STORE_DIRECTORY, csv_path=None):
+    """
+    Build or extend the stored `granularity` bars of a stored base series.
+
+    The derived series keeps completed bars only. Its meta records how many base rows they cover;
+    when the base series has grown since (and still starts with the same candles), only the rows
+    after those are aggregated and appended. Otherwise the series is rebuilt.
+
+    Returns:
+        The derived series' store granularity name (see derived_name), for candle_store.load_candles
+    """
+    period = period_seconds(granularity, base_granularity)
+    base_period = candle_store.GRANULARITY_SECONDS[base_granularity]
+    name = derived_name(granularity, base_granularity, offset)
+    base = candle_store.load_candles(instrument, base_granularity, store_directory=store_directory,
+                                     csv_path=csv_path)
+    if 'time' not in base:
+        raise ValueError(f"Stored candles for {instrument} {base_granularity} have no time column")
+    base_times = base['time'].to_numpy().view(np.int64)
+
+    meta = candle_store.read_meta(instrument, name, store_directory)
+    extend = False
+    if meta is not None and meta['base_last_time'] is not None and meta['base_rows'] <= len(base_times):
+        last = meta['base_rows'] - 1
+        extend = (base_times[0] == meta['base_first_time'] and base_times[last] == meta['base_last_time']
+                  and base['close'].iat[last] == meta['base_last_close'])
+    if extend:
+        first = meta['base_rows']
+        if first == len(base_times):
+            return name
+    else:
+        first = first_whole_bar(base_times, period, offset)
+
+    prices = np.vstack([base[column].to_numpy()[first:] for column in candle_store.PRICE_COLUMNS])
+    bar_times, bar_prices, starts = resample_ohlc(base_times[first:], prices, period, offset)
+    if len(bar_times) and base_times[-1] + base_period * NANOSECONDS < bar_times[-1] + period * NANOSECONDS:
+        # The last bar is still forming: leave its candles for the next call
+        consumed = first + int(starts[-1])
+        bar_times, bar_prices = bar_times[:-1], bar_prices[:, :-1]
+    else:
+        consumed = len(base_times)
+    added = len(bar_times)
+
+    if extend:
+        directory = candle_store.series_directory(instrument, name, store_directory)
+        bar_prices = np.concatenate([np.load(os.path.join(directory, 'ohlc.npy')), bar_prices], axis=1)
+        bar_times = np.concatenate([np.load(os.path.join(directory, 'time.npy')), bar_times])
+    candle_store.write_series(instrument, name, bar_prices, bar_times, store_directory, {
+        'derived_from': base_granularity,
+        'offset': offset,
+        'base_rows': consumed,
+        'base_first_time': int(base_times[0]),
+        'base_last_time': int(base_times[consumed - 1]) if consumed else None,
+        'base_last_close': float(base['close'].iat[consumed - 1]) if consumed else None,
+    })
+    print(f"{instrument} {granularity}: {len(bar_times)} bars ({added} new) from {consumed} {base_granularity} candles")
+    return name
+
+
+def _take(values, positions, missing):
+    if not len(values):
+        return np.full((len(positions),) + values.shape[1:], np.nan)
+    taken = values[positions]
+    taken[missing] = np.nan
+    return taken
+
+
+class MultiTimeframe:
+    """
+    Higher-timeframe bars derived from one base series, for strategies that read several timeframes.
+
+    Args:
+        base_granularity: granularity of the candles passed to update()
+        granularities: bars to derive, e.g. ('H1', 'H4')
+        offset: bar alignment shift in seconds (0: UTC boundaries)
+        max_bars: completed bars kept per granularity (None keeps all)
+    """
+
+    def __init__(self, base_granularity, granularities, offset=0, max_bars=None):
+        self.base_granularity = base_granularity
+        self.base_period = candle_store.GRANULARITY_SECONDS[base_granularity]
+        self.resamplers = {granularity: Resampler(granularity, base_granularity, offset, max_bars)
+                           for granularity in granularities}
+
+    @classmethod
+    def from_store(cls, instrument, base_granularity, granularities, offset=0,
+                   store_directory=candle_store.STORE_DIRECTORY, csv_path=None):
+        """Every completed bar of the stored base series, read from (and cached in) the candle store"""
+        timeframes = cls(base_granularity, granularities, offset)
+        for granularity, resampler in timeframes.resamplers.items():
+            name = derive_series(instrument, granularity, base_granularity, offset, store_directory, csv_path)
+            meta = candle_store.read_meta(instrument, name, store_directory)
+            bars = candle_store.load_candles(instrument, name, store_directory=store_directory)
+            resampler.load(bars['time'].to_numpy().view(np.int64),
+                           np.vstack([bars[column].to_numpy() for column in candle_store.PRICE_COLUMNS]),
+                           meta['base_last_time'])
+        return timeframes
+
+    def update(self, candles):
+        """
+        Advance every timeframe with new complete base candles: a DataFrame or a list of candle dicts
+        with time and open/high/low/close (already seen candles are skipped).
+
+        Returns:
+            {granularity: number of bars completed}
+        """
+        if isinstance(candles, pd.DataFrame):
+            if 'time' not in candles:
+                raise ValueError("Candles need a time column to build higher timeframes")
+            times = to_nanoseconds(candles['time'].to_numpy())
+            prices = np.vstack([candles[column].to_numpy(dtype=np.float64)
+                                for column in candle_store.PRICE_COLUMNS])
+        else:
+            if not candles:
+                return {granularity: 0 for granularity in self.resamplers}
+            times = to_nanoseconds([candle['time'] for candle in candles])
+            prices = np.array([[candle[column] for candle in candles] for column in candle_store.PRICE_COLUMNS],
+                              dtype=np.float64)
+        return self.advance(times, prices)
+
+    def advance(self, times, prices):
+        """update() on arrays: int64 ns open times and (4, n) OHLC"""
+        return {granularity: resampler.update(times, prices) for granularity, resampler in self.resamplers.items()}
+
+    def bars(self, granularity, count=None):
+        """Completed bars of a timeframe (the last `count`), oldest first, as a DataFrame"""
+        return self.resamplers[granularity].frame(count)
+
+    def forming(self, granularity):
+        """The bar still being built from the latest candles, as a dict, or None"""
+        forming = self.resamplers[granularity].forming
+        if forming is None:
+            return None
+        return dict(zip(('time', *candle_store.PRICE_COLUMNS),
+                        (pd.Timestamp(forming[0]), *forming[1:])))
+
+    def fingerprint(self):
+        """Identifies the bars held (for signal caches)"""
+        return tuple((granularity, resampler.count,
+                      int(resampler.times[resampler.count - 1]) if resampler.count else None)
+                     for granularity, resampler in self.resamplers.items())
+
+    def index(self, granularity, candles):
+        """For each base candle, the position in bars(granularity) of the last bar completed by its close (-1: none)"""
+        resampler = self.resamplers[granularity]
+        return last_completed(to_nanoseconds(candles['time'].to_numpy()), resampler.times[:resampler.count],
+                              resampler.period, self.base_period)
+
+    def align(self, granularity, candles, values=None):
+        """
+        Higher-timeframe values lined up with base candles, without lookahead: each candle gets the
+        value of the last bar completed by its close (NaN before the first one).
+
+        Args:
+            candles: base candles with a time column
+            values: one value per bar of bars(granularity) (e.g. an EMA computed on them), as an
+                array, Series or DataFrame; default: the bars' OHLC
+
+        Returns:
+            Array for 1D values, otherwise a DataFrame on candles' index with columns prefixed
+            by the granularity (e.g. H1_close)
+        """
+        positions = self.index(granularity, candles)
+        missing = positions < 0
+        if values is None:
+            values = self.bars(granularity).drop(columns='time')
+        if isinstance(values, pd.DataFrame):
+            aligned = _take(values.to_numpy(dtype=np.float64), positions, missing)
+            return pd.DataFrame(aligned, index=candles.index,
+                                columns=[f"{granularity}_{column}" for column in values.columns])
+        return _take(np.asarray(values, dtype=np.float64), positions, missing)
@@ -0,0 +1,209 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import candle_store
+from main import POSITION_PARAMS, calculate_metrics, generate_signals, load_timeframes, simulate_positions
+from metrics import objective_score
+from strategy_registry import DEFAULT_STRATEGY
+from sweep import _init_worker, _shared, expand_grid, share_frames
+
+# Walk-forward optimization: roll a train window and the test window after it through history,
+# pick the best param_grid permutation on each train window and trade it, unseen, on the test window.
+#
+# Signals are generated once over the whole history and sliced per window. A signal only depends
+# on the candles before it, so every window gets exactly the signals it would have computed itself,
+# with indicators warmed up on the candles before the window instead of losing its first `lookback`
+# candles. The candles and signals are shared with the worker processes like the sweep does.
+
+
+def walk_forward_windows(candle_count, train_candles, test_candles, step_candles=None):
+    """(train_start, test_start, test_stop) row ranges of every complete train/test window pair"""
+    step_candles = step_candles or test_candles
+    windows = []
+    train_start = 0
+    while train_start + train_candles + test_candles <= candle_count:
+        test_start = train_start + train_candles
+        windows.append((train_start, test_start, test_start + test_candles))
+        train_start += step_candles
+    return windows
+
+
+def _simulate(candles, signal_frame, params, starting_balance, instrument):
+    """simulate_positions on one window -> (trades, balance, metrics)"""
+    trades, balance = simulate_positions(candles, signal_frame, instrument, starting_balance=starting_balance,
+                                         **{**POSITION_PARAMS, **params})
+    metrics = calculate_metrics(trades, starting_balance, len(candles))
+    metrics['final_balance'] = round(balance, 2)
+    return trades, balance, metrics
+
+
+def _optimize_window(job):
+    """Run every permutation on one train window. Returns (window, best params, best metrics)"""
+    window, train_start, train_stop = job
+    settings = _shared['settings']
+    candles = _shared['candles'].iloc[train_start:train_stop]
+    signal_frame = _shared['signal_frame'].iloc[train_start:train_stop]
+
+    best = None
+    for params in settings['permutations']:
+        _, _, metrics = _simulate(candles, signal_frame, params, settings['starting_balance'], settings['instrument'])
+        score = objective_score(metrics, settings['objective'], settings['min_trades'])
+        if best is None or score > best[0]:
+            best = (score, params, metrics)
+    return window, best[1], best[2]
+
+
+def run_walk_forward(
+    param_grid,
+    train_candles=8928,
+    test_candles=2016,
+    step_candles=None,
+    instrument="EUR_USD",
+    granularity='M5',
+    start=None,
+    end=None,
+    candle_counter=None,
+    csv_path='EURUSD5.csv',
+    starting_balance=850,
+    lookback=300,
+    objective='profit_factor',
+    min_trades=10,
+    results_directory='walk_forward',
+    max_workers=None,
+    store_directory=candle_store.STORE_DIRECTORY,
+    strategy=DEFAULT_STRATEGY,
+    strategy_params=None,
+):
+    """
+    Walk-forward optimization of the simulate_positions parameters (risk_percent, trail_on,
+    trail_start, trail_distance).
+
+    Each train window is optimized in a worker process. The chosen parameters are then traded on
+    the test window that follows, with the balance carried from one test window to the next, so the
+    test windows stitch into one out-of-sample equity curve.
+
+    Args:
+        param_grid: {parameter: [values]} over the simulate_positions parameters (POSITION_PARAMS); signals
+            are generated once, so strategy parameters go in strategy_params instead
+        train_candles, test_candles: window lengths in candles
+        step_candles: how far each window pair moves on (default test_candles, so the test
+            windows are back to back)
+        instrument, granularity, start, end, candle_counter, csv_path, store_directory: candle
+            selection, as in run_backtest (candle_counter None keeps every candle in [start, end))
+        objective: calculate_metrics key (or 'final_balance') maximised on the train windows; ties go to
+            the first permutation in grid order
+        min_trades: permutations with fewer train trades are never chosen
+        max_workers: Worker processes (default: every core)
+
+    Returns:
+        dict with
+            windows: DataFrame, one row per window: time ranges, chosen params, train and test metrics
+            trades: out-of-sample trades, in order
+            equity_curve: DataFrame of window, trade number and balance after each out-of-sample trade
+            stability: DataFrame, one row per parameter: how often each window chose the most common
+                value and how many times the choice changed between consecutive windows
+            final_balance
+        The DataFrames are also written to results_directory as CSVs.
+    """
+    unknown = set(param_grid) - set(POSITION_PARAMS)
+    if unknown:
+        raise ValueError(f"Walk-forward only varies {', '.join(POSITION_PARAMS)}, not {', '.join(sorted(unknown))} "
+                         f"(strategy parameters go in strategy_params)")
+    permutations = expand_grid(param_grid)
+    candles = candle_store.load_candles(instrument, granularity, start=start, end=end, rows=candle_counter,
+                                        store_directory=store_directory, csv_path=csv_path)
+    windows = walk_forward_windows(len(candles), train_candles, test_candles, step_candles)
+    if not windows:
+        raise ValueError(f"{len(candles)} candles are not enough for one {train_candles} + {test_candles} candle window")
+    timeframes = load_timeframes(strategy, instrument, granularity, store_directory, csv_path)
+    signal_frame = generate_signals(candles, instrument=instrument, lookback=lookback,
+                                    strategy=strategy, strategy_params=strategy_params, granularity=granularity,
+                                    timeframes=timeframes)
+
+    # --- Optimize every train window in parallel ---
+    settings = {
+        'instrument': instrument,
+        'starting_balance': starting_balance,
+        'permutations': permutations,
+        'objective': objective,
+        'min_trades': min_trades,
+    }
+    jobs = [(window, train_start, test_start) for window, (train_start, test_start, _) in enumerate(windows)]
+    chosen = {}
+    shm, shape = share_frames(candles, signal_frame)
+    try:
+        start_time = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), initializer=_init_worker,
+                                 initargs=(shm.name, shape, settings)) as executor:
+            for window, params, metrics in executor.map(_optimize_window, jobs):
+                chosen[window] = (params, metrics)
+                print(f'Window {window + 1} of {len(windows)} optimized ({len(permutations)} permutations), '
+                      f'time elapsed: {time.perf_counter() - start_time:.2f}s')
+    finally:
+        shm.close()
+        shm.unlink()
+
+    # --- Trade each window's choice on its test window, carrying the balance forward ---
+    times = candles['time'] if 'time' in candles else None
+    balance = starting_balance
+    rows, oos_trades, equity = [], [], []
+    for window, (train_start, test_start, test_stop) in enumerate(windows):
+        params, train_metrics = chosen[window]
+        trades, new_balance, test_metrics = _simulate(candles.iloc[test_start:test_stop],
+                                                      signal_frame.iloc[test_start:test_stop],
+                                                      params, balance, instrument)
+        running = balance
+        for tr in trades:
+            running += tr['profit_usd']
+            equity.append({'window': window, 'trade': len(oos_trades), 'balance': round(running, 2)})
+            oos_trades.append(tr)
+        row = {'window': window}
+        if times is not None:
+            row.update(train_start=times.iloc[train_start], test_start=times.iloc[test_start],
+                       test_end=times.iloc[test_stop - 1])
+        row.update(params)
+        row.update({f'train_{objective}': train_metrics.get(objective),
+                    'train_trades': train_metrics.get('total_trades', 0),
+                    f'test_{objective}': test_metrics.get(objective),
+                    'test_trades': test_metrics.get('total_trades', 0),
+                    'start_balance': round(balance, 2),
+                    'end_balance': round(new_balance, 2)})
+        rows.append(row)
+        balance = new_balance
+
+    windows_frame = pd.DataFrame(rows)
+    equity_curve = pd.DataFrame(equity, columns=['window', 'trade', 'balance'])
+
+    # --- Parameter stability: does the optimum stay put from window to window? ---
+    stability = []
+    for name in param_grid:
+        chosen_values = windows_frame[name]
+        counts = chosen_values.value_counts()
+        stability.append({
+            'parameter': name,
+            'most_common': counts.index[0],
+            'most_common_pct': round(counts.iloc[0] / len(chosen_values) * 100, 2),
+            'distinct_values': len(counts),
+            'changes': int((chosen_values != chosen_values.shift()).iloc[1:].sum()),
+        })
+    stability = pd.DataFrame(stability)
+
+    os.makedirs(results_directory, exist_ok=True)
+    windows_frame.to_csv(os.path.join(results_directory, 'walk_forward_windows.csv'), index=False)
+    equity_curve.to_csv(os.path.join(results_directory, 'out_of_sample_equity.csv'), index=False)
+    stability.to_csv(os.path.join(results_directory, 'parameter_stability.csv'), index=False)
+    pd.DataFrame([tr.to_dict() for tr in oos_trades]).to_csv(
+        os.path.join(results_directory, 'out_of_sample_trades.csv'), index=False)
+
+    print(f'Walk-forward: {len(windows)} windows, {len(oos_trades)} out-of-sample trades, '
+          f'final balance ${round(balance, 2)}')
+    return {
+        'windows': windows_frame,
+        'trades': oos_trades,
+        'equity_curve': equity_curve,
+        'stability': stability,
+        'final_balance': balance,
+    }
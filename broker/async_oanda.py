@@ -0,0 +1,70 @@
+import asyncio
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from oandapyV20.exceptions import V20Error
+
+
+class AsyncOandaClient:
+    """
+    Awaitable wrapper around OandaClient for the asyncio bot runtime.
+
+    Every call runs the blocking client method on a dedicated thread pool, so requests for many
+    instruments are in flight at once (asyncio's default executor only has a handful of threads).
+    Network errors and 5xx responses are retried with exponential backoff and jitter, without
+    blocking the other instruments the way time.sleep did.
+
+    Args:
+        client: OandaClient
+        max_concurrency: Requests in flight at once
+        retries: Attempts per call before the error is raised
+        backoff: Delay before the first retry in seconds, doubled after every failed attempt
+    """
+
+    def __init__(self, client, max_concurrency=32, retries=3, backoff=1.0):
+        self.client = client
+        self.retries = retries
+        self.backoff = backoff
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='oanda')
+        client.configure_pool(max_concurrency)  # one keep-alive connection per worker thread
+
+    async def _call(self, method, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.retries):
+            try:
+                return await loop.run_in_executor(self._executor, lambda: method(*args, **kwargs))
+            except (requests.exceptions.RequestException, V20Error) as e:
+                retryable = not isinstance(e, V20Error) or getattr(e, 'code', 0) >= 500
+                if not retryable or attempt == self.retries - 1:
+                    raise
+                delay = self.backoff * 2 ** attempt * (0.5 + random.random() / 2)
+                print(f"Attempt {attempt+1} of {method.__name__} failed: {e}. Retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def get_candles(self, instrument, count=200, granularity="M5"):
+        return await self._call(self.client.get_candles, instrument, count=count, granularity=granularity)
+
+    async def update_candles(self, instrument, granularity="M5", count=200):
+        return await self._call(self.client.update_candles, instrument, granularity=granularity, count=count)
+
+    async def get_price(self, instrument):
+        return await self._call(self.client.get_price, instrument)
+
+    async def get_prices(self, instrument_list):
+        return await self._call(self.client.get_prices, instrument_list)
+
+    async def get_balance(self):
+        return await self._call(self.client.get_balance)
+
+    async def get_open_positions(self):
+        return await self._call(self.client.get_open_positions)
+
+    async def execute_trade(self, signal, prevent_duplicates=True):
+        # Orders are not retried: a timed-out order may still have been filled
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor,
+                                          lambda: self.client.execute_trade(signal, prevent_duplicates))
+
+    def close(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,348 @@
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from broker.oanda import GRANULARITY_SECONDS, parse_time
+
+# A local stand-in for the parts of the OANDA v20 REST API the bot uses, so the live runtime can be
+# exercised without an account:
+#
+#   with FakeOandaServer(instruments=['EUR_USD', 'GBP_USD'], granularity='S5', latency=0.2) as server:
+#       client = OandaClient('token', server.account_id, api_url=server.url)
+#
+# Candles are generated on the wall clock: every request first materialises all candles that have
+# closed since the last one, plus the still-forming candle (complete=False), like the real API.
+#
+# The pricing stream sends newline-delimited PRICE messages and periodic HEARTBEATs. It replays
+# recorded ticks (e.g. a PriceStream record_path file) when given, otherwise it streams the
+# current quote of each subscribed instrument every tick_interval seconds.
+
+
+def format_time(seconds):
+    """Epoch seconds -> OANDA RFC3339 time string"""
+    moment = datetime.fromtimestamp(seconds, tz=timezone.utc)
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.') + f'{moment.microsecond * 1000:09d}Z'
+
+
+class _Market:
+    """Random-walk candles for one instrument, generated up to the current time on demand"""
+
+    def __init__(self, instrument, period, history, rng):
+        self.instrument = instrument
+        self.period = period
+        self.pip = 0.01 if 'JPY' in instrument else 0.0001
+        self.decimals = 3 if 'JPY' in instrument else 5
+        self.rng = rng
+        self.price = 150.0 if 'JPY' in instrument else 1.1 + rng.random() * 0.2
+        self.candles = []  # complete candles: (start, open, high, low, close)
+        now = time.time()
+        self.next_start = (int(now // period) - history) * period
+
+    def _step(self):
+        open_ = self.price
+        moves = [self.rng.gauss(0, 2 * self.pip) for _ in range(4)]
+        path = [open_]
+        for move in moves:
+            path.append(path[-1] + move)
+        self.price = path[-1]
+        return (round(open_, self.decimals), round(max(path), self.decimals),
+                round(min(path), self.decimals), round(path[-1], self.decimals))
+
+    def catch_up(self, now):
+        while self.next_start + self.period <= now:
+            self.candles.append((self.next_start,) + self._step())
+            self.next_start += self.period
+
+    def forming(self):
+        price = round(self.price, self.decimals)
+        return (self.next_start, price, price, price, price)
+
+    def quote(self, spread_pips=1.0):
+        half = spread_pips * self.pip / 2
+        return round(self.price - half, self.decimals), round(self.price + half, self.decimals)
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # room for a burst of concurrent connections
+
+
+class FakeOandaServer:
+    """
+    Threaded HTTP server answering candles, pricing, account details/summary, open positions and market orders.
+
+    Args:
+        instruments: Instruments it serves prices and candles for
+        granularity: Candle granularity it generates (e.g. 'S5' to get new candles every 5 seconds)
+        history: Complete candles available when the server starts
+        latency: Seconds every response is delayed by, to make request concurrency visible
+        publish_delay: Seconds after a candle closes before it is served as complete
+        ticks: Recorded PRICE messages (dicts, or a JSONL file path) the pricing stream replays, keeping
+            their original spacing divided by replay_speed; each is re-stamped with the current time
+        tick_interval: Seconds between generated ticks when no recording is given
+        heartbeat_interval: Seconds between stream HEARTBEAT messages
+        stream_drop_after: Close each stream connection after this many messages (to test reconnects)
+        balance: Starting account balance
+        port: 0 picks a free port
+    """
+
+    def __init__(self, instruments=('EUR_USD', 'GBP_USD', 'USD_JPY'), granularity='M5', history=500,
+                 latency=0.0, balance=1000.0, account_id='101-000-0000000-001', host='127.0.0.1', port=0,
+                 seed=0, publish_delay=0.0, ticks=None, replay_speed=1.0, tick_interval=0.25,
+                 heartbeat_interval=5.0, stream_drop_after=None):
+        self.granularity = granularity
+        self.period = GRANULARITY_SECONDS[granularity]
+        self.latency = latency
+        self.publish_delay = publish_delay
+        if isinstance(ticks, str):
+            with open(ticks, encoding='utf-8') as file:
+                ticks = [json.loads(line) for line in file if line.strip()]
+        self.ticks = ticks
+        self.replay_speed = replay_speed
+        self.tick_interval = tick_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.stream_drop_after = stream_drop_after
+        self.balance = balance
+        self.account_id = account_id
+        self.lock = threading.Lock()
+        rng = random.Random(seed)
+        self.markets = {name: _Market(name, self.period, history, random.Random(rng.random()))
+                        for name in instruments}
+        self.positions = {}     # instrument -> net units
+        self.orders = []        # order request bodies, in arrival order
+        self.request_log = []   # (method, path, query) of every request, for inspecting traffic
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server._handle(self, 'GET')
+
+            def do_POST(self):
+                server._handle(self, 'POST')
+
+        self.httpd = _HTTPServer((host, port), Handler)
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # --- Request handling ---
+    def _routes(self):
+        account = re.escape(self.account_id)
+        return [
+            ('GET', re.compile(r'^/v3/instruments/(?P<instrument>\w+)/candles$'), self._candles),
+            ('GET', re.compile(rf'^/v3/accounts/{account}/pricing$'), self._pricing),
+            ('GET', re.compile(rf'^/v3/accounts/{account}$'), self._details),
+            ('GET', re.compile(rf'^/v3/accounts/{account}/summary$'), self._summary),
+            ('GET', re.compile(rf'^/v3/accounts/{account}/openPositions$'), self._open_positions),
+            ('POST', re.compile(rf'^/v3/accounts/{account}/orders$'), self._create_order),
+        ]
+
+    def _handle(self, handler, method):
+        parsed = urlparse(handler.path)
+        query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        body = None
+        if method == 'POST':
+            length = int(handler.headers.get('Content-Length') or 0)
+            body = json.loads(handler.rfile.read(length) or b'{}')
+        with self.lock:
+            self.request_log.append((method, parsed.path, query))
+        if self.latency:
+            time.sleep(self.latency)
+
+        if method == 'GET' and parsed.path == f'/v3/accounts/{self.account_id}/pricing/stream':
+            self._stream(handler, query['instruments'].split(','))
+            return
+
+        for route_method, pattern, view in self._routes():
+            match = pattern.match(parsed.path)
+            if route_method == method and match:
+                try:
+                    with self.lock:
+                        now = time.time() - self.publish_delay
+                        for market in self.markets.values():
+                            market.catch_up(now)
+                        status, payload = view(query=query, body=body, **match.groupdict())
+                except (KeyError, ValueError) as e:
+                    status, payload = 400, {'errorMessage': f'Invalid request: {e}'}
+                break
+        else:
+            status, payload = 404, {'errorMessage': f'No fake route for {method} {parsed.path}'}
+
+        data = json.dumps(payload).encode('utf-8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def _candles(self, query, body, instrument):
+        if query.get('granularity', 'S5') != self.granularity:
+            raise ValueError(f"this server only generates {self.granularity} candles")
+        market = self.markets[instrument]
+        count = int(query.get('count', 500))
+        rows = market.candles
+        if 'from' in query:
+            start = parse_time(query['from'])
+            rows = [c for c in rows if c[0] >= start][:count]
+            include_forming = len(rows) < count
+        else:
+            rows = rows[-(count - 1):] if count > 1 else []
+            include_forming = True
+
+        def to_json(candle, complete):
+            start, open_, high, low, close = candle
+            mid = {'o': f'{open_:.{market.decimals}f}', 'h': f'{high:.{market.decimals}f}',
+                   'l': f'{low:.{market.decimals}f}', 'c': f'{close:.{market.decimals}f}'}
+            return {'complete': complete, 'volume': 1, 'time': format_time(start), 'mid': mid}
+
+        candles = [to_json(c, True) for c in rows]
+        if include_forming:
+            candles.append(to_json(market.forming(), False))
+        return 200, {'instrument': instrument, 'granularity': self.granularity, 'candles': candles}
+
+    def _pricing(self, query, body):
+        prices = [self._price_message(instrument) for instrument in query['instruments'].split(',')]
+        return 200, {'prices': prices, 'time': format_time(time.time())}
+
+    def _price_message(self, instrument):
+        bid, ask = self.markets[instrument].quote()
+        return {'type': 'PRICE', 'instrument': instrument, 'time': format_time(time.time()), 'tradeable': True,
+                'bids': [{'price': str(bid), 'liquidity': 10000000}],
+                'asks': [{'price': str(ask), 'liquidity': 10000000}]}
+
+    def _tick_source(self, instruments):
+        """(delay before sending, message) pairs for one stream connection"""
+        if self.ticks is not None:
+            recorded = [tick for tick in self.ticks if tick.get('instrument') in instruments]
+            previous = None
+            for tick in recorded:
+                moment = parse_time(tick['time'])
+                delay = 0.0 if previous is None else max(0.0, moment - previous) / self.replay_speed
+                previous = moment
+                yield delay, dict(tick, time=format_time(time.time() + delay))
+            return
+        for instrument in instruments:
+            self.markets[instrument]  # unknown instruments fail before the stream starts
+        while True:
+            with self.lock:
+                for market in self.markets.values():
+                    market.catch_up(time.time() - self.publish_delay)
+            for instrument in instruments:
+                yield 0.0, self._price_message(instrument)
+            yield self.tick_interval, None
+
+    def _stream(self, handler, instruments):
+        unknown = [i for i in instruments if i not in self.markets and self.ticks is None]
+        if unknown:
+            data = json.dumps({'errorMessage': f'Invalid instruments: {unknown}'}).encode('utf-8')
+            handler.send_response(400)
+            handler.send_header('Content-Length', str(len(data)))
+            handler.end_headers()
+            handler.wfile.write(data)
+            return
+
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'application/octet-stream')
+        handler.send_header('Connection', 'close')
+        handler.end_headers()
+        handler.close_connection = True
+
+        def send(message):
+            handler.wfile.write(json.dumps(message).encode('utf-8') + b'\n')
+            handler.wfile.flush()
+
+        sent = 0
+        next_heartbeat = time.time()
+        try:
+            for delay, message in self._tick_source(instruments):
+                wake = time.time() + delay
+                while True:
+                    if time.time() >= next_heartbeat:
+                        send({'type': 'HEARTBEAT', 'time': format_time(time.time())})
+                        next_heartbeat = time.time() + self.heartbeat_interval
+                    remaining = wake - time.time()
+                    if remaining <= 0:
+                        break
+                    time.sleep(min(remaining, max(0.0, next_heartbeat - time.time())))
+                if message is not None:
+                    send(message)
+                    sent += 1
+                if self.stream_drop_after is not None and sent >= self.stream_drop_after:
+                    return
+            # recording exhausted: keep the connection alive on heartbeats until the client leaves
+            while True:
+                time.sleep(max(0.0, next_heartbeat - time.time()))
+                send({'type': 'HEARTBEAT', 'time': format_time(time.time())})
+                next_heartbeat = time.time() + self.heartbeat_interval
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _summary(self, query, body):
+        return 200, {'account': {'id': self.account_id, 'currency': 'GBP', 'balance': f'{self.balance:.4f}',
+                                 'openPositionCount': sum(1 for units in self.positions.values() if units)},
+                     'lastTransactionID': str(len(self.orders))}
+
+    def _positions(self, open_only):
+        return [{'instrument': instrument,
+                 'long': {'units': str(max(units, 0))},
+                 'short': {'units': str(min(units, 0))}}
+                for instrument, units in self.positions.items() if units or not open_only]
+
+    def _details(self, query, body):
+        status, payload = self._summary(query, body)
+        payload['account']['positions'] = self._positions(open_only=False)
+        return status, payload
+
+    def _open_positions(self, query, body):
+        return 200, {'positions': self._positions(open_only=True), 'lastTransactionID': str(len(self.orders))}
+
+    def _create_order(self, query, body):
+        order = body['order']
+        instrument, units = order['instrument'], int(order['units'])
+        bid, ask = self.markets[instrument].quote()
+        self.orders.append(order)
+        self.positions[instrument] = self.positions.get(instrument, 0) + units
+        fill = {'id': str(len(self.orders)), 'type': 'ORDER_FILL', 'instrument': instrument, 'units': str(units),
+                'price': str(ask if units > 0 else bid), 'pl': '0.0000', 'time': format_time(time.time())}
+        return 201, {'orderCreateTransaction': {'id': fill['id'], 'type': 'MARKET_ORDER', **order},
+                     'orderFillTransaction': fill, 'lastTransactionID': fill['id']}
+
+
+if __name__ == "__main__":
+    # python -m broker.fake_oanda
+    with FakeOandaServer(granularity='S5') as fake:
+        print(f'Fake OANDA API on {fake.url}, account {fake.account_id}. Ctrl+C to stop.')
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
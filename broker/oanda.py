@@ -1,36 +1,191 @@
 from oandapyV20 import API
+from oandapyV20.oandapyV20 import TRADING_ENVIRONMENTS
+from requests.adapters import HTTPAdapter
 import time
 import oandapyV20.endpoints.accounts as accounts
 import oandapyV20.endpoints.orders as orders
 import oandapyV20.endpoints.pricing as pricing
 import oandapyV20.endpoints.instruments as instruments
-import oandapyV20.endpoints.positions as positions
-from datetime import datetime
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from itertools import islice
+
+from broker.price_stream import PriceStream
+
+# Candle length in seconds per OANDA granularity
+GRANULARITY_SECONDS = {
+    'S5': 5, 'S10': 10, 'S15': 15, 'S30': 30,
+    'M1': 60, 'M2': 120, 'M4': 240, 'M5': 300, 'M10': 600, 'M15': 900, 'M30': 1800,
+    'H1': 3600, 'H2': 7200, 'H3': 10800, 'H4': 14400, 'H6': 21600, 'H8': 28800, 'H12': 43200,
+    'D': 86400,
+}
+
+
+def parse_time(value):
+    """OANDA RFC3339 time string (or epoch seconds) -> epoch seconds"""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    date, _, fraction = value.rstrip('Z').partition('.')
+    moment = datetime.strptime(date, '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc)
+    return moment.timestamp() + (float('0.' + fraction) if fraction else 0.0)
+
+
+class CandleBuffer:
+    """
+    Ring buffer of the last `capacity` complete candles of one instrument/granularity, oldest first.
+
+    Candles are the dicts get_candles returns. New candles are appended in place, so a consumer that
+    remembers the last time it saw can read just the newer ones with since() instead of copying the
+    whole window.
+    """
+
+    def __init__(self, capacity):
+        self.candles = deque(maxlen=capacity)
+
+    def __len__(self):
+        return len(self.candles)
+
+    def __iter__(self):
+        return iter(self.candles)
+
+    @property
+    def capacity(self):
+        return self.candles.maxlen
+
+    @property
+    def last_time(self):
+        return self.candles[-1]["time"] if self.candles else None
+
+    def extend(self, candles):
+        """Append the candles newer than the last one held. Returns how many were added"""
+        last_time = self.last_time
+        added = 0
+        for candle in candles:
+            if last_time is None or candle["time"] > last_time:
+                self.candles.append(candle)
+                last_time = candle["time"]
+                added += 1
+        return added
+
+    def tail(self, count):
+        return list(islice(self.candles, max(0, len(self.candles) - count), None))
+
+    def since(self, time_after):
+        """Candles newer than time_after (all of them if None), oldest first"""
+        if time_after is None:
+            return list(self.candles)
+        newer = []
+        for candle in reversed(self.candles):
+            if candle["time"] <= time_after:
+                break
+            newer.append(candle)
+        newer.reverse()
+        return newer
 
 
 class OandaClient:
-    def __init__(self, api_key, account_id):
-        self.client = API(access_token=api_key)
+    def __init__(self, api_key, account_id, environment="practice", api_url=None, stream_url=None,
+                 candle_buffer_size=500, pool_size=10, account_cache_ttl=5.0):
+        # api_url/stream_url point the client at another server, e.g. broker/fake_oanda.py
+        if api_url:
+            environment = f"custom:{api_url}"
+            TRADING_ENVIRONMENTS[environment] = {"api": api_url, "stream": stream_url or api_url}
+        self.client = API(access_token=api_key, environment=environment)
         self.account_id = account_id
+        self.pool_size = 0
+        self.configure_pool(pool_size)
+        # (instrument, granularity) -> CandleBuffer, refreshed incrementally by update_candles
+        self.candle_buffer_size = candle_buffer_size
+        self._candle_buffers = {}
+        self._candle_locks = {}
+        # Account details (balance and positions come from the same request), reused for
+        # account_cache_ttl seconds and dropped whenever one of our orders fills
+        self.account_cache_ttl = account_cache_ttl
+        self._account_cache = {}
+        self._account_cache_lock = threading.Lock()
+        self.price_stream = None
 
-    def get_balance(self):
-        r = accounts.AccountSummary(accountID=self.account_id)
+    def configure_pool(self, pool_size):
+        """
+        Size the keep-alive connection pool of the client's requests session. Every request reuses
+        an open connection; threads beyond pool_size would otherwise open and drop their own.
+        """
+        if pool_size <= self.pool_size:
+            return
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.client.client.mount("https://", adapter)
+        self.client.client.mount("http://", adapter)
+        self.pool_size = pool_size
+
+    def _cached(self, name, fetch):
+        now = time.monotonic()
+        with self._account_cache_lock:
+            entry = self._account_cache.get(name)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+        value = fetch()
+        with self._account_cache_lock:
+            self._account_cache[name] = (now + self.account_cache_ttl, value)
+        return value
+
+    def invalidate_account_cache(self):
+        with self._account_cache_lock:
+            self._account_cache.clear()
+
+    def _request_account(self):
+        r = accounts.AccountDetails(accountID=self.account_id)
         self.client.request(r)
-        return float(r.response['account']['balance'])
+        return r.response['account']
 
-    def get_price(self, instrument):
-        params = {"instruments": instrument}
+    def get_balance(self):
+        return float(self._cached("account", self._request_account)['balance'])
+
+    def start_price_stream(self, instrument_list, **kwargs):
+        """
+        Subscribe to the pricing stream in a background thread. While it is healthy, get_price and
+        get_prices answer from its in-memory quotes instead of a PricingInfo request.
+        kwargs go to PriceStream.
+        """
+        self.stop_price_stream()
+        self.price_stream = PriceStream(self, instrument_list, **kwargs).start()
+        return self.price_stream
+
+    def stop_price_stream(self):
+        if self.price_stream is not None:
+            self.price_stream.stop()
+            self.price_stream = None
+
+    def get_prices(self, instrument_list):
+        """Latest bid/ask/time for several instruments, from the price stream or one PricingInfo request"""
+        prices = {}
+        stream = self.price_stream
+        if stream is not None and stream.healthy:
+            for instrument in instrument_list:
+                quote = stream.quote(instrument)
+                if quote is not None:
+                    prices[instrument] = {"bid": quote["bid"], "ask": quote["ask"], "time": quote["time"]}
+        missing = [instrument for instrument in instrument_list if instrument not in prices]
+        if not missing:
+            return prices
+
+        params = {"instruments": ",".join(missing)}
         r = pricing.PricingInfo(accountID=self.account_id, params=params)
         self.client.request(r)
-        price_data = r.response['prices'][0]
-        return {
-            "bid": float(price_data['bids'][0]['price']),
-            "ask": float(price_data['asks'][0]['price']),
-            "time": price_data['time']
-        }
+        for price_data in r.response['prices']:
+            prices[price_data['instrument']] = {
+                "bid": float(price_data['bids'][0]['price']),
+                "ask": float(price_data['asks'][0]['price']),
+                "time": price_data['time']
+            }
+        return prices
 
-    def get_candles(self, instrument, count=200, granularity="M5"):
-        params = {"count": count, "granularity": granularity, "price": "M"}
+    def get_price(self, instrument):
+        return self.get_prices([instrument])[instrument]
+
+    def _request_candles(self, instrument, params):
         r = instruments.InstrumentsCandles(instrument=instrument, params=params)
         self.client.request(r)
         candles = r.response["candles"]
@@ -43,20 +198,56 @@ class OandaClient:
             "complete": c["complete"]
         } for c in candles if c["complete"]]
 
+    def update_candles(self, instrument, granularity="M5", count=200):
+        """
+        Bring the instrument's CandleBuffer up to date and return it.
+
+        The first call (or one after a gap longer than the buffer) downloads `count` candles. After
+        that only the candles from the last complete one onwards are requested, using `from`, so a
+        call usually transfers two or three bars instead of the whole window.
+        """
+        key = (instrument, granularity)
+        lock = self._candle_locks.setdefault(key, threading.Lock())
+        with lock:
+            buffer = self._candle_buffers.get(key)
+            if buffer is not None and buffer.capacity >= count and len(buffer):
+                missed = (time.time() - parse_time(buffer.last_time)) / GRANULARITY_SECONDS[granularity]
+                if missed < buffer.capacity:
+                    params = {"from": buffer.last_time, "granularity": granularity, "price": "M"}
+                    buffer.extend(self._request_candles(instrument, params))
+                    return buffer
+
+            buffer = CandleBuffer(max(count, self.candle_buffer_size))
+            params = {"count": count, "granularity": granularity, "price": "M"}
+            buffer.extend(self._request_candles(instrument, params))
+            self._candle_buffers[key] = buffer
+            return buffer
+
+    def candle_buffer(self, instrument, granularity="M5"):
+        return self._candle_buffers.get((instrument, granularity))
+
+    def get_candles(self, instrument, count=200, granularity="M5", use_cache=True):
+        if not use_cache:
+            params = {"count": count, "granularity": granularity, "price": "M"}
+            return self._request_candles(instrument, params)
+        return self.update_candles(instrument, granularity, count).tail(count)
+
     def calculate_units(self, amount_gbp, instrument="EUR_USD"):
-        # Get current GBP/USD and instrument price
-        instrument_price = self.get_price(instrument)["ask"]
-        gbpusd_price = self.get_price("GBP_USD")["bid"]
+        # Get current GBP/USD and instrument price in one request
+        prices = self.get_prices([instrument, "GBP_USD"] if instrument != "GBP_USD" else [instrument])
+        instrument_price = prices[instrument]["ask"]
+        gbpusd_price = prices["GBP_USD"]["bid"]
 
         amount_usd = amount_gbp * gbpusd_price
         units = int(amount_usd / instrument_price)
         return units
 
     def get_open_positions(self):
-        r = positions.OpenPositions(accountID=self.account_id)
-        self.client.request(r)
-        positions_data = r.response.get("positions", [])
-        return {p["instrument"]: int(p["long"]["units"]) - int(p["short"]["units"]) for p in positions_data}
+        # Account details list every instrument ever traded; only those with units are open.
+        # Short units are reported negative, so the net position is long + short
+        positions_data = self._cached("account", self._request_account).get("positions", [])
+        return {p["instrument"]: int(p["long"]["units"]) + int(p["short"]["units"])
+                for p in positions_data if int(p["long"]["units"]) or int(p["short"]["units"])}
 
     def has_open_position(self, instrument):
         open_positions = self.get_open_positions()
@@ -96,7 +287,11 @@ class OandaClient:
             }
 
         r = orders.OrderCreate(accountID=self.account_id, data=order_data)
-        self.client.request(r)
+        try:
+            self.client.request(r)
+        finally:
+            # balance and positions change on a fill (and are unknown if the request failed)
+            self.invalidate_account_cache()
         response = r.response
 
         fill = response.get("orderFillTransaction", {})
@@ -117,7 +312,10 @@ class OandaClient:
 # Features:
 # get_balance()	Returns account balance in GBP
 # get_price(instrument)	Returns latest bid/ask/time for given pair
+# get_prices(instruments)	Latest bid/ask/time for several pairs in one request
+# start_price_stream(...)	Keeps quotes in memory from the pricing stream; get_price(s) then reads them
 # get_candles(...)	Returns historical candles for indicator calculation
+# update_candles(...)	Incrementally refreshes and returns the per-instrument CandleBuffer
 # calculate_units(...)	Converts £300 to correct number of units
 # get_open_positions()	Returns dictionary of open positions
 # has_open_position()	Boolean — is there a live trade on this instrument?
@@ -0,0 +1,127 @@
+import json
+import threading
+import time
+
+import requests
+from oandapyV20 import API
+from oandapyV20.exceptions import StreamTerminated, V20Error
+import oandapyV20.endpoints.pricing as pricing
+
+
+class PriceStream:
+    """
+    Background consumer of OANDA's pricing stream, keeping the latest bid/ask per instrument in memory.
+
+    Readers never take a lock: every tick replaces the instrument's quote dict as a whole, so a
+    quote() call always sees one complete quote. OANDA sends a heartbeat every 5 seconds; if nothing
+    arrives for heartbeat_timeout seconds the connection is treated as dead and reopened, with the
+    delay between attempts doubling up to max_reconnect_delay.
+
+    Args:
+        client: OandaClient whose account, token and server the stream uses
+        instrument_list: Instruments to subscribe to
+        heartbeat_timeout: Seconds of silence before reconnecting
+        record_path: Optional JSONL file every received PRICE message is appended to (for replaying
+            through broker/fake_oanda.py)
+    """
+
+    def __init__(self, client, instrument_list, heartbeat_timeout=10.0, reconnect_delay=1.0,
+                 max_reconnect_delay=30.0, record_path=None):
+        self.client = client
+        self.instruments = list(instrument_list)
+        self.heartbeat_timeout = heartbeat_timeout
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.record_path = record_path
+
+        self.quotes = {}            # instrument -> {'bid', 'ask', 'time', 'received'}
+        self.last_message = None    # time.time() of the last price or heartbeat
+        self.last_heartbeat = None
+        self.connected = False
+        self.reconnects = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='oanda-price-stream', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Stop the stream. The thread exits at its next message or read timeout"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout if timeout is not None else self.heartbeat_timeout + 1)
+
+    def quote(self, instrument, max_age=None):
+        """Latest quote for instrument, or None if there is none (or it is older than max_age seconds)"""
+        quote = self.quotes.get(instrument)
+        if quote is None or (max_age is not None and time.time() - quote['received'] > max_age):
+            return None
+        return quote
+
+    @property
+    def healthy(self):
+        """Connected and heard from within heartbeat_timeout"""
+        return (self.connected and self.last_message is not None
+                and time.time() - self.last_message < self.heartbeat_timeout)
+
+    def wait_until_ready(self, timeout=10.0):
+        """Block until every instrument has a quote. Returns whether they all did"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if all(instrument in self.quotes for instrument in self.instruments):
+                return True
+            time.sleep(0.01)
+        return False
+
+    def _handle(self, message, record_file):
+        now = time.time()
+        self.last_message = now
+        if message.get('type') == 'HEARTBEAT':
+            self.last_heartbeat = now
+        elif message.get('type') == 'PRICE' and message.get('bids') and message.get('asks'):
+            self.quotes[message['instrument']] = {
+                'bid': float(message['bids'][0]['price']),
+                'ask': float(message['asks'][0]['price']),
+                'time': message['time'],
+                'received': now,
+            }
+            if record_file is not None:
+                record_file.write(json.dumps(message) + '\n')
+
+    def _run(self):
+        api_client = self.client.client
+        delay = self.reconnect_delay
+        record_file = open(self.record_path, 'a', encoding='utf-8') if self.record_path else None
+        try:
+            while not self._stop.is_set():
+                # Own session: the read timeout doubles as the heartbeat watchdog
+                api = API(access_token=api_client.access_token, environment=api_client.environment,
+                          request_params={'timeout': (5, self.heartbeat_timeout)})
+                r = pricing.PricingStream(accountID=self.client.account_id,
+                                          params={'instruments': ','.join(self.instruments)})
+                try:
+                    for message in api.request(r):
+                        if not self.connected:
+                            self.connected = True
+                            delay = self.reconnect_delay
+                        self._handle(message, record_file)
+                        if self._stop.is_set():
+                            r.terminate('stopped')
+                except (requests.exceptions.RequestException, V20Error, StreamTerminated, ValueError) as e:
+                    if not self._stop.is_set():
+                        print(f"Price stream error: {e!r}")
+                finally:
+                    self.connected = False
+                    api.close()
+
+                if not self._stop.is_set():
+                    self.reconnects += 1
+                    print(f"Price stream disconnected, reconnecting in {delay:.1f}s")
+                    self._stop.wait(delay)
+                    delay = min(delay * 2, self.max_reconnect_delay)
+        finally:
+            if record_file is not None:
+                record_file.close()
@@ -0,0 +1,212 @@
+import asyncio
+import time
+
+import requests
+from oandapyV20.exceptions import V20Error
+
+from backtest import instrumentation
+from backtest.indicators import StreamingIndicators
+from backtest.strategy_registry import get_strategy
+from backtest.timeframes import MultiTimeframe, base_candles_needed
+from broker.oanda import GRANULARITY_SECONDS, parse_time
+from scheduler import CycleMetrics, CycleTiming, next_candle_close, sleep_until
+
+# asyncio runtime for the live bot. Every instrument runs in its own task that wakes just after each
+# candle close, polls until the new complete candle is available, and evaluates the strategies once.
+# A slow or failing instrument does not hold up the others, and the time from candle close to order
+# stays roughly the same whether the bot trades 3 pairs or 30.
+
+# Most candles one OANDA candles request returns
+MAX_CANDLES_PER_REQUEST = 5000
+
+
+def feed_indicators(indicators, candle_data):
+    # Only candles newer than the last one fed advance the indicators
+    last_time = indicators.recent[-1]['time'] if indicators.recent else None
+    for candle in candle_data:
+        if last_time is None or candle['time'] > last_time:
+            indicators.update(candle)
+
+
+async def fetch_new_candles(client, instrument, indicators, granularity='M5', lookback=200):
+    """
+    Complete candles newer than the last one fed to `indicators`.
+
+    The client keeps a candle buffer per instrument that it refreshes with only the bars since its
+    last complete candle; the new candles are read straight off the end of that buffer.
+    """
+    last_time = indicators.recent[-1]['time'] if indicators.recent else None
+    with instrumentation.span('get_candles'):
+        buffer = await client.update_candles(instrument, granularity=granularity, count=lookback)
+    return buffer.since(last_time)
+
+
+async def place_order(client, signal, risk_percent):
+    """Size a signal from the account balance and its stop distance, then send it. Returns the fill or None"""
+    instrument = signal['instrument']
+    with instrumentation.span('get_price'):  # price and balance are fetched together
+        current_price, balance = await asyncio.gather(client.get_price(instrument), client.get_balance())
+    if signal['action'] == 'buy':
+        current_price_actual = current_price['ask']
+    else:
+        current_price_actual = current_price['bid']
+    if balance - 300 < 0:
+        print(f'Balance {balance} too low to trade {instrument}')
+        return None
+
+    sl_distance = abs(signal['stop_loss'] - current_price_actual)
+    sl_pips = sl_distance / 0.0001
+    risk_gbp = balance * (risk_percent / 100)
+    signal['risk'] = risk_gbp
+    signal['units'] = int(risk_gbp / (sl_pips * 0.0001))
+    with instrumentation.span('execute_trade'):
+        trade = await client.execute_trade(signal)
+    print(trade)
+    return trade
+
+
+async def act_on_signals(client, instrument, strategy_specs, indicators, risk_percent, timing=None, timeframes=None):
+    """
+    Evaluate every strategy on the instrument's indicators and place an order for each signal.
+    Strategies registered with higher timeframes are also given `timeframes` (a MultiTimeframe).
+
+    Returns:
+        List of (strategy name, signal, trade or None)
+    """
+    with instrumentation.span('strategy.run'):
+        signals = []
+        for spec in strategy_specs:
+            if spec.timeframes:
+                signals.append((spec, spec.load().run_streaming(indicators, instrument, timeframes=timeframes)))
+            else:
+                signals.append((spec, spec.load().run_streaming(indicators, instrument)))
+    if timing is not None:
+        timing.signalled = time.time()
+
+    results = []
+    for spec, signal in signals:
+        print(signal)
+        trade = None
+        if signal['action'] != 'hold':
+            trade = await place_order(client, signal, risk_percent)
+            if timing is not None:
+                timing.ordered = time.time()
+        else:
+            print(f'Hold {instrument}')
+        results.append((spec.name, signal, trade))
+    return results
+
+
+async def run_instrument(client, instrument, strategy_specs, risk_percent, lookback=200, granularity='M5',
+                         metrics=None, cycles=None, settle=0.5, poll_interval=1.0, prometheus_path=None):
+    """
+    Candle-close loop for one instrument.
+
+    Args:
+        settle: Seconds after the candle boundary before the first poll
+        poll_interval: Seconds between polls while the new candle has not appeared yet. Polling gives
+            up at the next boundary (e.g. when the market is closed)
+        metrics: CycleMetrics every completed cycle is recorded in
+        cycles: Stop after this many candle boundaries (None runs forever)
+        prometheus_path: with instrumentation enabled, the span histograms are rewritten there after
+            every cycle (for the node exporter textfile collector)
+    """
+    indicators = StreamingIndicators(window=lookback, ema_spans=(9, 25))
+    period = GRANULARITY_SECONDS[granularity]
+
+    # Higher timeframes the strategies read are built from the same candles, so the history fetched
+    # has to cover the bars they need
+    needed = {}
+    for spec in strategy_specs:
+        for timeframe, bars in spec.timeframes.items():
+            needed[timeframe] = max(needed.get(timeframe, 0), bars)
+    timeframes = None
+    history = lookback
+    if needed:
+        timeframes = MultiTimeframe(granularity, needed, max_bars=max(needed.values()))
+        history = max(lookback, base_candles_needed(needed, granularity))
+        if history > MAX_CANDLES_PER_REQUEST:
+            print(f"{instrument}: {needed} needs {history} {granularity} candles of history, "
+                  f"fetching {MAX_CANDLES_PER_REQUEST}")
+            history = MAX_CANDLES_PER_REQUEST
+
+    # Warm up on history without acting on it
+    try:
+        history_candles = await fetch_new_candles(client, instrument, indicators, granularity, history)
+        feed_indicators(indicators, history_candles)
+        if timeframes is not None:
+            timeframes.update(history_candles)
+    except (requests.exceptions.RequestException, V20Error) as e:
+        print(f"Failed to load history for {instrument}, retrying at the next candle: {e}")
+
+    cycle = 0
+    while cycles is None or cycle < cycles:
+        candle_close = next_candle_close(time.time(), granularity)
+        await sleep_until(candle_close + settle)
+        cycle += 1
+        timing = CycleTiming(instrument, candle_close)
+        try:
+            # Poll until the candle that just closed is served (older unseen candles alone are not enough)
+            new_candles = []
+            while True:
+                timing.polls += 1
+                try:
+                    new_candles = await fetch_new_candles(client, instrument, indicators, granularity,
+                                                          history) or new_candles
+                except (requests.exceptions.RequestException, V20Error) as e:
+                    print(f"Failed to fetch candles for {instrument}: {e}")
+                if new_candles and parse_time(new_candles[-1]['time']) >= candle_close - period:
+                    break
+                if time.time() + poll_interval >= candle_close + period:
+                    break
+                await asyncio.sleep(poll_interval)
+            if not new_candles:
+                print(f'No new {granularity} candle for {instrument} after {timing.polls} polls')
+                continue
+
+            timing.fetched = time.time()
+            timing.candle_time = new_candles[-1]['time']
+            with instrumentation.span('indicator.update'):
+                feed_indicators(indicators, new_candles)
+                if timeframes is not None:
+                    timeframes.update(new_candles)
+            await act_on_signals(client, instrument, strategy_specs, indicators, risk_percent, timing, timeframes)
+        except Exception as e:
+            print(f"Error while evaluating {instrument}: {e!r}")
+            continue
+
+        if metrics is not None:
+            metrics.record(timing)
+        print(f'Cycle timing: {timing.to_dict()}')
+        if prometheus_path and instrumentation.is_enabled():
+            instrumentation.write_prometheus(prometheus_path, metric='bot_span_seconds')
+
+
+async def run_bot(client, instruments, strategies, risk_percent, lookback=200, granularity='M5',
+                  metrics=None, cycles=None, settle=0.5, poll_interval=1.0, prometheus_path=None):
+    """
+    Live trading loop: one candle-close task per instrument.
+
+    Args:
+        client: AsyncOandaClient
+        strategies: Registered strategy names (see backtest/strategy_registry.py)
+        lookback: Candles each instrument's indicators are computed over
+        metrics: CycleMetrics to record per-cycle timings in (a new one is created if None)
+        cycles, settle, poll_interval, prometheus_path: see run_instrument
+
+    Returns:
+        The CycleMetrics (when cycles is set and the loops finish)
+    """
+    print('Running bot...')
+    # Only the strategies this bot trades are imported, and before the first candle so its
+    # decision does not pay for the import
+    strategy_specs = [get_strategy(strategy) for strategy in strategies]
+    for spec in strategy_specs:
+        spec.load()
+    metrics = metrics if metrics is not None else CycleMetrics()
+    await asyncio.gather(*(
+        run_instrument(client, instrument, strategy_specs, risk_percent, lookback, granularity,
+                       metrics, cycles, settle, poll_interval, prometheus_path)
+        for instrument in instruments
+    ))
+    return metrics
@@ -1,9 +1,11 @@
 import os
+import asyncio
 from dotenv import load_dotenv
-import time
-import requests
 from broker import oanda
-from strategies import EMA_CROSS_9_25_bot 
+from broker.async_oanda import AsyncOandaClient
+from backtest import instrumentation
+from live_runtime import run_bot
+from scheduler import CycleMetrics
 
 risk_percent = 1
 
@@ -13,52 +15,20 @@ ACCOUNT_ID = os.getenv("OANDA_ACCOUNT_ID")
 
 client = oanda.OandaClient(API_KEY, ACCOUNT_ID)
 
-def trading_bot(instruments, strategies, risk_percent):
-    print('Running bot...')
-
-    while True:
-        for instrument in instruments:
-            print(f'Current instrument: {instrument}')
-            for attempt in range(3):
-                print('Attempting to collect candles...')
-                try:
-                    candle_data = client.get_candles(instrument)
-                    break
-                except requests.exceptions.RequestException as e:
-                    print(f"Attempt {attempt+1} failed while fetching candles for {instrument}: {e}")
-                    time.sleep(5)
-            else:
-                print(f"Skipping {instrument} after 3 failed attempts to fetch candles.")
-                continue
-
-            
-            for strategy in strategies:
-                if strategy == 'EMA_CROSS_9_25':
-                    signal = EMA_CROSS_9_25_bot.run(candle_data, instrument)
-                    print(signal)
-                    if signal['action'] != 'hold':
-                        current_price = client.get_price(instrument)
-                        if signal['action'] == 'buy':
-                            current_price_actual = current_price['ask']
-                        else:
-                            current_price_actual = current_price['bid']
-                        sl_distance = abs(signal['stop_loss'] - current_price_actual)
-                        sl_pips = sl_distance / 0.0001
-                        units = int(signal['risk'] / (sl_pips * 0.0001))
-                        balance = client.get_balance()
-                        if (balance - 300 >= 0):
-                            risk_gbp = balance * (risk_percent / 100)
-                            signal['risk'] = risk_gbp
-                            signal['units'] = units
-                            trade = client.execute_trade(signal)
-                        print(trade)
-                    else:
-                        print('Hold')
-
-        for i in range(60):
-            if i % 10 == 0:
-                print(f'Waiting for new candles\nTime passed: {i} Seconds')
-            time.sleep(1)
+def trading_bot(instruments, strategies, risk_percent, lookback=200, granularity='M5'):
+    async_client = AsyncOandaClient(client)
+    metrics = CycleMetrics()
+    # Quotes for order sizing come from the pricing stream instead of a request per order
+    client.start_price_stream(instruments)
+    try:
+        asyncio.run(run_bot(async_client, instruments, strategies, risk_percent, lookback, granularity, metrics,
+                            prometheus_path=os.getenv("BOT_PROMETHEUS_PATH")))
+    finally:
+        async_client.close()
+        client.stop_price_stream()
+        print(f'Candle close -> order timings (seconds): {metrics.summary()}')
+        if instrumentation.is_enabled():
+            instrumentation.write_json('bot_spans.json')
 
 instruments = ['EUR_USD', 'GBP_USD', 'USD_JPY']
 strategies = ['EMA_CROSS_9_25']
@@ -0,0 +1,97 @@
+import asyncio
+import statistics
+import time
+from collections import deque
+
+from broker.oanda import GRANULARITY_SECONDS
+
+# Candle-close timing for the live bot: wake just after each candle boundary instead of polling
+# on a fixed interval, and record how long each step from candle close to order took.
+
+
+def next_candle_close(now, granularity):
+    """Epoch seconds of the first candle boundary after `now`"""
+    period = GRANULARITY_SECONDS[granularity]
+    return (now // period + 1) * period
+
+
+async def sleep_until(moment):
+    delay = moment - time.time()
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+class CycleTiming:
+    """
+    Timestamps (epoch seconds) of one candle cycle for one instrument.
+
+    candle_close -> fetched: the new complete candle was received
+    fetched -> signalled: indicators advanced and every strategy evaluated
+    signalled -> ordered: orders sent (None when every strategy held)
+    """
+
+    __slots__ = ('instrument', 'candle_time', 'candle_close', 'fetched', 'signalled', 'ordered', 'polls')
+
+    def __init__(self, instrument, candle_close):
+        self.instrument = instrument
+        self.candle_close = candle_close
+        self.candle_time = None
+        self.fetched = None
+        self.signalled = None
+        self.ordered = None
+        self.polls = 0
+
+    @property
+    def close_to_fetch(self):
+        return self.fetched - self.candle_close
+
+    @property
+    def fetch_to_signal(self):
+        return self.signalled - self.fetched
+
+    @property
+    def signal_to_order(self):
+        return None if self.ordered is None else self.ordered - self.signalled
+
+    @property
+    def close_to_decision(self):
+        return (self.ordered or self.signalled) - self.candle_close
+
+    def to_dict(self):
+        return {
+            'instrument': self.instrument,
+            'candle_time': self.candle_time,
+            'polls': self.polls,
+            'close_to_fetch': round(self.close_to_fetch, 4),
+            'fetch_to_signal': round(self.fetch_to_signal, 4),
+            'signal_to_order': None if self.ordered is None else round(self.signal_to_order, 4),
+            'close_to_decision': round(self.close_to_decision, 4),
+        }
+
+
+class CycleMetrics:
+    """Completed CycleTimings, keeping the most recent `history` of them"""
+
+    STAGES = ('close_to_fetch', 'fetch_to_signal', 'signal_to_order', 'close_to_decision')
+
+    def __init__(self, history=1000):
+        self.cycles = deque(maxlen=history)
+
+    def record(self, timing):
+        self.cycles.append(timing)
+
+    def summary(self):
+        """{stage: {count, mean, p50, p95, max}} over the recorded cycles, in seconds"""
+        result = {}
+        for stage in self.STAGES:
+            values = sorted(v for v in (getattr(c, stage) for c in self.cycles) if v is not None)
+            if not values:
+                continue
+            result[stage] = {
+                'count': len(values),
+                'mean': round(statistics.fmean(values), 4),
+                'p50': round(values[len(values) // 2], 4),
+                'p95': round(values[min(len(values) - 1, int(len(values) * 0.95))], 4),
+                'max': round(values[-1], 4),
+            }
+        return result
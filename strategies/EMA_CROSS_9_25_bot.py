@@ -49,4 +49,41 @@ def run(candles, instrument="EUR_USD"):
         }
 
     else:
-        return {"instrument": instrument, "action": "hold", "risk_gbp": 300}
\ No newline at end of file
+        return {"instrument": instrument, "action": "hold", "risk_gbp": 300}
+
+def run_streaming(indicators, instrument="EUR_USD"):
+    """Same as run(), read from a StreamingIndicators fed with every candle so far"""
+    if indicators.window_length < 26:
+        return {"instrument": instrument, "action": "hold"}
+
+    prev_ema_9, last_ema_9 = indicators.ema(9, 1), indicators.ema(9)
+    prev_ema_25, last_ema_25 = indicators.ema(25, 1), indicators.ema(25)
+    atr = indicators.atr()
+    last_close = indicators.recent[-1]["close"]
+
+    if prev_ema_9 < prev_ema_25 and last_ema_9 > last_ema_25:
+        # Buy signal
+        sl = last_close - 1.5 * atr
+        tp = last_close + 3 * atr
+        return {
+            "instrument": instrument,
+            "action": "buy",
+            "stop_loss": float(sl),
+            "take_profit": float(tp),
+            'risk': 300
+        }
+
+    elif prev_ema_9 > prev_ema_25 and last_ema_9 < last_ema_25:
+        # Sell signal
+        sl = last_close + 1.5 * atr
+        tp = last_close - 3 * atr
+        return {
+            "instrument": instrument,
+            "action": "sell",
+            "stop_loss": float(sl),
+            "take_profit": float(tp),
+            'risk': 300
+        }
+
+    else:
+        return {"instrument": instrument, "action": "hold", "risk_gbp": 300}